@@ -18,6 +18,10 @@
 
 import wx, math
 import sys
+try :
+    from .GoSyncUsage import *
+except (ImportError, ValueError):
+    from GoSyncUsage import *
 if sys.version_info > (3,):
     long = int
 
@@ -171,6 +175,14 @@ class DriveUsageBox(wx.Panel):
         self.othersPanelWidth = float((float(size) * 100)/self.drive_size_bytes)
         self.legendOthersText.SetLabel('Others ' + self.FileSizeHumanize(size))
 
+    def SetUsageFromSnapshot(self, snapshot):
+        totals = snapshot.CategoryTotals()
+        self.SetAudioUsage(int(totals[CATEGORY_AUDIO]))
+        self.SetMoviesUsage(int(totals[CATEGORY_MOVIES]))
+        self.SetPhotoUsage(int(totals[CATEGORY_PHOTO]))
+        self.SetDocumentUsage(int(totals[CATEGORY_DOCUMENT]))
+        self.SetOthersUsage(int(totals[CATEGORY_OTHERS]))
+
     def RePaint(self):
         panelList = [(self.audioPanel, self.audioPanelWidth, self.audioPanelColor),
                      (self.photoPanel, self.photoPanelWidth, self.photoPanelColor),
@@ -0,0 +1,154 @@
+# gosync is an open source Google Drive(TM) sync application for Linux
+#
+# Copyright (C) 2015 Himanshu Chauhan
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+from apiclient.errors import HttpError
+try :
+    from .GoSyncRequestGate import RequestGate, IsTransient, IsRateLimited, Sleep
+except (ImportError, ValueError):
+    from GoSyncRequestGate import RequestGate, IsTransient, IsRateLimited, Sleep
+
+# Drive accepts at most 100 calls in one batch request
+MAX_BATCH_SIZE = 100
+
+class BatchItem(object):
+    """
+    One call queued in a BatchRequestEngine. After the flush, either
+    'response' or 'error' is set.
+    """
+    __slots__ = ('request', 'callback', 'response', 'error', 'done')
+
+    def __init__(self, request, callback):
+        self.request = request
+        self.callback = callback
+        self.response = None
+        self.error = None
+        self.done = False
+
+    def Result(self):
+        """
+        Return the response of the call, or raise its error.
+        """
+        if self.error is not None:
+            raise self.error
+        return self.response
+
+class BatchRequestEngine(object):
+    """
+    Collects Drive API calls and sends them in batch requests of up to
+    MAX_BATCH_SIZE calls, using the client library's batch support. Each
+    call gets its own result or error back, in its BatchItem and through
+    its callback. Calls failing with a transient error are sent again in
+    a later batch, up to 'retries' times, after the backoff of 'gate'.
+    Every batch request goes through 'gate' too. If the CancelToken
+    'cancel' is given, the backoff ends with SyncCancelled once it is
+    cancelled.
+
+    An engine is not meant to be shared between threads: make one per
+    bulk operation.
+    """
+    def __init__(self, service, batch_size=MAX_BATCH_SIZE, retries=3, gate=None, cancel=None):
+        self.service = service
+        self.cancel = cancel
+        self.batch_size = min(batch_size, MAX_BATCH_SIZE)
+        self.retries = retries
+        self.gate = gate if gate is not None else RequestGate()
+        self.pending = []
+        self.requests_sent = 0
+
+    def Add(self, request, callback=None):
+        """
+        Queue 'request' (an unexecuted API call). 'callback', if given,
+        is called as callback(item) once the call is done. The calls are
+        sent on the next Flush(), or as soon as a full batch is queued.
+        """
+        item = BatchItem(request, callback)
+        self.pending.append(item)
+        if len(self.pending) >= self.batch_size:
+            self.Flush()
+        return item
+
+    def Execute(self, requests):
+        """
+        Send all 'requests' and return their BatchItems, in order.
+        """
+        items = [self.Add(r) for r in requests]
+        self.Flush()
+        return items
+
+    def Flush(self):
+        """
+        Send everything queued. Errors of single calls are stored in
+        their items; a failure of the batch request itself is raised and
+        the calls not sent stay queued.
+        """
+        attempt = 0
+        while self.pending:
+            retry = []
+            try:
+                while self.pending:
+                    group = self.pending[:self.batch_size]
+                    self.__SendGroup(group, retry, attempt < self.retries)
+                    del self.pending[:len(group)]
+            except:
+                self.pending.extend(item for item, _ in retry)
+                raise
+
+            if retry:
+                delay = max(self.gate.RetryDelay(error, attempt) or 0 for _, error in retry)
+                attempt += 1
+                # Queued before the backoff, so that they are still there
+                # if it is cancelled
+                self.pending = [item for item, _ in retry]
+                if any(IsRateLimited(error) for _, error in retry):
+                    # The gate holds back everyone else as well
+                    self.gate.CountRetries(len(retry), delay)
+                else:
+                    self.gate.CountRetries(len(retry))
+                    Sleep(delay, self.cancel)
+
+    def __SendGroup(self, group, retry, can_retry):
+        def Finish(item, response, exception):
+            item.response = response
+            item.error = exception
+            item.done = True
+            if item.callback is not None:
+                item.callback(item)
+
+        def Done(request_id, response, exception):
+            item = group[int(request_id)]
+            if can_retry and exception is not None and IsTransient(exception):
+                retry.append((item, exception))
+                return
+            Finish(item, response, exception)
+
+        if len(group) == 1:
+            # Not worth the batch envelope. The gate retries it as any
+            # single call, what it raises is final.
+            try:
+                response = self.gate.Execute(group[0].request.execute, cancel=self.cancel)
+            except HttpError as error:
+                Finish(group[0], None, error)
+            else:
+                Finish(group[0], response, None)
+        else:
+            batch = self.service.new_batch_http_request(callback=Done)
+            for i, item in enumerate(group):
+                batch.add(item.request, request_id=str(i))
+            self.gate.Execute(batch.execute, len(group), cancel=self.cancel)
+
+        self.requests_sent += 1
@@ -0,0 +1,60 @@
+# gosync is an open source Google Drive(TM) sync application for Linux
+#
+# Copyright (C) 2015 Himanshu Chauhan
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+import threading
+
+class SyncCancelled(RuntimeError):
+    """Sync was paused or GoSync is shutting down"""
+
+class CancelToken(object):
+    """
+    Handed to the listing, hashing and transfer loops of a sync run, and
+    cancelled when sync is paused or GoSync shuts down. The loops check
+    it at every step, which is kept short, and the waits made on it end
+    at once, so that pausing and shutting down take effect within a
+    second. A cancelled token stays cancelled; a new run takes a new one.
+    """
+    def __init__(self):
+        self.event = threading.Event()
+
+    def Cancel(self):
+        self.event.set()
+
+    def IsCancelled(self):
+        return self.event.is_set()
+
+    def Check(self):
+        """
+        Raise SyncCancelled if the token is cancelled.
+        """
+        if self.event.is_set():
+            raise SyncCancelled()
+
+    def Wait(self, seconds):
+        """
+        Sleep for 'seconds', or less if the token gets cancelled. Return
+        whether it is cancelled.
+        """
+        return self.event.wait(seconds)
+
+    def Sleep(self, seconds):
+        """
+        Like Wait(), but raise SyncCancelled if the token is cancelled.
+        """
+        if self.event.wait(seconds):
+            raise SyncCancelled()
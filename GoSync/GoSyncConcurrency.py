@@ -0,0 +1,149 @@
+# gosync is an open source Google Drive(TM) sync application for Linux
+#
+# Copyright (C) 2015 Himanshu Chauhan
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+import threading, time
+from contextlib import contextmanager
+try :
+    from .GoSyncRequestGate import IsRateLimited
+except (ImportError, ValueError):
+    from GoSyncRequestGate import IsRateLimited
+
+class AIMDLimit(object):
+    """
+    Adaptive limit on the number of Drive requests of one kind in
+    flight, additive-increase multiplicative-decrease style.
+
+    Requests are made inside Slot(), which waits while the limit is
+    reached and times the request. Completions are looked at in
+    windows of about 'limit' requests. After a window in which the
+    limit was reached, latency stayed within LATENCY_TOLERANCE of the
+    best seen and throughput didn't drop, the limit grows by one. A
+    window with latency past that tolerance shrinks it by
+    LATENCY_DECREASE, and a rate limit answer from Drive halves it at
+    once (once per window). The best latency creeps up a little every
+    window so that an old, lucky figure is forgotten.
+
+    A request that marks FirstByte() is timed until then rather than
+    until its slot ends, so that a transfer is judged by how long Drive
+    took to answer and not by the size of the file.
+
+    'log', if given, is called as log(level, message) whenever the
+    limit changes.
+    """
+    RATE_LIMIT_DECREASE = 0.5
+    LATENCY_DECREASE = 0.75
+    LATENCY_TOLERANCE = 2.0
+    BEST_LATENCY_DRIFT = 1.05
+    MIN_WINDOW = 4
+
+    def __init__(self, name, initial, minimum=1, maximum=16, log=None):
+        self.name = name
+        self.minimum = minimum
+        self.maximum = maximum
+        self.log = log
+        self.cond = threading.Condition(threading.Lock())
+        # When the answer to the request in this thread's slot started
+        # to arrive, see FirstByte()
+        self.local = threading.local()
+        self.limit = float(max(minimum, min(initial, maximum)))
+        self.in_flight = 0
+        self.best_latency = None
+        self.last_throughput = None
+        self.__NewWindow()
+
+    def __NewWindow(self):
+        self.window_start = time.monotonic()
+        self.window_done = 0
+        self.window_latency = 0.0
+        self.saturated = False
+        self.cut = False
+
+    def GetLimit(self):
+        return int(self.limit)
+
+    def SetLimit(self, value, reason='set'):
+        with self.cond:
+            self.__SetLimit(value, reason)
+            self.cond.notify_all()
+
+    def __SetLimit(self, value, reason):
+        old = self.GetLimit()
+        self.limit = float(max(self.minimum, min(value, self.maximum)))
+        self.__NewWindow()
+        if self.log is not None and self.GetLimit() != old:
+            self.log(2, "Concurrency limit of %s: %d -> %d (%s)" % (self.name, old, self.GetLimit(), reason))
+
+    @contextmanager
+    def Slot(self):
+        with self.cond:
+            while self.in_flight >= self.GetLimit():
+                self.cond.wait()
+            self.in_flight += 1
+            if self.in_flight >= self.GetLimit():
+                self.saturated = True
+
+        start = time.monotonic()
+        self.local.first_byte = None
+        rate_limited = False
+        try:
+            yield
+        except Exception as error:
+            rate_limited = IsRateLimited(error)
+            raise
+        finally:
+            end = self.local.first_byte or time.monotonic()
+            self.local.first_byte = None
+            with self.cond:
+                self.in_flight -= 1
+                self.__Done(end - start, rate_limited)
+                self.cond.notify_all()
+
+    def FirstByte(self):
+        """
+        Called from inside Slot() when the answer starts to arrive.
+        """
+        if self.local.first_byte is None:
+            self.local.first_byte = time.monotonic()
+
+    def __Done(self, latency, rate_limited):
+        if rate_limited:
+            if not self.cut:
+                self.__SetLimit(self.limit * self.RATE_LIMIT_DECREASE, 'rate limited')
+                self.cut = True
+            return
+
+        self.window_done += 1
+        self.window_latency += latency
+        if self.window_done < max(self.GetLimit(), self.MIN_WINDOW):
+            return
+
+        latency = self.window_latency / self.window_done
+        throughput = self.window_done / max(time.monotonic() - self.window_start, 1e-6)
+        if self.best_latency is None:
+            self.best_latency = latency
+        else:
+            self.best_latency = min(latency, self.best_latency * self.BEST_LATENCY_DRIFT)
+
+        last_throughput = self.last_throughput
+        self.last_throughput = throughput
+        if latency > self.best_latency * self.LATENCY_TOLERANCE:
+            self.__SetLimit(self.limit * self.LATENCY_DECREASE, 'latency %.2fs' % latency)
+        elif self.saturated and (last_throughput is None or throughput >= last_throughput):
+            self.__SetLimit(self.limit + 1, '%.1f requests/s' % throughput)
+        else:
+            self.__NewWindow()
@@ -0,0 +1,161 @@
+# gosync is an open source Google Drive(TM) sync application for Linux
+#
+# Copyright (C) 2015 Himanshu Chauhan
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+import random, socket, threading, time
+
+PROBE_HOST = ('www.googleapis.com', 443)
+PROBE_TIMEOUT = 5
+# Calls in a row that must fail on the network before the link is taken
+# for down without probing it
+FAILURES_BEFORE_DOWN = 3
+
+def ProbeGoogle():
+    """
+    Return True if a TCP connection to the Drive API host can be made.
+    Nothing is sent over it.
+    """
+    try:
+        socket.create_connection(PROBE_HOST, PROBE_TIMEOUT).close()
+        return True
+    except OSError:
+        return False
+
+class ConnectivityMonitor(object):
+    """
+    Keeps track of whether Drive can be reached, from the outcome of the
+    calls that are made anyway: a call that got an answer, even an
+    error, says the link is up. One call that failed on the network,
+    e.g. a slow page that timed out, doesn't say much: the link is taken
+    for down once 'failures_before_down' calls in a row have failed, or
+    earlier if a probe fails too.
+
+    While the link is up nothing is probed, unless IsUp() is asked after
+    nothing has succeeded for 'stale_after' seconds. Once it is down a
+    thread probes with 'probe' until it is back, waiting between probes
+    from 'min_interval' up to 'max_interval' seconds, doubling, with
+    jitter. WaitUntilUp() blocks until then.
+
+    'on_change', if given, is called as on_change(up) on every change,
+    in the thread that noticed it.
+    """
+    def __init__(self, probe=ProbeGoogle, min_interval=2.0, max_interval=60.0,
+                 stale_after=60.0, on_change=None, failures_before_down=FAILURES_BEFORE_DOWN):
+        self.probe = probe
+        self.failures_before_down = failures_before_down
+        # Network failures since the last success
+        self.failures = 0
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.stale_after = stale_after
+        self.on_change = on_change
+        self.cond = threading.Condition(threading.Lock())
+        self.up = True
+        self.last_ok = None
+        self.prober = None
+        self.probes = 0
+
+    def ReportSuccess(self):
+        with self.cond:
+            self.last_ok = time.monotonic()
+            self.failures = 0
+            if self.up:
+                return
+            self.up = True
+            self.cond.notify_all()
+
+        if self.on_change is not None:
+            self.on_change(True)
+
+    def ReportFailure(self):
+        with self.cond:
+            if not self.up:
+                return
+            self.failures += 1
+            sure = self.failures >= self.failures_before_down
+
+        if not sure:
+            self.probes += 1
+            if self.probe():
+                return
+
+        self.SetDown()
+
+    def SetDown(self):
+        """
+        Take the link for down and start probing for it to come back.
+        """
+        with self.cond:
+            if not self.up:
+                return
+            self.up = False
+            if self.prober is None:
+                self.prober = threading.Thread(target=self.__ProbeLoop, name='ConnectivityProbe')
+                self.prober.daemon = True
+                self.prober.start()
+
+        if self.on_change is not None:
+            self.on_change(False)
+
+    def IsUp(self):
+        """
+        Return whether Drive can be reached. A probe is only made if the
+        link is thought to be up but nothing has succeeded lately.
+        """
+        with self.cond:
+            if not self.up:
+                return False
+            if self.last_ok is not None and time.monotonic() - self.last_ok < self.stale_after:
+                return True
+
+        self.probes += 1
+        if self.probe():
+            self.ReportSuccess()
+            return True
+
+        self.SetDown()
+        return False
+
+    def WaitUntilUp(self, should_stop=None, check_every=1.0):
+        """
+        Block until Drive can be reached. If 'should_stop' is given it is
+        checked every 'check_every' seconds, and False is returned as
+        soon as it returns True.
+        """
+        with self.cond:
+            while not self.up:
+                if should_stop is not None and should_stop():
+                    return False
+                self.cond.wait(check_every if should_stop is not None else None)
+            return True
+
+    def __ProbeLoop(self):
+        attempt = 0
+        while True:
+            with self.cond:
+                if not self.up:
+                    delay = min(self.max_interval, self.min_interval * (2 ** attempt))
+                    # Woken up early if a call gets through meanwhile
+                    self.cond.wait(random.uniform(delay / 2, delay))
+                if self.up:
+                    self.prober = None
+                    return
+
+            self.probes += 1
+            if self.probe():
+                self.ReportSuccess()
+            attempt += 1
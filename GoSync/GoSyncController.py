@@ -81,16 +81,20 @@ class PageAccount(wx.Panel):
                                           self.OnUsageCalculationUpdate)
 
     def OnUsageCalculationDone(self, event):
-        if not event.data:
-            self.driveUsageBar.SetStatusMessage("Your Google Drive usage is shown below:")
-            self.driveUsageBar.SetMoviesUsage(self.sync_model.GetMovieUsage())
-            self.driveUsageBar.SetDocumentUsage(self.sync_model.GetDocumentUsage())
-            self.driveUsageBar.SetOthersUsage(self.sync_model.GetOthersUsage())
-            self.driveUsageBar.SetAudioUsage(self.sync_model.GetAudioUsage())
-            self.driveUsageBar.SetPhotoUsage(self.sync_model.GetPhotoUsage())
-            self.driveUsageBar.RePaint()
-        else:
+        # The usage thread sends the snapshot it took along, others
+        # send 0: the last snapshot is shown then. Taking a new one
+        # here would hold up the UI on a large drive.
+        if event.data == -1:
             self.driveUsageBar.SetStatusMessage("Sorry, could not calculate your Google Drive usage.")
+            return
+
+        snapshot = event.data
+        if snapshot == 0:
+            snapshot = self.sync_model.GetLastUsageSnapshot()
+        self.driveUsageBar.SetStatusMessage("Your Google Drive usage is shown below:")
+        if snapshot is not None:
+            self.driveUsageBar.SetUsageFromSnapshot(snapshot)
+        self.driveUsageBar.RePaint()
 
     def OnUsageCalculationUpdate(self, event):
         self.totalFiles = event.data
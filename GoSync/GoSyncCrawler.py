@@ -0,0 +1,93 @@
+# gosync is an open source Google Drive(TM) sync application for Linux
+#
+# Copyright (C) 2015 Himanshu Chauhan
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+try :
+    from .GoSyncDriveTree import FOLDER_MIME_TYPE
+except (ImportError, ValueError):
+    from GoSyncDriveTree import FOLDER_MIME_TYPE
+
+# Order in which the crawler lists the folders it found
+CRAWL_BREADTH_FIRST = 'breadth'
+CRAWL_DEPTH_FIRST = 'depth'
+
+DEFAULT_CRAWL_WORKERS = 4
+MAX_CRAWL_WORKERS = 16
+
+class RemoteCrawler(object):
+    """
+    Lists a remote folder and everything below it with a pool of worker
+    threads, so that up to 'workers' folder listings are in flight at
+    once instead of one.
+
+    Crawl() is a generator: it hands out (parent id, parent path, item)
+    as the listings come back, in the thread that iterates it. A folder
+    is always handed out before anything in it. 'order' picks which of
+    the folders found so far is listed next: CRAWL_BREADTH_FIRST takes
+    the oldest, CRAWL_DEPTH_FIRST the newest.
+
+    list_folder(folder_id) is called in the worker threads and must be
+    safe to call from several threads at once. should_stop() is checked
+    between listings; once it returns True, no more folders are listed
+    and Crawl() returns.
+
+    If 'limit' (an AIMDLimit) is given, no more than its current value
+    of listings are started at once, still at most 'workers'.
+    """
+    def __init__(self, list_folder, should_stop, workers=DEFAULT_CRAWL_WORKERS,
+                 order=CRAWL_BREADTH_FIRST, limit=None):
+        self.list_folder = list_folder
+        self.should_stop = should_stop
+        self.workers = max(1, min(workers, MAX_CRAWL_WORKERS))
+        self.order = order
+        self.limit = limit
+        self.folders_listed = 0
+
+    def Crawl(self, folder_id, path, recursive=True):
+        pending = deque([(folder_id, path)])
+        running = {}
+        pool = ThreadPoolExecutor(self.workers)
+        try:
+            while pending or running:
+                if self.should_stop():
+                    return
+
+                workers = self.workers
+                if self.limit is not None:
+                    workers = min(workers, self.limit.GetLimit())
+                while pending and len(running) < workers:
+                    if self.order == CRAWL_DEPTH_FIRST:
+                        fid, fpath = pending.pop()
+                    else:
+                        fid, fpath = pending.popleft()
+                    running[pool.submit(self.list_folder, fid)] = (fid, fpath)
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    fid, fpath = running.pop(future)
+                    self.folders_listed += 1
+                    for item in future.result() or []:
+                        if recursive and item['mimeType'] == FOLDER_MIME_TYPE:
+                            pending.append((item['id'], os.path.join(fpath, item['name'])))
+                        yield fid, fpath, item
+        finally:
+            for future in running:
+                future.cancel()
+            pool.shutdown(wait=False)
@@ -0,0 +1,139 @@
+# gosync is an open source Google Drive(TM) sync application for Linux
+#
+# Copyright (C) 2015 Himanshu Chauhan
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+import copy, datetime, threading
+from google.auth.transport.requests import Request
+
+# Seconds before expiry at which the token is refreshed in the
+# background. google-auth itself refreshes on a request less than 225
+# seconds before expiry, which this keeps requests from ever doing.
+REFRESH_AHEAD = 300
+# A token this close to expiry isn't sent any more
+EXPIRY_SKEW = 60
+# Seconds between attempts after a failed background refresh
+RETRY_EVERY = 30
+# Longest the refresh thread sleeps at a time, so that a suspend or a
+# clock change doesn't make it miss the expiry
+MAX_SLEEP = 60
+
+def _UtcNow():
+    # Credentials keep their expiry as a naive UTC datetime
+    return datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+
+class CredentialManager(object):
+    """
+    Shares one set of OAuth user credentials between every Drive client
+    and thread, and keeps their access token fresh. It is handed to
+    AuthorizedSession in place of the credentials themselves.
+
+    A thread started by Start() refreshes the token REFRESH_AHEAD
+    seconds before it expires, so that requests don't have to. The token
+    and its expiry are published together, as one tuple, so a request
+    never goes out with a token that is half replaced. Should a request
+    still find the token out of date (after a suspend, or on a 401), it
+    refreshes it under the lock; the threads that were waiting on that
+    lock then use the new token instead of refreshing it again.
+
+    'save', if given, is called as save(credentials) with a copy of the
+    credentials after every refresh, in a thread of its own, so that
+    saving them never holds up a request. 'log', if given, is called as
+    log(level, message).
+    """
+    def __init__(self, credentials, save=None, log=None):
+        self.credentials = credentials
+        self.save = save
+        self.log = log
+        self.lock = threading.Lock()
+        self.current = (credentials.token, credentials.expiry)
+        self.request = Request()
+        self.stopped = threading.Event()
+        self.refresher = None
+        self.refreshes = 0
+
+    def Start(self):
+        if self.refresher is None:
+            self.refresher = threading.Thread(target=self.__RefreshLoop, name='CredentialRefresh')
+            self.refresher.daemon = True
+            self.refresher.start()
+
+    def Stop(self):
+        self.stopped.set()
+
+    def IsFresh(self, current, margin=EXPIRY_SKEW):
+        token, expiry = current
+        if token is None:
+            return False
+        return expiry is None or _UtcNow() < expiry - datetime.timedelta(seconds=margin)
+
+    def Refresh(self, request, stale):
+        """
+        Refresh the token unless it is no longer 'stale', i.e. another
+        thread has refreshed it meanwhile. Return the current token.
+        """
+        with self.lock:
+            if self.current[0] == stale:
+                self.credentials.refresh(request)
+                self.current = (self.credentials.token, self.credentials.expiry)
+                self.refreshes += 1
+                saved = copy.copy(self.credentials)
+            else:
+                saved = None
+            token = self.current[0]
+
+        if saved is not None:
+            if self.log is not None:
+                self.log(3, "Access token refreshed, valid until %s UTC" % self.current[1])
+            if self.save is not None:
+                saver = threading.Thread(target=self.save, args=(saved,), name='CredentialSave')
+                saver.daemon = True
+                saver.start()
+        return token
+
+    # What AuthorizedSession calls
+
+    def before_request(self, request, method, url, headers):
+        current = self.current
+        token = current[0]
+        if not self.IsFresh(current):
+            token = self.Refresh(request, token)
+        self.credentials.apply(headers, token=token)
+
+    def refresh(self, request):
+        # The token was turned down
+        self.Refresh(request, self.current[0])
+
+    def __RefreshLoop(self):
+        while not self.stopped.is_set():
+            current = self.current
+            if current[0] is not None and current[1] is None:
+                # A token that doesn't expire
+                self.stopped.wait(MAX_SLEEP)
+                continue
+
+            if self.IsFresh(current, REFRESH_AHEAD):
+                left = (current[1] - _UtcNow()).total_seconds() - REFRESH_AHEAD
+                self.stopped.wait(max(1, min(left, MAX_SLEEP)))
+                continue
+
+            try:
+                self.Refresh(self.request, current[0])
+            except Exception as error:
+                if self.log is not None:
+                    self.log(1, "Refreshing the access token failed (%s). Retrying in %ds"
+                             % (error, RETRY_EVERY))
+                self.stopped.wait(RETRY_EVERY)
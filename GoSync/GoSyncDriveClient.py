@@ -0,0 +1,284 @@
+# gosync is an open source Google Drive(TM) sync application for Linux
+#
+# Copyright (C) 2015 Himanshu Chauhan
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+import socket, threading, time, weakref
+import httplib2
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from requests.adapters import HTTPAdapter
+from requests.exceptions import RequestException
+from google.auth.transport.requests import AuthorizedSession
+from googleapiclient.discovery import build, build_from_document
+from googleapiclient.errors import HttpError
+
+# Connections kept alive to Google, enough for the listing and
+# transfer limits at their maximum
+DEFAULT_POOL_SIZE = 32
+
+# Seconds to wait for a connection to be made, and for the next bytes of
+# a response. Listing pages can take Drive a while to put together. A
+# read doesn't hold up pausing or shutting down that long, see
+# DriveClientFactory.Abort().
+CONNECT_TIMEOUT = 10
+READ_TIMEOUT = 60
+# Seconds without a byte after which a download is given up as stalled
+STALL_TIMEOUT = 30
+# Bytes written between two looks at the cancel token, small enough for
+# the look to come within a second on slow links
+DOWNLOAD_BLOCK_SIZE = 16 * 1024
+
+MEDIA_URI = 'https://www.googleapis.com/drive/v3/files/%s?alt=media'
+
+class DiscoveryDocumentInvalid(RuntimeError):
+    """The Drive discovery document bundled with googleapiclient is unusable"""
+
+class TransferStalled(RuntimeError):
+    """A transfer made no progress for too long"""
+
+def _HttplibResponse(r):
+    info = dict((k.lower(), v) for k, v in r.headers.items())
+    # The content is unpacked already
+    info.pop('content-encoding', None)
+    info['status'] = str(r.status_code)
+    resp = httplib2.Response(info)
+    resp.reason = r.reason
+    return resp
+
+def _ResumesAt(r, offset):
+    """
+    True if the response 'r' to a range request carries the content
+    from byte 'offset' on.
+    """
+    return (r.status_code == 206
+            and r.headers.get('content-range', '').startswith('bytes %d-' % offset))
+
+class _SocketKeeping(object):
+    """
+    Connection mixin that keeps its socket in 'abort_sock'. The
+    connection drops 'sock' when it hands the socket over to a response
+    that reads until the connection closes.
+    """
+    abort_sock = None
+
+    def connect(self):
+        super().connect()
+        self.abort_sock = self.sock
+
+class _AbortableHTTPConnection(_SocketKeeping, HTTPConnection):
+    pass
+
+class _AbortableHTTPSConnection(_SocketKeeping, HTTPSConnection):
+    pass
+
+class _BusyTracking(object):
+    """
+    Connection pool mixin that keeps the connections handed out, i.e.
+    with a request in flight, in the 'busy' set of its 'adapter'.
+    """
+    adapter = None
+
+    def _get_conn(self, timeout=None):
+        conn = super()._get_conn(timeout)
+        with self.adapter.busy_lock:
+            self.adapter.busy.add(conn)
+        return conn
+
+    def _put_conn(self, conn):
+        # A connection that was dropped comes back as None and leaves
+        # the set once it is garbage
+        if conn is not None:
+            with self.adapter.busy_lock:
+                self.adapter.busy.discard(conn)
+        super()._put_conn(conn)
+
+class AbortableAdapter(HTTPAdapter):
+    """
+    HTTPAdapter whose requests in flight can be cut short from any
+    thread with Abort(). It shuts down their sockets, so that a read
+    blocked on one ends at once with a connection error instead of
+    waiting for its timeout. A connection still being made is not
+    affected; it is given up after the connect timeout.
+    """
+    def __init__(self, *args, **kwargs):
+        self.busy = weakref.WeakSet()
+        self.busy_lock = threading.Lock()
+        HTTPAdapter.__init__(self, *args, **kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        HTTPAdapter.init_poolmanager(self, *args, **kwargs)
+        http = type('HTTPPool', (_BusyTracking, HTTPConnectionPool),
+                    {'adapter': self, 'ConnectionCls': _AbortableHTTPConnection})
+        https = type('HTTPSPool', (_BusyTracking, HTTPSConnectionPool),
+                     {'adapter': self, 'ConnectionCls': _AbortableHTTPSConnection})
+        self.poolmanager.pool_classes_by_scheme = {'http': http, 'https': https}
+
+    def Abort(self):
+        with self.busy_lock:
+            busy = list(self.busy)
+
+        for conn in busy:
+            sock = getattr(conn, 'abort_sock', None)
+            if isinstance(sock, socket.socket):
+                try:
+                    # Not SSLSocket.shutdown(), which would pull the TLS
+                    # state from under the thread reading
+                    socket.socket.shutdown(sock, socket.SHUT_RDWR)
+                except OSError:
+                    pass
+
+class SessionHttp(object):
+    """
+    httplib2 style front, which is what googleapiclient calls, for a
+    requests session. Unlike an httplib2.Http it can be used from many
+    threads at once: the session's urllib3 pool hands every request a
+    connection of its own and keeps them alive in between.
+
+    Metadata responses are asked for gzipped (requests does that, and
+    unpacks them); media is fetched as is, so that byte ranges stay
+    byte ranges.
+
+    'timeout' is passed on to requests: seconds, or a (connect, read)
+    pair.
+    """
+    def __init__(self, session, timeout=None):
+        self.session = session
+        self.timeout = timeout
+
+    def request(self, uri, method='GET', body=None, headers=None,
+                redirections=httplib2.DEFAULT_MAX_REDIRECTS, connection_type=None):
+        headers = dict(headers or {})
+        if 'alt=media' in uri:
+            headers['accept-encoding'] = 'identity'
+
+        r = self.session.request(method, uri, data=body, headers=headers,
+                                 timeout=self.timeout, allow_redirects=redirections > 0)
+        return _HttplibResponse(r), r.content
+
+class DriveClientFactory(object):
+    """
+    Hands out a Drive service object per thread. All of them share
+    'credentials' and one AuthorizedSession, so one pool of keep-alive
+    connections. The discovery document is the one bundled with
+    googleapiclient, so building a service never goes to the network.
+    It is checked and parsed once, then reused for every thread's
+    service.
+
+    Every request gives up after 'timeout' seconds, (connect, read),
+    without an answer. Downloads go through Download() instead. Abort()
+    ends the requests in flight at once.
+    """
+    def __init__(self, credentials, pool_size=DEFAULT_POOL_SIZE,
+                 timeout=(CONNECT_TIMEOUT, READ_TIMEOUT), stall_timeout=STALL_TIMEOUT):
+        self.credentials = credentials
+        self.session = AuthorizedSession(credentials)
+        self.adapter = AbortableAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('https://', self.adapter)
+        self.http = SessionHttp(self.session, timeout)
+        self.stall_timeout = stall_timeout
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.document = None
+
+    def GetService(self):
+        service = getattr(self.local, 'service', None)
+        if service is not None:
+            return service
+
+        with self.lock:
+            if self.document is None:
+                service = build('drive', 'v3', http=self.http, static_discovery=True)
+                document = service._rootDesc
+                if (document.get('version') != 'v3'
+                    or not {'files', 'changes', 'about'} <= set(document.get('resources', {}))):
+                    raise DiscoveryDocumentInvalid()
+                self.document = document
+
+        if service is None:
+            service = build_from_document(self.document, http=self.http)
+        self.local.service = service
+        return service
+
+    def Download(self, file_id, fh, offset=0, cancel=None, progress=None, on_response=None):
+        """
+        Write the content of 'file_id' from byte 'offset' on to 'fh' as
+        it arrives, and return the number of bytes written. The
+        CancelToken 'cancel' is checked after every DOWNLOAD_BLOCK_SIZE
+        bytes, and progress(bytes so far) called. on_response() is
+        called once Drive has answered, before the content comes. A download that gets
+        no bytes for 'stall_timeout' seconds raises TransferStalled;
+        what was written stays, so it can be resumed from there.
+        Errors from Drive are raised as HttpError.
+
+        A resumed download only carries on if the answer is a 206 that
+        starts at 'offset'. Otherwise (the range was ignored, or the file
+        has changed) 'fh' is emptied and the whole content written from
+        the start.
+        """
+        headers = {'accept-encoding': 'identity'}
+        if offset:
+            headers['range'] = 'bytes=%d-' % offset
+
+        done = 0
+        restart = False
+        last_progress = time.monotonic()
+        try:
+            with self.session.get(MEDIA_URI % file_id, headers=headers, stream=True,
+                                  timeout=(self.http.timeout[0], self.stall_timeout)) as r:
+                if on_response is not None:
+                    on_response()
+                if offset and not _ResumesAt(r, offset):
+                    fh.seek(0)
+                    fh.truncate()
+                    # A 200 brings the whole file anyway
+                    restart = r.status_code != 200
+                    offset = 0
+                if not restart:
+                    if r.status_code >= 300:
+                        raise HttpError(_HttplibResponse(r), r.content, uri=r.url)
+                    for block in r.iter_content(DOWNLOAD_BLOCK_SIZE):
+                        if cancel is not None:
+                            cancel.Check()
+                        fh.write(block)
+                        done += len(block)
+                        last_progress = time.monotonic()
+                        if progress is not None:
+                            progress(offset + done)
+        except RequestException:
+            if cancel is not None:
+                # Cut short by Abort()
+                cancel.Check()
+            if time.monotonic() - last_progress >= self.stall_timeout:
+                raise TransferStalled()
+            raise
+
+        if restart:
+            return self.Download(file_id, fh, 0, cancel, progress)
+        return done
+
+    def Abort(self):
+        """
+        End every request in flight with a connection error, from any
+        thread. Called when sync is paused or GoSync shuts down, once the
+        cancel token is cancelled, so that no read holds that up for as
+        long as its timeout. Calls that weren't cancelled are retried by
+        the request gate as after any network error.
+        """
+        self.adapter.Abort()
+
+    def Close(self):
+        self.session.close()
@@ -16,23 +16,39 @@
 # along with this program; if not, write to the Free Software
 # Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
 
-import os, threading, logging
-
-class DriveFile(object):
-    def __init__(self, parent, id, name, data=None):
+import os, sys, threading, logging
+from collections import deque, defaultdict
+try :
+    from .GoSyncUtils import ReadWriteLock
+except (ImportError, ValueError):
+    from GoSyncUtils import ReadWriteLock
+
+FOLDER_MIME_TYPE = 'application/vnd.google-apps.folder'
+
+# Kinds of entries in the tree's change log
+CHANGE_ADD = 'add'
+CHANGE_UPDATE = 'update'
+CHANGE_MOVE = 'move'
+CHANGE_DELETE = 'delete'
+
+# Number of changes the tree remembers, see GoogleDriveTree.ChangesSince()
+CHANGE_LOG_SIZE = 100000
+
+class DriveNode(object):
+    """
+    Common part of files and folders in the drive tree. Nodes are kept
+    small: no instance dictionary and no copy of the API response. The
+    metadata dictionary is rebuilt by GetData() when asked for, its
+    'parents' entry comes from the node's position in the tree.
+    """
+    __slots__ = ('id', 'name', 'parent', 'path')
+
+    def __init__(self, parent, id, name):
         self.id = id
         self.parent = parent
-        self.data = data
         self.name = name
-
-    def IsFile(self):
-        return True
-
-    def SetData(self, data):
-        self.data = data
-
-    def GetData(self):
-        return self.data
+        # Cached result of GetPath(). None means it needs to be computed.
+        self.path = None
 
     def GetParent(self):
         return self.parent
@@ -44,190 +60,558 @@ class DriveFile(object):
         return self.name
 
     def GetPath(self):
-        cpath =''
-        if self.parent is not None:
-            cpath = self.parent.GetPath()
+        if self.path is None:
+            if self.parent is None:
+                self.path = os.path.join('', '')
+            else:
+                self.path = os.path.join(self.parent.GetPath(), self.GetName())
 
+        return self.path
+
+    def GetParentId(self):
         if self.parent is None:
-            path = os.path.join(cpath, '')
+            return None
+        return self.parent.GetId()
+
+class DriveFile(DriveNode):
+    __slots__ = ('mime', 'size', 'md5')
+
+    def __init__(self, parent, id, name, data=None):
+        DriveNode.__init__(self, parent, id, name)
+        self.SetData(data)
+
+    def __getstate__(self):
+        return (self.id, self.name, self.parent, self.mime, self.size, self.md5)
+
+    def __setstate__(self, state):
+        self.path = None
+        if isinstance(state, dict):
+            # Pickle written before nodes had slots
+            self.id = state['id']
+            self.name = state['name']
+            self.parent = state['parent']
+            self.SetData(state.get('data'))
         else:
-            path = os.path.join(cpath, self.GetName())
+            self.id, self.name, self.parent, self.mime, self.size, self.md5 = state
+
+    def IsFile(self):
+        return True
+
+    def SetData(self, data):
+        self.mime = None
+        self.size = None
+        self.md5 = None
+        if not data:
+            return
+
+        if data.get('mimeType'):
+            self.mime = sys.intern(str(data['mimeType']))
+        if data.get('size') is not None:
+            self.size = int(data['size'])
+        if data.get('md5Checksum'):
+            try:
+                self.md5 = bytes.fromhex(data['md5Checksum'])
+            except ValueError:
+                self.md5 = None
+
+    def GetData(self):
+        data = {'id': self.id, 'name': self.name}
+        if self.parent is not None:
+            data['parents'] = [self.parent.GetId()]
+        if self.mime is not None:
+            data['mimeType'] = self.mime
+        if self.size is not None:
+            data['size'] = str(self.size)
+        if self.md5 is not None:
+            data['md5Checksum'] = self.md5.hex()
+        return data
+
+    def GetMimeType(self):
+        return self.mime
+
+    def GetSize(self):
+        return self.size or 0
+
+    def GetMD5(self):
+        if self.md5 is None:
+            return None
+        return self.md5.hex()
+
+    def InvalidatePath(self):
+        self.path = None
 
-        return path
+class DriveFolder(DriveNode):
+    # child_names maps a name to a child and is used to walk a path one
+    # component at a time. Drive allows siblings with the same name,
+    # only the first one added is kept there; has_dup_names tells
+    # GetChildByName to look further when that one isn't of the wanted
+    # kind.
+    # snapshot is the FolderSnapshot of this folder, None when it has to
+    # be built again. See GoogleDriveTree.GetDirectorySnapshot().
+    __slots__ = ('children', 'child_names', 'has_dup_names', 'snapshot')
 
-class DriveFolder(object):
     def __init__(self, parent, id, name, data=None):
+        DriveNode.__init__(self, parent, id, name)
         self.children = []
-        self.id = id
-        self.parent = parent
-        self.data = data
-        self.name = name
+        self.child_names = {}
+        self.has_dup_names = False
+        self.snapshot = None
+
+    def __getstate__(self):
+        return (self.id, self.name, self.parent, self.children)
+
+    def __setstate__(self, state):
+        self.path = None
+        if isinstance(state, dict):
+            # Pickle written before nodes had slots
+            state = (state['id'], state['name'], state['parent'], state['children'])
+        self.id, self.name, self.parent, self.children = state
+        self.child_names = {}
+        self.has_dup_names = False
+        self.snapshot = None
+        for child in self.children:
+            self.__AddName(child)
 
     def IsFile(self):
         return False
 
     def SetData(self, data):
-        self.data = data
+        pass
 
     def GetData(self):
-        return self.data
-
-    def GetParent(self):
-        return self.parent
+        data = {'id': self.id, 'name': self.name, 'mimeType': FOLDER_MIME_TYPE}
+        if self.parent is not None:
+            data['parents'] = [self.parent.GetId()]
+        return data
 
-    def GetId(self):
-        return self.id
+    def GetMimeType(self):
+        return FOLDER_MIME_TYPE
 
-    def GetName(self):
-        return self.name
+    def __AddName(self, child):
+        if child.GetName() in self.child_names:
+            self.has_dup_names = True
+        else:
+            self.child_names[child.GetName()] = child
+
+    def InvalidateSnapshot(self):
+        """
+        Drop the snapshot of this folder and of its ancestors, they all
+        have to be built again. A folder only has a snapshot if all the
+        folders below it have one, so the walk stops at the first
+        ancestor that has none.
+        """
+        n = self
+        while n is not None and n.snapshot is not None:
+            n.snapshot = None
+            n = n.parent
 
     def AddChild(self, child):
         self.children.append(child)
+        self.__AddName(child)
+        if not child.IsFile():
+            self.InvalidateSnapshot()
 
     def DeleteChild(self, child):
         self.children.remove(child)
+        if not child.IsFile():
+            self.InvalidateSnapshot()
+        name = child.GetName()
+        if self.child_names.get(name) is child:
+            del self.child_names[name]
+            if self.has_dup_names:
+                for c in self.children:
+                    if c.GetName() == name:
+                        self.child_names[name] = c
+                        break
 
     def GetChildren(self):
         return self.children
 
-    def GetPath(self):
-        cpath =''
+    def GetChildByName(self, name, is_file=None):
+        """
+        Return the child called 'name'. If is_file is True (False) only
+        a file (folder) is returned.
+        """
+        child = self.child_names.get(name)
+        if child is None or is_file is None or child.IsFile() == is_file:
+            return child
+
+        if self.has_dup_names:
+            for c in self.children:
+                if c.GetName() == name and c.IsFile() == is_file:
+                    return c
+
+        return None
+
+    def InvalidatePath(self):
+        """
+        Forget the cached path of this folder and everything below it.
+        Must be called when the folder is renamed or moved.
+        """
         if self.parent is not None:
-            cpath = self.parent.GetPath()
+            self.parent.InvalidateSnapshot()
+
+        stack = [self]
+        while stack:
+            n = stack.pop()
+            n.path = None
+            if not n.IsFile():
+                n.snapshot = None
+                stack.extend(n.GetChildren())
+
+class FolderSnapshot(object):
+    """
+    Immutable, read-only view of a folder and the folders below it.
+    Snapshots of folders that did not change are shared between
+    successive snapshots of the tree, so taking a new one only costs
+    the folders changed since the previous one. Files are not part of
+    the snapshot.
+    """
+    __slots__ = ('id', 'name', 'path', 'children')
+
+    def __init__(self, folder, children):
+        self.id = folder.GetId()
+        self.name = folder.GetName()
+        self.path = folder.GetPath()
+        self.children = children
 
-        if self.parent is None:
-            path = os.path.join(cpath, '')
-        else:
-            path = os.path.join(cpath, self.GetName())
+    def IsFile(self):
+        return False
 
-        return path
+    def GetId(self):
+        return self.id
+
+    def GetName(self):
+        return self.name
+
+    def GetPath(self):
+        return self.path
+
+    def GetChildren(self):
+        return self.children
+
+class TreeSnapshot(object):
+    def __init__(self, root):
+        self.root_node = root
+
+    def GetRoot(self):
+        return self.root_node
 
 
 class GoogleDriveTree(object):
     def __init__(self):
         self.root_node = DriveFolder(None, 'root', 'Google Drive Root', None)
+        # Map of drive ID to node. Kept up to date by AddFile, AddFolder
+        # and DeleteFolder so that ID lookups don't walk the tree.
+        self.id_index = {'root': self.root_node}
+        # Every change to the tree gets the next generation number and an
+        # entry (generation, kind, id) in the change log. Only the latest
+        # CHANGE_LOG_SIZE entries are kept. See ChangesSince().
+        self.generation = 0
+        self.change_log = deque(maxlen=CHANGE_LOG_SIZE)
+        # Lookups share the lock, changes to the tree take it alone.
+        # Callers doing network work must not hold it across the call.
+        self.lock = ReadWriteLock()
+
+    def __getstate__(self):
+        # The index is derived data, don't put it in the pickle.
+        state = self.__dict__.copy()
+        del state['id_index']
+        state.pop('change_log', None)
+        state.pop('generation', None)
+        state.pop('lock', None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = ReadWriteLock()
+        self.id_index = {}
+        self.__IndexSubtree(self.root_node)
+        self.generation = 0
+        self.change_log = deque(maxlen=CHANGE_LOG_SIZE)
+
+    def __IndexSubtree(self, node):
+        stack = [node]
+        while stack:
+            n = stack.pop()
+            self.id_index[n.GetId()] = n
+            if not n.IsFile():
+                stack.extend(n.GetChildren())
 
     def GetRoot(self):
         return self.root_node
 
     def FindFolderInParent(self, parent, id):
-        for f in parent.GetChildren():
-            if f.GetId() == id:
-                return f
+        with self.lock.read_locked():
+            node = self.id_index.get(id)
+            if node is None or node is parent:
+                return None
 
-            if not f.IsFile():
-                ret = self.FindFolderInParent(f, id)
-                if ret:
-                    return ret
+            # Only return the node if it lives somewhere below parent
+            if self.__IsBelow(node, parent):
+                return node
 
-        return None
+            return None
 
     def FindFolder(self, id):
         if id == 'root':
             return self.root_node
         else:
-            return self.FindFolderInParent(self.root_node, id)
+            with self.lock.read_locked():
+                return self.id_index.get(id)
+
+    def FindNodeByPath(self, rel_path, is_file=None):
+        """
+        Walk rel_path one component at a time from the root. Cost is
+        proportional to the depth of the path, not the size of the tree.
+        """
+        components = [c for c in rel_path.split(os.sep) if c]
+        if not components:
+            return None
 
-    def FindFolderByPath(self, rel_path, parent=None):
-        if parent == None:
-            parent = self.root_node
+        with self.lock.read_locked():
+            node = self.root_node
+            for name in components[:-1]:
+                node = node.GetChildByName(name, False)
+                if node is None:
+                    return None
 
-        for f in parent.GetChildren():
-            if not f.IsFile() and f.GetPath() == rel_path:
-                return f
+            return node.GetChildByName(components[-1], is_file)
 
-            if not f.IsFile():
-                ret = self.FindFolderByPath(rel_path, f)
-                if ret:
-                    return ret
+    def __IsBelow(self, node, parent):
+        if parent is None or parent is self.root_node:
+            return True
 
-        return None
+        p = node.GetParent()
+        while p is not None:
+            if p is parent:
+                return True
+            p = p.GetParent()
 
-    def FindFile(self, id):
-        return self.FindFolderInParent(self.root_node, id)
+        return False
 
-    def FindFileByPath(self, rel_path, parent=None):
-        if parent == None:
-            parent = self.root_node
+    def HasAncestorIn(self, node_id, ids):
+        """
+        Return True if the node 'node_id', or a folder above it, is one
+        of 'ids'. The cost is the depth of the node.
+        """
+        with self.lock.read_locked():
+            node = self.FindFolder(node_id)
+            while node is not None:
+                if node.GetId() in ids:
+                    return True
+                node = node.GetParent()
+
+            return False
 
-        for f in parent.GetChildren():
-            if f.IsFile() and f.GetPath() == rel_path:
+    def FindFolderByPath(self, rel_path, parent=None):
+        with self.lock.read_locked():
+            f = self.FindNodeByPath(rel_path, False)
+            if f and self.__IsBelow(f, parent):
                 return f
 
-            if not f.IsFile():
-                ret = self.FindFileByPath(rel_path, f)
-                if ret:
-                    return ret
+            return None
 
-        return None
+    def FindFile(self, id):
+        if id == 'root':
+            return None
+        with self.lock.read_locked():
+            return self.id_index.get(id)
+
+    def FindFileByPath(self, rel_path, parent=None):
+        with self.lock.read_locked():
+            f = self.FindNodeByPath(rel_path, True)
+            if f and self.__IsBelow(f, parent):
+                return f
+
+            return None
 
     def AddFile(self, parent, file_id, file_name, data):
         if not parent:
             return None
 
-        pnode = self.FindFolder(parent)
-        if self.FindFile(file_id):
-            return
-
-        cnode = DriveFile(pnode, file_id, file_name, data)
-        pnode.AddChild(cnode)
+        with self.lock.write_locked():
+            pnode = self.FindFolder(parent)
+            cnode = self.FindFile(file_id)
+            if cnode:
+                # Known file, only its content may have changed
+                if data:
+                    cnode.SetData(data)
+                    self.__LogChange(CHANGE_UPDATE, file_id)
+                return
+
+            cnode = DriveFile(pnode, file_id, file_name, data)
+            pnode.AddChild(cnode)
+            self.id_index[file_id] = cnode
+            self.__LogChange(CHANGE_ADD, file_id)
+            return cnode
 
     def AddFolder(self, parent, folder_id, folder_name, data):
         if not parent:
             return None
 
-        pnode = self.FindFolder(parent)
-        if self.FindFolder(folder_id):
-            return
-
-        cnode = DriveFolder(pnode, folder_id, folder_name, data)
-        pnode.AddChild(cnode)
-
-    def __DeleteFolder(self, folder_id, FolderDeleteCallback):
-        pnode = self.FindFolder(folder_id)
+        with self.lock.write_locked():
+            pnode = self.FindFolder(parent)
+            if self.FindFolder(folder_id):
+                return
+
+            cnode = DriveFolder(pnode, folder_id, folder_name, data)
+            pnode.AddChild(cnode)
+            self.id_index[folder_id] = cnode
+            self.__LogChange(CHANGE_ADD, folder_id)
+            return cnode
+
+    def MoveNode(self, node_id, new_parent, new_name=None):
+        """
+        Move the node under the folder 'new_parent' and/or rename it to
+        'new_name'. The cached paths of the node and of everything below
+        it are dropped.
+        """
+        with self.lock.write_locked():
+            node = self.FindFile(node_id)
+            pnode = self.FindFolder(new_parent)
+
+            if node is None:
+                raise NameError("MoveNode: Node %s not found" % node_id)
+
+            if pnode is None or pnode.IsFile():
+                raise NameError("MoveNode: Folder %s not found" % new_parent)
+
+            if pnode is node or (not node.IsFile() and self.__IsBelow(pnode, node)):
+                raise NameError("MoveNode: Can't move %s below itself" % node_id)
+
+            # Unlink under the old name so that the name map stays right
+            node.GetParent().DeleteChild(node)
+            if new_name is not None:
+                node.name = new_name
+            node.parent = pnode
+            pnode.AddChild(node)
+            node.InvalidatePath()
+            self.__LogChange(CHANGE_MOVE, node_id)
+            return node
 
-        if pnode is None:
-            raise NameError("__DeleteFolder: Parent folder %s not found" % folder_id)
-
-        if not pnode.GetChildren():
-            try:
-                if FolderDeleteCallback:
-                    FolderDeleteCallback(pnode)
-            except:
-                #The folder delete callback should handle things properly
-                pass
-            pnode.GetParent().DeleteChild(pnode)
-            return
-
-        #This try is important. After Deleting child, the pnode's
-        #for loop goes for a toss. So a call of pnode.GetChildren()
-        #is required to start afresh.
-        #
-        #I have sweat enough on it, can I can't get this working in
-        #a pure recursive way.
-        while True:
-            if not pnode.GetChildren():
-                break
-            for child in pnode.GetChildren():
-                try:
-                    self.__DeleteFolder(child.GetId(), FolderDeleteCallback)
-                except:
-                    raise
+    def DeleteFolder(self, folder_id, FolderDeleteCallback=None):
+        """
+        Remove the folder and everything below it from the tree.
+
+        The subtree is walked once, iteratively and in post-order, so the
+        cost is proportional to its size. FolderDeleteCallback is called
+        once for every folder removed, children before their parent,
+        while the folder is still in the tree. Returns the IDs of all the
+        removed nodes so that callers can update their own indexes in
+        one go.
+        """
+        with self.lock.write_locked():
+            pnode = self.FindFolder(folder_id)
+
+            if pnode is None:
+                raise NameError("DeleteFolder: Folder %s not found" % folder_id)
+
+            if pnode is self.root_node:
+                raise NameError("DeleteFolder: Root folder can't be deleted")
+
+            removed = []
+            stack = [(pnode, False)]
+            while stack:
+                node, children_done = stack.pop()
+                if node.IsFile():
+                    removed.append(node.GetId())
+                elif not children_done:
+                    stack.append((node, True))
+                    stack.extend((c, False) for c in node.GetChildren())
                 else:
+                    try:
+                        if FolderDeleteCallback:
+                            FolderDeleteCallback(node)
+                    except:
+                        #The folder delete callback should handle things properly
+                        pass
+                    removed.append(node.GetId())
+
+            # Only the top of the subtree needs unlinking, the rest goes
+            # with it.
+            pnode.GetParent().DeleteChild(pnode)
+            for fid in removed:
+                del self.id_index[fid]
+                self.__LogChange(CHANGE_DELETE, fid)
+
+            return removed
+
+    def GetAllNodes(self):
+        """
+        Return every node except the root, parents before children.
+        """
+        with self.lock.read_locked():
+            nodes = []
+            stack = [self.root_node]
+            while stack:
+                n = stack.pop()
+                if n is not self.root_node:
+                    nodes.append(n)
+                if not n.IsFile():
+                    stack.extend(n.GetChildren())
+
+            return nodes
+
+    def __LogChange(self, kind, node_id):
+        self.generation += 1
+        self.change_log.append((self.generation, kind, node_id))
+
+    def GetGeneration(self):
+        return self.generation
+
+    def ChangesSince(self, generation):
+        """
+        Return the log entries (generation, kind, id) of the changes made
+        after 'generation', oldest first. The cost is proportional to the
+        number of changes returned. Returns None if some of them have
+        already dropped out of the log: the caller has to look at the
+        whole tree instead.
+        """
+        with self.lock.read_locked():
+            count = self.generation - generation
+            if count == 0:
+                return []
+
+            # A generation from the future belongs to some other tree
+            if count < 0 or count > len(self.change_log):
+                return None
+
+            # Generations in the log are consecutive, the wanted entries
+            # are the last 'count' ones.
+            changes = []
+            for entry in reversed(self.change_log):
+                if len(changes) == count:
                     break
+                changes.append(entry)
+
+            changes.reverse()
+            return changes
+
+    def GetDirectorySnapshot(self):
+        """
+        Return a TreeSnapshot of the folders in the tree. Nothing is
+        copied: only the folders that changed since the last snapshot
+        are built again, the rest is shared with earlier snapshots.
+        Readers can walk the snapshot without any lock while the tree
+        keeps changing.
+        """
+        with self.lock.read_locked():
+            stack = [(self.root_node, False)]
+            while stack:
+                folder, children_done = stack.pop()
+                if folder.snapshot is not None:
+                    continue
+
+                subfolders = [c for c in folder.GetChildren() if not c.IsFile()]
+                if children_done:
+                    folder.snapshot = FolderSnapshot(folder,
+                                                     tuple(c.snapshot for c in subfolders))
+                else:
+                    stack.append((folder, True))
+                    stack.extend((c, False) for c in subfolders if c.snapshot is None)
 
-    #This is really ugly. But while deleting child, the child list
-    #keeps modifying and for loop goes for a toss. The "recursive"
-    #function doesn't delete the root. So second call to get rid of
-    #root node as well.
-    def DeleteFolder(self, folder_id, FolderDeleteCallback=None):
-        try:
-            self.__DeleteFolder(folder_id, FolderDeleteCallback)
-            self.__DeleteFolder(folder_id, FolderDeleteCallback)
-        except:
-            raise
-        else:
-            return
+            return TreeSnapshot(self.root_node.snapshot)
 
     def PrintTree(self, folder_id):
         pnode = self.FindFolder(folder_id)
@@ -243,6 +627,33 @@ class GoogleDriveTree(object):
 
         print("%s" % pnode.GetName())
 
+def BuildDriveTree(files, root_id):
+    """
+    Build a GoogleDriveTree from a flat list of file metadata, as
+    returned by files().list, in one pass. Every item goes under its
+    first parent. Items not below 'root_id', the ID of My Drive, are
+    left out: shared with me, or in a folder that wasn't listed.
+    """
+    children = defaultdict(list)
+    for f in files:
+        parents = f.get('parents')
+        if parents:
+            pid = parents[0]
+            children['root' if pid == root_id else pid].append(f)
+
+    tree = GoogleDriveTree()
+    stack = ['root']
+    while stack:
+        pid = stack.pop()
+        for f in children.pop(pid, ()):
+            if f.get('mimeType') == FOLDER_MIME_TYPE:
+                tree.AddFolder(pid, f['id'], f['name'], f)
+                stack.append(f['id'])
+            else:
+                tree.AddFile(pid, f['id'], f['name'], f)
+
+    return tree
+
 
 #DRIVER CODE
 #tree = GoogleDriveTree()
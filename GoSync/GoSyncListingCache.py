@@ -0,0 +1,89 @@
+# gosync is an open source Google Drive(TM) sync application for Linux
+#
+# Copyright (C) 2015 Himanshu Chauhan
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+import threading
+from collections import OrderedDict
+
+DEFAULT_LISTING_CACHE_SIZE = 4096
+
+class ListingCache(object):
+    """
+    Bounded LRU cache of remote name lookups: (parent id, name) -> the
+    items called 'name' in that folder, as Drive returned them. An
+    empty list is a negative entry: Drive had nothing by that name.
+
+    Entries must be dropped with Invalidate() whenever something with
+    that name appears in or leaves the folder. GetEntries() and
+    SetEntries() save and restore the cache, oldest entry first.
+    Negative entries are not saved: something by that name may be
+    created while GoSync isn't running, and the change feed only tells
+    once the first sync is done, too late for a lookup made before.
+    """
+    def __init__(self, max_entries=DEFAULT_LISTING_CACHE_SIZE):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        # Changed since the last GetEntries()
+        self.dirty = False
+        self.hits = 0
+        self.misses = 0
+
+    def Get(self, parent, name):
+        """
+        Return (True, items) on a hit, (False, None) on a miss.
+        """
+        key = (parent, name)
+        with self.lock:
+            items = self.entries.get(key)
+            if items is None:
+                self.misses += 1
+                return False, None
+
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return True, items
+
+    def Put(self, parent, name, items):
+        with self.lock:
+            self.entries[(parent, name)] = list(items)
+            self.entries.move_to_end((parent, name))
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+            self.dirty = True
+
+    def Invalidate(self, parent, name):
+        with self.lock:
+            if self.entries.pop((parent, name), None) is not None:
+                self.dirty = True
+
+    def Clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.dirty = True
+
+    def GetEntries(self):
+        with self.lock:
+            self.dirty = False
+            return [[parent, name, items] for (parent, name), items in self.entries.items() if items]
+
+    def SetEntries(self, entries):
+        with self.lock:
+            self.entries.clear()
+            for parent, name, items in entries[-self.max_entries:]:
+                self.entries[(parent, name)] = items
+            self.dirty = False
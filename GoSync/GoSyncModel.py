@@ -20,9 +20,6 @@ import sys, os, wx, ntpath, threading, hashlib, time, copy, io, re
 import shutil, traceback
 if sys.version_info > (3,):
     long = int
-    import urllib.request
-else:
-    import urllib2
 
 from os.path import expanduser
 from watchdog.observers import Observer
@@ -31,19 +28,41 @@ from threading import Thread
 from apiclient.errors import HttpError
 from apiclient import errors
 from apiclient.http import MediaFileUpload
-from apiclient.http import MediaIoBaseDownload
 import logging
-from googleapiclient.discovery import build
-from google_auth_oauthlib.flow import InstalledAppFlow
-from google.auth.transport.requests import Request
 import json, pickle
 try :
-	from .GoSyncDriveTree import GoogleDriveTree
+	from .GoSyncDriveTree import GoogleDriveTree, BuildDriveTree
+	from .GoSyncStateStore import StateStore, StateStoreFailed
+	from .GoSyncUsage import *
+	from .GoSyncSearchIndex import SearchIndex
+	from .GoSyncBatch import BatchRequestEngine
+	from .GoSyncRequestGate import RequestGate
+	from .GoSyncConcurrency import AIMDLimit
+	from .GoSyncDriveClient import DriveClientFactory, TransferStalled
+	from .GoSyncCancel import CancelToken, SyncCancelled
+	from .GoSyncCredentials import CredentialManager
+	from .GoSyncConnectivity import ConnectivityMonitor
+	from .GoSyncCrawler import *
+	from .GoSyncListingCache import ListingCache
+	from . import GoSyncRemoteChanges
 	from .defines import *
 	from .GoSyncEvents import *
 	from .GoSyncUtils import *
 except (ImportError, ValueError):
-	from GoSyncDriveTree import GoogleDriveTree
+	from GoSyncDriveTree import GoogleDriveTree, BuildDriveTree
+	from GoSyncStateStore import StateStore, StateStoreFailed
+	from GoSyncUsage import *
+	from GoSyncSearchIndex import SearchIndex
+	from GoSyncBatch import BatchRequestEngine
+	from GoSyncRequestGate import RequestGate
+	from GoSyncConcurrency import AIMDLimit
+	from GoSyncDriveClient import DriveClientFactory, TransferStalled
+	from GoSyncCancel import CancelToken, SyncCancelled
+	from GoSyncCredentials import CredentialManager
+	from GoSyncConnectivity import ConnectivityMonitor
+	from GoSyncCrawler import *
+	from GoSyncListingCache import ListingCache
+	import GoSyncRemoteChanges
 	from defines import *
 	from GoSyncEvents import *
 	from GoSyncUtils import *
@@ -84,19 +103,29 @@ class FilesInConflict(Exception):
     """The remote and local files have different MD5SUM """
 class FileMissingInLocalCache(Exception):
     """Raised when the file is missing in the local cache"""
+class DownloadCorrupted(RuntimeError):
+    """A downloaded file doesn't match the size or MD5 checksum on Drive"""
 
-audio_file_mimelist = ['audio/mpeg', 'audio/x-mpeg-3', 'audio/mpeg3', 'audio/aiff', 'audio/x-aiff', 'audio/m4a', 'audio/mp4', 'audio/flac', 'audio/mp3']
-movie_file_mimelist = ['video/mp4', 'video/x-msvideo', 'video/mpeg', 'video/flv', 'video/quicktime', 'video/mkv']
-image_file_mimelist = ['image/png', 'image/jpeg', 'image/jpg', 'image/tiff']
-document_file_mimelist = ['application/powerpoint', 'applciation/mspowerpoint', \
-                              'application/x-mspowerpoint', 'application/pdf', \
-                              'application/x-dvi', 'application/vnd.ms-htmlhelp', \
-                          'application/x-mobipocket-ebook', \
-                          'application/vnd.ms-publisher']
-google_docs_re = 'application/vnd.google-apps'
 
 Default_Log_Level = 3
 
+# Changes fetched per page, and the fields of each change sync needs
+CHANGES_PAGE_SIZE = 1000
+# Fields of the files in listings
+FILE_LIST_FIELDS = 'id, name, parents, mimeType, size, md5Checksum'
+# Items fetched per page when listing the whole drive
+DRIVE_SCAN_PAGE_SIZE = 1000
+CHANGES_FIELDS = ('nextPageToken, newStartPageToken, '
+                  'changes(fileId, removed, file(id, name, mimeType, trashed, parents, size, md5Checksum))')
+# Downloads and uploads in flight to start with, and at most
+TRANSFER_LIMIT_INITIAL = 2
+TRANSFER_LIMIT_MAX = 8
+# Uploads are sent in chunks of this size (a multiple of 256 KiB), the
+# cancel token being checked in between
+UPLOAD_CHUNK_SIZE = 4 * 1024 * 1024
+# Bytes of a file hashed between two looks at the cancel token
+HASH_BLOCK_SIZE = 1024 * 1024
+
 class GoSyncModel(object):
     def __init__(self):
         self.calculatingDriveUsage = False
@@ -125,10 +154,48 @@ class GoSyncModel(object):
         self.check_local_against_dc = True
         self.in_conflict_server_presides = True
         self.new_sync_selection = []
+        # Folder listings SyncRemoteDirectory starts with at once (the
+        # listing limit adapts from there), and in which order, see
+        # RemoteCrawler
+        self.crawl_workers = DEFAULT_CRAWL_WORKERS
+        self.crawl_order = CRAWL_BREADTH_FIRST
+        # CredentialManager shared by every Drive client, keeping the
+        # access token fresh in the background
+        self.credentials = None
+        self.credentials_save_lock = threading.Lock()
+        # Drive service of each thread, see DriveClientFactory
+        self.client_factory = None
+        # Whether Drive can be reached, learnt from the calls made
+        self.connectivity = ConnectivityMonitor(on_change=self.OnConnectivityChange)
+        # Every Drive call goes through here, see RequestGate
+        self.request_gate = RequestGate(monitor=self.connectivity)
+        # Requests of each kind allowed in flight at once, adjusted as
+        # they complete, see AIMDLimit
+        self.listing_limit = AIMDLimit('listing', DEFAULT_CRAWL_WORKERS,
+                                       maximum=MAX_CRAWL_WORKERS, log=self.SendlToLog)
+        self.download_limit = AIMDLimit('download', TRANSFER_LIMIT_INITIAL,
+                                        maximum=TRANSFER_LIMIT_MAX, log=self.SendlToLog)
+        self.upload_limit = AIMDLimit('upload', TRANSFER_LIMIT_INITIAL,
+                                      maximum=TRANSFER_LIMIT_MAX, log=self.SendlToLog)
+        self.root_id = None
+        # Remote name lookups that missed the drive tree, see
+        # FindChildOnDrive()
+        self.listing_cache = ListingCache()
+        # Changes read from the change feed since start, how many of them
+        # were outside the sync selection and how many needed their path
+        # looked up on remote
+        self.changes_seen = 0
+        self.changes_filtered = 0
+        self.changes_looked_up = 0
+        # Cancelled when sync is paused or GoSync shuts down, see
+        # CancelToken. StartSync() puts a new one in place.
+        self.cancel_token = CancelToken()
 
         self.config_path = os.path.join(os.environ['HOME'], ".gosync")
         self.credential_file = os.path.join(self.config_path, "credentials.json")
         self.client_pickle = os.path.join(self.config_path, "token.pickle")
+        # Account details of the last run, see LoadCachedAbout()
+        self.about_cache_file = os.path.join(self.config_path, "about.json")
         self.settings_file = os.path.join(self.config_path, "settings.yaml")
         self.base_mirror_directory = os.path.join(os.environ['HOME'], "Google Drive")
         self.client_secret_file = os.path.join(os.environ['HOME'], '.gosync', 'client_secrets.json')
@@ -140,11 +207,11 @@ class GoSyncModel(object):
         self.config=None
         self.LargeFileSize = 250000000
         self.last_page_token = None
-        self.gd_regex = re.compile(google_docs_re, re.IGNORECASE)
-        self.aud_regex = re.compile('audio', re.IGNORECASE)
-        self.vid_regex = re.compile('video', re.IGNORECASE)
-        self.img_regex = re.compile('image', re.IGNORECASE)
-        self.doc_regex = re.compile('officedocument', re.IGNORECASE)
+        # Usage snapshot of the drive tree, see GetUsageSnapshot()
+        self.usage_snapshot = None
+        self.usage_snapshot_tree = None
+        # Filename index of the drive tree, see SearchDrive()
+        self.search_index = None
 
         self.logger = logging.getLogger(APP_NAME + APP_VERSION)
         self.logger.setLevel(logging.DEBUG)
@@ -156,7 +223,11 @@ class GoSyncModel(object):
 
         self.SendlToLog(3,"Initialize - Started Initialize")
 
-        if not self.IsInternetReachable():
+        # With the account details of the last run at hand nothing needs
+        # the network before the window is up. They are refreshed when
+        # the sync thread starts.
+        self.about_drive = self.LoadCachedAbout()
+        if self.about_drive is None and not self.IsInternetReachable():
             raise InternetNotReachable()
 
         if not os.path.exists(self.config_path):
@@ -190,23 +261,23 @@ class GoSyncModel(object):
         self.observer = Observer()
         self.SendlToLog(2, "Initialize - Going for authentication")
         self.DoAuthenticate()
-        self.RetrieveAbout_Drive()
+        if self.about_drive is None:
+            self.RetrieveAbout_Drive()
         self.SendlToLog(2,"Initialize - Completed Drive Quota Execution")
 
         self.user_email = self.about_drive['user']['emailAddress']
         self.SendlToLog(3,"Initialize - Completed Account Information Load")
 
+        # Tree pickle of older versions. Only read once to migrate it to
+        # the state store.
         self.tree_pickle_file = os.path.join(self.config_path, 'gtree-' + self.user_email + '.pick')
+        self.state_db_file = os.path.join(self.config_path, 'state-' + self.user_email + '.db')
+        self.state_store = StateStore(self.state_db_file)
+        self.SendlToLog(3, "Initialize - Opened state store %s" % self.state_db_file)
+        self.listing_cache.SetEntries(self.state_store.GetValue('listing_cache', []))
 
-        self.SendlToLog(3, "Initialize - Loaded tree pickle")
-
-        if not os.path.exists(self.config_file):
-            self.SendlToLog(3, "Initialize - Creating default config file")
-            self.CreateDefaultConfigFile()
-            self.SendlToLog(3,"Initialize - Completed Default Config File Creation")
-#todo : add default config logic in method
         try:
-            self.SendlToLog(3, "Initialize - Trying to load config file %s" % self.config_file)
+            self.SendlToLog(3, "Initialize - Trying to load configuration")
             self.LoadConfig()
             self.SendlToLog(3,"Initialize - Read %s as base mirror" % self.base_mirror_directory)
             if not os.path.exists(self.base_mirror_directory):
@@ -240,17 +311,14 @@ class GoSyncModel(object):
         self.usageCalculateEvent = threading.Event()
         self.usageCalculateEvent.set()
 
-        if not os.path.exists(self.tree_pickle_file):
-            self.driveTree = GoogleDriveTree()
+        # The tree is loaded from the state store on first use, see
+        # GetDriveTree()
+        self._drive_tree = None
+        self.drive_tree_lock = threading.Lock()
+        if not self.state_store.HasTree() and not os.path.exists(self.tree_pickle_file):
             #Until driveTree is present, GoSync cannot autostart.
             self.can_autostart = False
-        else:
-            try:
-                self.driveTree = pickle.load(open(self.tree_pickle_file, "rb"))
-            except:
-                self.driveTree = GoogleDriveTree()
-                self.can_autostart = False
-        self.SendlToLog(3,"Initialize - Completed GoogleDriveTree File")
+        self.SendlToLog(3,"Initialize - Completed GoogleDriveTree check")
         self.SendlToLog(3,"Initialize - Completed Initialize")
 
 # Sends Log Level Message to Log File
@@ -265,13 +333,55 @@ class GoSyncModel(object):
                 self.logger.error(LogMsg)
 
     def RetrieveAbout_Drive(self):
-        self.about_drive = self.drive.about().get(fields='user, storageQuota').execute()
+        self.about_drive = self.Execute(self.drive.about().get(fields='user, storageQuota'))
         #test test
         #self.about_drive['storageQuota'].pop('limit')
         #with GSuite for Business there is no Storage Limit, set limit to usage
         if ('limit' not in self.about_drive['storageQuota']) :
             self.about_drive['storageQuota']['limit'] = self.about_drive['storageQuota']['usage']
 
+        try:
+            tmp_file = self.about_cache_file + '.tmp'
+            with open(tmp_file, 'w') as f:
+                json.dump(self.about_drive, f)
+            os.replace(tmp_file, self.about_cache_file)
+        except (OSError, ValueError):
+            self.SendlToLog(1, "RetrieveAbout_Drive - Failed to save %s" % self.about_cache_file)
+
+    def SaveCredentials(self, creds):
+        """
+        Save 'creds' for the next run. Called by the CredentialManager
+        from a thread of its own after every refresh.
+        """
+        self.SendlToLog(3, "Authenticate - Saving pickle file")
+        with self.credentials_save_lock:
+            try:
+                tmp_file = self.client_pickle + '.tmp'
+                with open(tmp_file, 'wb') as token:
+                    pickle.dump(creds, token)
+                os.replace(tmp_file, self.client_pickle)
+            except (OSError, pickle.PicklingError):
+                self.SendlToLog(1, "Authenticate - Failed to save %s" % self.client_pickle)
+
+    def LoadCachedAbout(self):
+        """
+        Return the account details saved by the last RetrieveAbout_Drive(),
+        or None if there are none or no saved login to go with them.
+        """
+        if not os.path.exists(self.client_pickle) or not os.path.exists(self.about_cache_file):
+            return None
+
+        try:
+            with open(self.about_cache_file) as f:
+                about = json.load(f)
+            about['user']['emailAddress']
+            about['storageQuota']['limit']
+        except (OSError, ValueError, KeyError, TypeError):
+            self.SendlToLog(1, "LoadCachedAbout - Ignoring unreadable %s" % self.about_cache_file)
+            return None
+
+        return about
+
     def SetTheBallRolling(self):
         #if we can autostart and user has selected autostart
         #then auto start the sync
@@ -287,6 +397,10 @@ class GoSyncModel(object):
 
     def StopTheShow(self):
         self.shutting_down = True
+        self.cancel_token.Cancel()
+        self.AbortRequests()
+        if self.credentials is not None:
+            self.credentials.Stop()
         self.observer.unschedule_all()
         # Wakeup the threads if they are sleeping
         # so that they can exit
@@ -297,30 +411,89 @@ class GoSyncModel(object):
     def IsUserLoggedIn(self):
         return self.is_logged_in
 
-    def HashOfFile(self, abs_filepath):
-        data = open(abs_filepath, "rb").read()
-        return hashlib.md5(data).hexdigest()
+    def HashOfFile(self, abs_filepath, cancel=None):
+        md5 = hashlib.md5()
+        with open(abs_filepath, "rb") as f:
+            for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b''):
+                if cancel is not None:
+                    cancel.Check()
+                md5.update(block)
+        return md5.hexdigest()
+
+    def GetDriveTree(self):
+        if self._drive_tree is None:
+            with self.drive_tree_lock:
+                if self._drive_tree is None:
+                    self._drive_tree = self.LoadDriveTree()
+        return self._drive_tree
+
+    def SetDriveTree(self, tree):
+        self._drive_tree = tree
+
+    driveTree = property(GetDriveTree, SetDriveTree)
+
+    def LoadDriveTree(self):
+        if self.state_store.HasTree():
+            self.SendlToLog(3, "LoadDriveTree - Loading tree from state store")
+            try:
+                return self.state_store.LoadTree()
+            except:
+                self.SendlToLog(1, "LoadDriveTree - Failed to load tree from state store")
+                return GoogleDriveTree()
+
+        if os.path.exists(self.tree_pickle_file):
+            self.SendlToLog(2, "LoadDriveTree - Migrating %s to state store" % self.tree_pickle_file)
+            try:
+                tree = pickle.load(open(self.tree_pickle_file, "rb"))
+                self.state_store.Save(tree)
+                os.remove(self.tree_pickle_file)
+                return tree
+            except:
+                self.SendlToLog(1, "LoadDriveTree - Failed to migrate tree pickle")
+
+        return GoogleDriveTree()
+
+    def CreateDefaultConfig(self):
+        config_dict = {}
+        config_dict['Sync Selection'] = [['root', '']]
+        config_dict['SyncInterval'] = 1800
+        config_dict['AutoStartSync'] = False
+        config_dict['UseSystemNotif'] = True
+        config_dict['BaseMirrorDirectory'] = self.base_mirror_directory
+        config_dict['LogLevel'] = Default_Log_Level
+        config_dict['LastPageToken'] = None
+        config_dict['CrawlWorkers'] = DEFAULT_CRAWL_WORKERS
+        config_dict['CrawlOrder'] = CRAWL_BREADTH_FIRST
+        return config_dict
+
+    def LoadLegacyConfig(self):
+        """
+        Return the configuration of this account from the gosyncrc file
+        used by older versions, or the default configuration.
+        """
+        if os.path.exists(self.config_file):
+            self.SendlToLog(2, "LoadLegacyConfig - Migrating %s to state store" % self.config_file)
+            f = open(self.config_file, 'r')
+            self.account_dict = json.load(f)
+            f.close()
+            if self.user_email in self.account_dict:
+                return self.account_dict[self.user_email]
 
-    def CreateDefaultConfigFile(self):
-        f = open(self.config_file, 'w')
-        self.config_dict['Sync Selection'] = [['root', '']]
-        self.config_dict['SyncInterval'] = 1800
-        self.config_dict['AutoStartSync'] = False
-        self.config_dict['UseSystemNotif'] = True
-        self.config_dict['BaseMirrorDirectory'] = self.base_mirror_directory
-        self.config_dict['LogLevel'] = Default_Log_Level
-        self.config_dict['LastPageToken'] = None
-        self.account_dict[self.user_email] = self.config_dict
-        json.dump(self.account_dict, f)
-        f.close()
+        self.SendlToLog(3, "LoadLegacyConfig - Creating default configuration")
+        return self.CreateDefaultConfig()
 
     def LoadConfig(self):
         try:
-            f = open(self.config_file, 'r')
             try:
-                self.config = json.load(f)
+                self.config_dict = self.state_store.GetValue('settings')
+                migrated = self.config_dict is None
+                if migrated:
+                    self.config_dict = self.LoadLegacyConfig()
+                else:
+                    self.config_dict['LastPageToken'] = self.state_store.GetValue('last_page_token')
+                    self.config_dict['Sync Selection'] = self.state_store.GetValue('sync_selection',
+                                                                                  [['root', '']])
                 try:
-                    self.config_dict = self.config[self.user_email]
                     if self.config_dict['SyncInterval']:
                         self.sync_interval = self.config_dict['SyncInterval']
                         if self.sync_interval < 30 or self.sync_interval > (24*60*60):
@@ -329,6 +502,11 @@ class GoSyncModel(object):
 
                     self.SendlToLog(3, "Sync Interval: %d seconds" % self.sync_interval)
 
+                    self.crawl_workers = self.config_dict.get('CrawlWorkers', DEFAULT_CRAWL_WORKERS)
+                    self.listing_limit.SetLimit(self.crawl_workers, 'settings')
+                    if self.config_dict.get('CrawlOrder') in (CRAWL_BREADTH_FIRST, CRAWL_DEPTH_FIRST):
+                        self.crawl_order = self.config_dict['CrawlOrder']
+
                     if self.config_dict['LastPageToken']:
                         self.last_page_token = self.config_dict['LastPageToken']
                         self.SendlToLog(3, "Last Page Token %s" % self.last_page_token)
@@ -378,6 +556,10 @@ class GoSyncModel(object):
                         self.driveDocumentUsage = self.drive_usage_dict['Document Size']
                         self.drivePhotoUsage = self.drive_usage_dict['Photo Size']
                         self.driveOthersUsage = self.drive_usage_dict['Others Size']
+                        if 'Files Scanned' not in self.drive_usage_dict:
+                            # Scanned before the files were kept in the drive
+                            # tree. Show these numbers until a new scan is done.
+                            self.drive_usage_dict = {}
 
                         # TODO: This isn't right place for UI components
                         self.use_system_notif = self.config_dict['UseSystemNotif']
@@ -388,15 +570,19 @@ class GoSyncModel(object):
                 except:
                     pass
 
-                f.close()
+                if migrated:
+                    self.SaveConfig()
             except:
                 raise ConfigLoadFailed()
         except:
             raise ConfigLoadFailed()
 
     def SaveConfig(self):
-        f = open(self.config_file, 'w')
-        f.truncate()
+        """
+        Save the configuration and the changes to the drive tree in one
+        transaction, so that the stored page token never gets ahead of
+        the stored tree.
+        """
         self.config_dict['AutoStartSync'] = self.auto_start_sync
         self.config_dict['BaseMirrorDirectory'] = self.base_mirror_directory
         self.config_dict['SyncInterval'] = self.sync_interval
@@ -404,15 +590,27 @@ class GoSyncModel(object):
         self.config_dict['LogLevel'] = self.Log_Level
         self.config_dict['LastPageToken'] = self.last_page_token
         self.config_dict['ServerPresides'] = self.in_conflict_server_presides
+        self.config_dict['CrawlWorkers'] = self.crawl_workers
+        self.config_dict['CrawlOrder'] = self.crawl_order
         if not self.sync_selection:
             self.config_dict['Sync Selection'] = [['root', '']]
         else:
             self.config_dict['Sync Selection'] = self.sync_selection
 
-        self.account_dict[self.user_email] = self.config_dict
+        settings = dict(self.config_dict)
+        settings.pop('LastPageToken', None)
+        settings.pop('Sync Selection', None)
+        values = {'settings': settings,
+                  'last_page_token': self.last_page_token,
+                  'sync_selection': self.config_dict['Sync Selection']}
+        if self.listing_cache.dirty:
+            values['listing_cache'] = self.listing_cache.GetEntries()
 
-        json.dump(self.account_dict, f)
-        f.close()
+        # A tree that was never loaded has nothing to save
+        self.state_store.Save(self._drive_tree, values)
+
+    def SaveState(self):
+        self.SaveConfig()
 
     def AskChooseCredentialsFile(self):
         dial = wx.MessageDialog(None, 'No Credentials file was found!\n\nDo you want to load one?\n',
@@ -461,10 +659,13 @@ class GoSyncModel(object):
             # If there are no (valid) credentials available, let the user log in.
             if not creds or not creds.valid:
                 if creds and creds.expired and creds.refresh_token:
-                    self.SendlToLog(2, "Authenticate - expired. Refreshing")
-                    creds.refresh(Request())
+                    # The credential manager refreshes the token in the
+                    # background, startup doesn't have to wait for it
+                    self.SendlToLog(2, "Authenticate - expired. Refreshing in the background")
                 else:
                     self.SendlToLog(2, "Authenticate - New authentication")
+                    # Only needed to log in, and slow to import
+                    from google_auth_oauthlib.flow import InstalledAppFlow
                     try:
                         self.SendlToLog(2, "Authenticate - File %s" % (self.credential_file))
                         flow = InstalledAppFlow.from_client_secrets_file(self.credential_file, SCOPES)
@@ -479,25 +680,30 @@ class GoSyncModel(object):
                         self.SendlToLog(2, "Authenticate - Failed to connect to local authentication server")
                         raise
 
-                self.SendlToLog(2, "Authenticate - Saving pickle file")
-                # Save the credentials for the next run
-                with open(self.client_pickle, 'wb') as token:
-                    pickle.dump(creds, token)
+                    self.SaveCredentials(creds)
 
             self.SendlToLog(2, "Authenticate - Building service")
             try:
-                service = build('drive', 'v3', credentials=creds)
+                manager = CredentialManager(creds, self.SaveCredentials, self.SendlToLog)
+                factory = DriveClientFactory(manager)
+                service = factory.GetService()
                 self.SendlToLog(2, "Authenticate - service built successfully!")
             except:
                 self.SendlToLog(2, "Authenticate - service built failed. Going for re-authentication")
                 try:
+                    from google_auth_oauthlib.flow import InstalledAppFlow
                     flow = InstalledAppFlow.from_client_secrets_file(self.credential_file, SCOPES)
                     creds = flow.run_local_server(port=0)
-                    service = build('drive', 'v3', credentials=creds)
+                    self.SaveCredentials(creds)
+                    manager = CredentialManager(creds, self.SaveCredentials, self.SendlToLog)
+                    factory = DriveClientFactory(manager)
+                    service = factory.GetService()
                 except:
                     raise AuthenticationFailed()
 
-            self.drive = service
+            manager.Start()
+            self.credentials = manager
+            self.client_factory = factory
             self.is_logged_in = True
             return service
         except:
@@ -507,8 +713,39 @@ class GoSyncModel(object):
             self.is_logged_in = False
             pass
 
+    @property
+    def drive(self):
+        """
+        The Drive service of the calling thread. The services of all
+        threads share one connection pool, so any thread may make calls
+        at any time.
+        """
+        return self.client_factory.GetService()
+
+    def Execute(self, request, limit=None, cancel=None):
+        """
+        Execute an API request through the request gate, within 'limit'
+        if given. SyncCancelled is raised if 'cancel' is cancelled first.
+        """
+        return self.request_gate.Execute(request.execute, limit=limit, cancel=cancel)
+
+    def UploadMedia(self, request, cancel=None):
+        """
+        Send the resumable upload 'request' a chunk at a time, each
+        through the request gate within the upload limit, and return the
+        file Drive answers with at the end. 'cancel' is checked between
+        chunks.
+        """
+        response = None
+        while response is None:
+            _, response = self.request_gate.Execute(request.next_chunk, limit=self.upload_limit,
+                                                    cancel=cancel)
+        return response
+
     def DoUnAuthenticate(self):
             self.do_sync = False
+            if self.credentials is not None:
+                self.credentials.Stop()
             self.observer.unschedule(self.iobserv_handle)
             self.iobserv_handle = None
             os.remove(self.credential_file)
@@ -523,7 +760,7 @@ class GoSyncModel(object):
 
     def GetStartPageToken(self):
         try:
-            response = self.drive.changes().getStartPageToken().execute()
+            response = self.Execute(self.drive.changes().getStartPageToken())
         except:
             return None
         else:
@@ -533,7 +770,10 @@ class GoSyncModel(object):
         file_metadata = {'name': dirname,
                         'mimeType':'application/vnd.google-apps.folder'}
         file_metadata['parents'] = [parent_id]
-        upfile = self.drive.files().create(body=file_metadata, fields='id').execute()
+        upfile = self.Execute(self.drive.files().create(body=file_metadata,
+                                                        fields='id, name, mimeType, parents'))
+        self.ForgetRemoteName(parent_id, dirname)
+        self.AddToDriveTree(parent_id, upfile)
 
     def CreateDirectoryByPath(self, dirpath, recursive=False, absolute=True):
         self.SendlToLog(3,"create directory: %s\n" % dirpath)
@@ -571,24 +811,28 @@ class GoSyncModel(object):
         except FileListQueryFailed:
             raise FileListQueryFailed()
 
-    def UpdateRegularFile(self, fid, file_path):
+    def UpdateRegularFile(self, fid, file_path, cancel=None):
         self.SendlToLog(3, "UpdateRegularFile - File Path %s File ID: %s" % (file_path, fid))
         filename = self.PathLeaf(file_path)
-        media = MediaFileUpload(file_path, resumable=True)
-        uf = self.drive.files().create(fileId=fid,
-                                       media_body=media,
-                                       fields='id, name, parents, mimeType, size, md5Checksum').execute()
+        media = MediaFileUpload(file_path, chunksize=UPLOAD_CHUNK_SIZE, resumable=True)
+        uf = self.UploadMedia(self.drive.files().create(fileId=fid,
+                                                        media_body=media,
+                                                        fields='id, name, parents, mimeType, size, md5Checksum'),
+                              cancel)
         return uf
 
-    def CreateRegularFile(self, file_path, parent='root', uploaded=False):
+    def CreateRegularFile(self, file_path, parent='root', uploaded=False, cancel=None):
         self.SendlToLog(3,"CreateRegularFile: Create file %s\n" % file_path)
         filename = self.PathLeaf(file_path)
         file_metadata = {'name': filename}
         file_metadata['parents'] = [parent]
-        media = MediaFileUpload(file_path, resumable=True)
-        upfile = self.drive.files().create(body=file_metadata,
-                                    media_body=media,
-                                    fields='id, name, parents, mimeType, size, md5Checksum').execute()
+        media = MediaFileUpload(file_path, chunksize=UPLOAD_CHUNK_SIZE, resumable=True)
+        upfile = self.UploadMedia(self.drive.files().create(body=file_metadata,
+                                                            media_body=media,
+                                                            fields='id, name, parents, mimeType, size, md5Checksum'),
+                                  cancel)
+        self.ForgetRemoteName(parent, filename)
+        self.AddToDriveTree(parent, upfile)
         return upfile
 
     def GetRelativeFolder(self, file_path, IsFolder=False):
@@ -631,11 +875,8 @@ class GoSyncModel(object):
                 break
             except InternetNotReachable:
                 self.SendlToLog(1, "UploadFolder: Internet down")
-                while True:
-                    time.sleep(5)
-                    if not self.IsInternetReachable():
-                        continue
-                    break
+                if not self.connectivity.WaitUntilUp(lambda: self.shutting_down):
+                    raise
                 continue
             except FileListQueryFailed:
                 time.sleep(5)
@@ -733,9 +974,15 @@ class GoSyncModel(object):
         try:
             file = {'name': new_title}
 
-            updated_file = self.drive.files().update( body= file,
-                                                         fileId=file_object['id'],
-                                                         fields='id, appProperties').execute()
+            updated_file = self.Execute(self.drive.files().update(body=file,
+                                                                  fileId=file_object['id'],
+                                                                  fields='id, appProperties'))
+            for parent in file_object.get('parents', []):
+                self.ForgetRemoteName(parent, file_object['name'])
+                self.ForgetRemoteName(parent, new_title)
+            node = self.driveTree.FindFile(file_object['id'])
+            if node is not None:
+                self.driveTree.MoveNode(node.GetId(), node.GetParentId(), new_title)
             return updated_file
         except errors.HttpError as error:
             self.SendlToLog(1,'An error occurred while renaming file: %s' % error)
@@ -762,8 +1009,12 @@ class GoSyncModel(object):
     def TrashFile(self, file_object):
         try:
             file_metadata = {'trashed':True}
-            self.drive.files().update(body=file_metadata,fileId=file_object['id']).execute()
+            self.Execute(self.drive.files().update(body=file_metadata,fileId=file_object['id']))
             self.SendlToLog(3,{"TRASH_FILE: File %s deleted successfully.\n" % file_object['name']})
+            for parent in file_object.get('parents', []):
+                self.ForgetRemoteName(parent, file_object['name'])
+            if self.driveTree.FindFile(file_object['id']) is not None:
+                self.driveTree.DeleteFolder(file_object['id'])
         except errors.HttpError as error:
             self.SendlToLog(1,"TRASH_FILE: HTTP Error\n")
             raise RegularFileTrashFailed()
@@ -794,8 +1045,8 @@ class GoSyncModel(object):
                     self.SendlToLog(3, "Deleting folder %s (%s) from local drive tree"
                                     % (self.GetRelativeFolder(file_path), ftd['id']))
                     try:
-                        self.driveTree.DeleteFolder(ftd['id'], self.TrashFileCallback)
-                        self.SendlToLog(3, "DriveTree folder deleted. Updating sync tree in UI")
+                        removed = self.driveTree.DeleteFolder(ftd['id'], self.TrashFileCallback)
+                        self.SendlToLog(3, "DriveTree folder deleted (%d entries). Updating sync tree in UI" % len(removed))
                         GoSyncEventController().PostEvent(GOSYNC_EVENT_CALCULATE_USAGE_DONE, 0)
                         self.SendlToLog(3, "Signal sent to UI")
                     except:
@@ -831,12 +1082,27 @@ class GoSyncModel(object):
             else:
                 sid = 'root'
 
-            updated_file = self.drive.files().update(fileId=src_file['id'],
-                                    addParents=did,
-                                    removeParents=sid,
-                                    fields='id, parents').execute()
+            updated_file = self.Execute(self.drive.files().update(fileId=src_file['id'],
+                                                                  addParents=did,
+                                                                  removeParents=sid,
+                                                                  fields='id, parents'))
         except:
             self.logger.exception("move failed\n")
+            return
+
+        self.ForgetRemoteName(sid, src_file['name'])
+        self.ForgetRemoteName(did, src_file['name'])
+        if did == self.root_id:
+            did = 'root'
+        node = self.driveTree.FindFile(src_file['id'])
+        if node is None:
+            return
+        dest = self.driveTree.FindFolder(did)
+        if dest is not None and not dest.IsFile():
+            self.driveTree.MoveNode(node.GetId(), did)
+        else:
+            # Moved out of the part of the drive the tree knows about
+            self.driveTree.DeleteFolder(node.GetId())
 
     def MoveObservedFile(self, src_path, dest_path):
         from_drive_path = src_path.split(self.mirror_directory+'/')[1]
@@ -910,12 +1176,10 @@ class GoSyncModel(object):
 #### LocateFileInFolder
     def LocateFileInFolder(self, filename, parent='root'):
         try:
-            self.SendlToLog(3, "LocateFileInFolder - Querying remote\n")
-            file_list = self.MakeFileListQuery("'%s' in parents and trashed=false" % parent)
-            for f in file_list:
-                if f['name'] == filename:
-                    self.SendlToLog(3, "LocateFileInFolder - Found\n")
-                    return f
+            f = self.FindChildOnDrive(filename, parent)
+            if f is not None:
+                self.SendlToLog(3, "LocateFileInFolder - Found\n")
+                return f
             self.SendlToLog(1, "LocateFileInFolder - %s not found\n" % filename)
             raise FileNotFound()
         except InternetNotReachable:
@@ -997,6 +1261,70 @@ class GoSyncModel(object):
 
         return folder
 
+    def ForgetRemoteName(self, parent, name):
+        """
+        Drop the cached lookup of 'name' in the folder 'parent'. Called
+        whenever something by that name appears in or leaves the folder.
+        """
+        if parent == self.root_id:
+            parent = 'root'
+        self.listing_cache.Invalidate(parent, name)
+
+    def ForgetChange(self, fid, fdata):
+        """
+        Drop the cached lookups a change from the change feed may have
+        made wrong: the old name of the file, as the drive tree still
+        has it, and the new one.
+        """
+        node = self.driveTree.FindFile(fid)
+        if node is not None and node.GetParentId() is not None:
+            self.ForgetRemoteName(node.GetParentId(), node.GetName())
+        if fdata and 'name' in fdata:
+            for parent in fdata.get('parents', []):
+                self.ForgetRemoteName(parent, fdata['name'])
+
+    def AddToDriveTree(self, parent, f):
+        """
+        Add a file or folder we created on remote to the drive tree, if
+        its parent folder is in the tree.
+        """
+        if parent == self.root_id:
+            parent = 'root'
+        GoSyncRemoteChanges.AddNodeToTree(self.driveTree, parent, f)
+
+    def FindChildOnDrive(self, name, parent='root', is_folder=False):
+        """
+        Return the file (or folder, if 'is_folder') called 'name' in the
+        remote folder 'parent', or None if there is none. The drive tree
+        is asked first, then the listing cache, and only then Drive,
+        with a query for that exact name. The answer of Drive, found or
+        not, goes into the cache.
+        """
+        if parent == self.root_id:
+            parent = 'root'
+
+        tree = self.driveTree
+        with tree.lock.read_locked():
+            pnode = tree.FindFolder(parent)
+            if pnode is not None and not pnode.IsFile():
+                node = pnode.GetChildByName(name, not is_folder)
+                if node is not None:
+                    return node.GetData()
+
+        hit, items = self.listing_cache.Get(parent, name)
+        if not hit:
+            self.SendlToLog(3, "FindChildOnDrive - Querying remote for %s in %s\n" % (name, parent))
+            escaped = name.replace('\\', '\\\\').replace("'", "\\'")
+            items = list(self.IterFileList("name = '%s' and '%s' in parents and trashed=false"
+                                           % (escaped, parent)))
+            self.listing_cache.Put(parent, name, items)
+
+        for f in items:
+            if (f['mimeType'] == 'application/vnd.google-apps.folder') == is_folder:
+                return f
+
+        return None
+
 #### GetFolderOnDrive
     def GetFolderOnDrive(self, folder_name, parent='root'):
         """
@@ -1005,11 +1333,10 @@ class GoSyncModel(object):
         """
         self.SendlToLog(3,"GetFolderOnDrive: Checking Folder (%s) on (%s)" % (folder_name, parent))
         try:
-            file_list = self.MakeFileListQuery("'%s' in parents and trashed=false"  % parent)
-            for f in file_list:
-                if f['name'] == folder_name and f['mimeType']=='application/vnd.google-apps.folder':
-                    self.SendlToLog(3,"GetFolderOnDrive: Found Folder (%s) on (%s)" % (folder_name, parent))
-                    return f
+            f = self.FindChildOnDrive(folder_name, parent, True)
+            if f is not None:
+                self.SendlToLog(3,"GetFolderOnDrive: Found Folder (%s) on (%s)" % (folder_name, parent))
+            return f
         except InternetNotReachable:
             raise
         except:
@@ -1054,9 +1381,60 @@ class GoSyncModel(object):
                     fid = response['parents']
                     continue
 
+    def GetFolderPathsOnDriveByID(self, fids, metadata=None, cancel=None):
+        """
+        Batched GetFolderPathOnDriveByID(). 'metadata' holds what is
+        already known, {id: metadata}. The missing ancestors of all
+        'fids' are fetched together, one batch per level. Returns
+        {id: path}; IDs whose path can't be found are left out.
+        'cancel' is passed on to GetFilesMetaDataByID().
+        """
+        meta = dict(metadata or {})
+
+        def Walk(fid):
+            # Return the list of ancestors of fid known so far, and the
+            # first ID up the chain that needs fetching (or None)
+            chain = []
+            while True:
+                if fid not in meta:
+                    return chain, fid
+                m = meta[fid]
+                if m is None:
+                    return None, None
+                if fid == self.root_id or m.get('name') == 'My Drive':
+                    return chain, None
+                chain.append(m['name'])
+                if not m.get('parents'):
+                    # Not below My Drive, e.g. shared with me
+                    return None, None
+                fid = m['parents'][0]
+
+        while True:
+            missing = set()
+            for fid in fids:
+                chain, next_id = Walk(fid)
+                if next_id is not None:
+                    missing.add(next_id)
+
+            if not missing:
+                break
+
+            found = self.GetFilesMetaDataByID(missing, cancel)
+            for fid in missing:
+                meta[fid] = found.get(fid)
+
+        paths = {}
+        for fid in fids:
+            chain, next_id = Walk(fid)
+            if chain is not None:
+                paths[fid] = ''.join('/' + name for name in reversed(chain))
+
+        return paths
+
 #### SyncLocalDirectory
     def SyncLocalDirectory(self):
-        if not self.syncRunning.is_set() or self.shutting_down:
+        cancel = self.cancel_token
+        if cancel.IsCancelled():
             self.SendlToLog(3,"SyncLocalDirectory: Sync has been paused. Aborting.\n")
             return
 
@@ -1064,7 +1442,7 @@ class GoSyncModel(object):
         for root, dirs, files in os.walk(self.mirror_directory):
             for names in files:
                 while True:
-                    if not self.syncRunning.is_set() or self.shutting_down:
+                    if cancel.IsCancelled():
                         self.SendlToLog(3,"SyncLocalDirectory: - file - Sync has been paused. Aborting.\n")
                         return
 
@@ -1089,16 +1467,9 @@ class GoSyncModel(object):
                                         return
                                     except InternetNotReachable:
                                         self.SendlToLog(2, "SyncLocalDirectory: - file - Network is down!\n")
-                                        GoSyncEventController().PostEvent(GOSYNC_EVENT_INTERNET_UNREACHABLE, 1)
-                                        while True:
-                                            if self.IsInternetReachable():
-                                                GoSyncEventController().PostEvent(GOSYNC_EVENT_INTERNET_UNREACHABLE, 0)
-                                                self.SendlToLog(2, "SyncLocalDirectory: - file - Network is up!\n")
-                                                break
-                                            else:
-                                                time.sleep(5)
-                                                continue
-                                            continue
+                                        if not self.connectivity.WaitUntilUp(cancel.IsCancelled):
+                                            return
+                                        self.SendlToLog(2, "SyncLocalDirectory: - file - Network is up!\n")
                                     except FileNotFound:
                                         self.SendlToLog(3, "SyncLocalDirectory: - file - File missing in local cache and in remote")
                                         raise
@@ -1118,7 +1489,7 @@ class GoSyncModel(object):
                                 f = f.GetData()
 
                         self.SendlToLog(3, "SyncLocalDirectory: - file - Found file drivepath: %s dirpath: %s" % (drivepath, dirpath))
-                        if f and self.HashOfFile(dirpath) == f['md5Checksum']:
+                        if f and self.HashOfFile(dirpath, cancel) == f['md5Checksum']:
                             self.SendlToLog(3,"SyncLocalDirectory: - file - Skipping Local File (%s) same as Remote\n" % dirpath)
                             raise FilesSame()
                         else:
@@ -1133,15 +1504,9 @@ class GoSyncModel(object):
                         return
                     except InternetNotReachable:
                         self.SendlToLog(2, "SyncLocalDirectory: - file - Network is down!\n")
-                        GoSyncEventController().PostEvent(GOSYNC_EVENT_INTERNET_UNREACHABLE, 1)
-                        while True:
-                            if self.IsInternetReachable():
-                                GoSyncEventController().PostEvent(GOSYNC_EVENT_INTERNET_UNREACHABLE, 0)
-                                self.SendlToLog(2, "SyncLocalDirectory: - file - Network is up!\n")
-                                break
-                            else:
-                                time.sleep(5)
-                                continue
+                        if not self.connectivity.WaitUntilUp(cancel.IsCancelled):
+                            return
+                        self.SendlToLog(2, "SyncLocalDirectory: - file - Network is up!\n")
                     except FilesSame:
                         self.SendlToLog(3, "SyncLocalDirectory: - file - Files are same")
                         break
@@ -1149,11 +1514,11 @@ class GoSyncModel(object):
                         if self.in_conflict_server_presides:
                             self.SendlToLog(2, "SyncLocalDirectory: - file - CONFLICT: User wants server to preside")
                             self.SendlToLog(2, "SyncLocalDirectory: - file - Downloading file %s: (root: %s)" % (dirpath, root))
-                            self.DownloadFileByObject(f, root)
+                            self.DownloadFileByObject(f, root, cancel)
                         else:
                             self.SendlToLog(2, "SyncLocalDirectory: - file - CONFLICT: User wants local to preside")
                             self.SendlToLog(2, "SyncLocalDirectory: - file - Updating file %s: (root: %s) on server" % (dirpath, root))
-                            f = self.UpdateRegularFile(f['id'], dirpath)
+                            f = self.UpdateRegularFile(f['id'], dirpath, cancel)
                         self.SendlToLog(3, "SyncLocalDirectory: - file - Adding file to local cache")
                         self.driveTree.AddFile(f['parents'][0], f['id'], f['name'], f)
                         self.SendlToLog(3, "- file - Done")
@@ -1176,12 +1541,15 @@ class GoSyncModel(object):
                     except FolderNotFound:
                         self.SendlToLog(3, "SyncLocalDirectory: - file - Folder not found for path %s. Aborting" % self.GetRelativeFolder(dirpath, False))
                         return
+                    except SyncCancelled:
+                        self.SendlToLog(3,"SyncLocalDirectory: - file - Sync has been paused. Aborting.\n")
+                        return
                     except:
                         self.SendlToLog(3, "SyncLocalDirectory: - file - Unknown exception")
 
             for names in dirs:
                 nf = None
-                if not self.syncRunning.is_set() or self.shutting_down:
+                if cancel.IsCancelled():
                     self.SendlToLog(3,"SyncLocalDirectory: - dir - Sync has been paused. Aborting.\n")
                     return
 
@@ -1240,124 +1608,181 @@ class GoSyncModel(object):
     #################################################
     ####### DOWNLOAD SECTION (Syncing remote) #######
     #################################################
-    def IsInternetReachable(self, host='http://www.google.com'):
+    def IsInternetReachable(self):
+        """
+        Return whether Drive can be reached, as far as the connectivity
+        monitor knows. This rarely goes to the network.
+        """
+        return self.connectivity.IsUp()
+
+    def OnConnectivityChange(self, up):
+        if up:
+            self.SendlToLog(2, "Connectivity - Drive is reachable again")
+            GoSyncEventController().PostEvent(GOSYNC_EVENT_INTERNET_UNREACHABLE, 0)
+        else:
+            self.SendlToLog(2, "Connectivity - Drive is not reachable")
+            GoSyncEventController().PostEvent(GOSYNC_EVENT_INTERNET_UNREACHABLE, 1)
+
+    def GetFileMetaDataByID(self, fid):
+        """
+        Return the metadata of the file 'fid'. Transient errors are
+        retried by the request gate; FileNotFound, InternetNotReachable
+        or FileListQueryFailed is raised for the rest.
+        """
+        self.SendlToLog(3, "GetFileMetaDataByID - FileID: %s" % fid)
         try:
-            if sys.version_info > (3,):
-                urllib.request.urlopen(host)
-            else:
-                urllib2.urlopen(host)
-            return True
+            response = self.Execute(self.drive.files().get(fileId=fid,
+                                                           fields='id, name, mimeType, trashed, parents, size, md5Checksum'))
+        except HttpError as error:
+            self.SendlToLog(1, "HTTP Error: %d" % error.resp.status)
+            if error.resp.status == 404:
+                self.SendlToLog(1, "HTTP Error: raising FileNotFound()")
+                raise FileNotFound()
+
+            if not self.IsInternetReachable():
+                self.SendlToLog(1, "GetFileMetaDataByID - Internet is down\n")
+                raise InternetNotReachable()
+
+            self.SendlToLog(1, "GetFileMetaDataByID - Raising FileListQueryFailed")
+            raise FileListQueryFailed()
         except:
-            return False
+            if not self.IsInternetReachable():
+                self.SendlToLog(1, "GetFileMetaDataByID (unknown except) - Internet is down\n")
+                raise InternetNotReachable()
 
-    def GetFileMetaDataByID(self, fid):
-        retry = 0
-        while True:
-            self.SendlToLog(3, "GetFileMetaDataByID - FileID: %s" % fid)
-            try:
-                response = self.drive.files().get(fileId=fid,
-                                                  fields='id, name, mimeType, trashed, parents, size, md5Checksum').execute()
-            except HttpError as error:
-                self.SendlToLog(1, "HTTP Error: %d" % error.resp.status)
-                if error.resp.status == 404:
-                    self.SendlToLog(1, "HTTP Error: raising FileNotFound()")
-                    raise FileNotFound()
-
-                if error.resp.status in [403, 500, 503, 429]:
-                    self.SendlToLog(1, "GetFileMetaDataByID - Status: %d. (Retrying)\n", error.resp.status)
-                    time.sleep(5)
-                    continue
+            self.logger.exception("GetFileMetaDataByID - Query failed")
+            raise FileListQueryFailed()
 
-                if not self.IsInternetReachable():
-                    self.SendlToLog(1, "GetFileMetaDataByID - Internet is down\n")
-                    raise InternetNotReachable()
-            except:
-                if not self.IsInternetReachable():
-                    self.SendlToLog(1, "GetFileMetaDataByID (unknown except) - Internet is down\n")
-                    raise InternetNotReachable()
-                else:
-                    if retry == 0:
-                        self.SendlToLog(1, "GetFileMetaDataByID - Query failed. Trying one more time.")
-                        retry = 1;
-                        continue
-                    else:
-                        self.SendlToLog(1, "GetFileMetaDataByID (unknown except %d) - Raising FileListQueryFailed", e.errno)
-                        raise FileListQueryFailed()
+        self.SendlToLog(3, "GetFileMetaDataByID - Got something")
+        return response
+
+    def GetFilesMetaDataByID(self, fids, cancel=None):
+        """
+        Batched GetFileMetaDataByID(): fetch the metadata of all 'fids'
+        in batch requests of up to 100. Returns {id: metadata}; the IDs
+        Drive doesn't know are left out. SyncCancelled is raised if
+        'cancel' is cancelled while waiting to send.
+        """
+        batch = BatchRequestEngine(self.drive, gate=self.request_gate, cancel=cancel)
+        items = [(fid, batch.Add(self.drive.files().get(fileId=fid,
+                                                        fields='id, name, mimeType, trashed, parents, size, md5Checksum')))
+                 for fid in set(fids)]
+        try:
+            batch.Flush()
+        except SyncCancelled:
+            raise
+        except:
+            if not self.IsInternetReachable():
+                self.SendlToLog(1, "GetFilesMetaDataByID - Internet is down\n")
+                raise InternetNotReachable()
+            self.logger.exception("GetFilesMetaDataByID - Batch request failed")
+            raise FileListQueryFailed()
+
+        self.SendlToLog(3, "GetFilesMetaDataByID - %d files in %d requests" % (len(items), batch.requests_sent))
+        found = {}
+        for fid, item in items:
+            if item.error is None:
+                found[fid] = item.response
+            elif isinstance(item.error, HttpError) and item.error.resp.status == 404:
+                self.SendlToLog(3, "GetFilesMetaDataByID - %s not found" % fid)
             else:
-                self.SendlToLog(3, "GetFileMetaDataByID - Got something")
-                return response
+                self.SendlToLog(1, "GetFilesMetaDataByID - Query of %s failed: %s" % (fid, item.error))
+                raise FileListQueryFailed()
+
+        return found
 
-    def MakeFileListQuery(self, query):
-        retry = 0
+    def IterFileList(self, query, fields=FILE_LIST_FIELDS, page_size=None, cancel=None):
+        """
+        Yield the files matching 'query'. A page is only fetched when the
+        caller gets to it, and closing the generator stops the listing.
+        'fields' is the field mask of each file. Transient errors are
+        retried by the request gate; after that InternetNotReachable or
+        FileListQueryFailed is raised. No match is just an empty listing.
+        SyncCancelled is raised before the next page once 'cancel' is
+        cancelled.
+        """
+        page_token = None
         while True:
             try:
-                page_token = None
-                filelist = []
-                #self.SendlToLog(3, "Query: %s\n" % query)
-                while True:
-                    response = self.drive.files().list(q=query,
-                                                       spaces='drive',
-                                                       fields='nextPageToken, files(id, name, parents, mimeType, size, md5Checksum)',
-                                                       pageToken=page_token).execute()
-                    filelist.extend(response.get('files',[]))
-                    page_token = response.get('nextPageToken', None)
-                    if page_token is None:
-                        break
-
-                if not filelist:
-                    if not self.IsInternetReachable():
-                        self.SendlToLog(1, "Internet is down\n")
-                        raise InternetNotReachable()
-                    else:
-                        self.SendlToLog(3, "Empty Folder\n")
-                        return None
-                else:
-                    return filelist
+                response = self.Execute(self.drive.files().list(q=query,
+                                                                spaces='drive',
+                                                                pageSize=page_size,
+                                                                fields='nextPageToken, files(%s)' % fields,
+                                                                pageToken=page_token),
+                                        self.listing_limit, cancel)
             except HttpError as error:
-                self.SendlToLog(1, "MakeFileListQuery - %s\n", error.resp.reason)
-                if error.resp.status in [403, 500, 503, 429]:
-                    self.SendlToLog(1, "MakeFileListQuery - Status: %d. (Retrying)\n", error.resp.status)
-                    time.sleep(5)
-                    continue
-
-                if not self.IsInternetReachable():
-                    self.SendlToLog(1, "MakeFileListQuery - Internet is down\n")
-                    raise InternetNotReachable()
+                self.SendlToLog(1, "IterFileList - %s\n" % error.resp.reason)
+                raise FileListQueryFailed()
+            except SyncCancelled:
+                raise
             except:
                 if not self.IsInternetReachable():
-                    self.SendlToLog(1, "MakeFileListQuery (unknown except) - Internet is down\n")
+                    self.SendlToLog(1, "IterFileList (unknown except) - Internet is down\n")
                     raise InternetNotReachable()
-                else:
-                    if retry == 0:
-                        self.SendlToLog(1, "MakeFileListQuery - Query failed. Trying one more time.")
-                        retry = 1;
-                        continue
-                    else:
-                        self.SendlToLog(1, "MakeFileListQuery (unknown except %d) - Raising FileListQueryFailed", e.errno)
-                        raise FileListQueryFailed()
-            break
+
+                self.SendlToLog(1, "IterFileList - Raising FileListQueryFailed")
+                raise FileListQueryFailed()
+
+            for f in response.get('files', []):
+                yield f
+
+            page_token = response.get('nextPageToken')
+            if page_token is None:
+                return
 
     def RefreshHTTPConnection(self):
-        try:
-            file_list = self.MakeFileListQuery("'root' in parents and trashed=false")
-        except:
-            raise
+        for f in self.IterFileList("'root' in parents and trashed=false", page_size=1):
+            break
+
+    def ScanWholeDrive(self):
+        """
+        List every item of the drive with one paginated query and link
+        the items into a new GoogleDriveTree. This takes one request per
+        1000 items, where a walk takes a request per folder. Returns None
+        if GoSync is shutting down.
+        """
+        root_id = self.GetFileMetaDataByID('root')['id']
+
+        listed = [0]
+        def Listing():
+            # The items go straight into the tree builder as the pages
+            # come in
+            for f in self.IterFileList("trashed=false", page_size=DRIVE_SCAN_PAGE_SIZE):
+                listed[0] += 1
+                if listed[0] % DRIVE_SCAN_PAGE_SIZE == 0:
+                    GoSyncEventController().PostEvent(GOSYNC_EVENT_CALCULATE_USAGE_UPDATE, listed[0])
+                    if self.shutting_down:
+                        return
+                yield f
+
+        self.SendlToLog(3, "ScanWholeDrive: Listing the drive")
+        tree = BuildDriveTree(Listing(), root_id)
+        if self.shutting_down:
+            self.SendlToLog(3, "ScanWholeDrive: GoSync is shutting down!")
+            return None
+
+        self.fcount = len(tree.id_index) - 1
+        self.SendlToLog(3, "ScanWholeDrive: %d items listed, %d in My Drive" % (listed[0], self.fcount))
+        return tree
 
     def TotalFilesInFolder(self, parent='root'):
+        # Counted in the drive tree, which the change feed keeps up to
+        # date; nothing is asked from Drive.
+        tree = self.driveTree
+        folder = tree.FindFolder(parent)
+        if folder is None or folder.IsFile():
+            return 0
+
         file_count = 0
-        try:
-            file_list = self.MakeFileListQuery("'%s' in parents and trashed=false"  % parent)
-            for f in file_list:
-                if f['mimeType'] == 'application/vnd.google-apps.folder':
-                    GoSyncEventController().PostEvent(GOSYNC_EVENT_SCAN_UPDATE, {'Scanning: %s' % f['name']})
-                    file_count += self.TotalFilesInFolder(f['id'])
-                    file_count += 1
-                else:
-                    file_count += 1
+        with tree.lock.read_locked():
+            stack = list(folder.GetChildren())
+            while stack:
+                f = stack.pop()
+                file_count += 1
+                if not f.IsFile():
+                    stack.extend(f.GetChildren())
 
-            return file_count
-        except:
-            raise
+        return file_count
 
     def IsGoogleFolder(self, mimeType):
         if mimeType == 'application/vnd.google-apps.folder':
@@ -1366,45 +1791,25 @@ class GoSyncModel(object):
             return False
 
     def IsGoogleDocument(self, f):
-        if self.gd_regex.search(f['mimeType']):
-            return True
-        else:
-            return False
+        return MimeCategory(f['mimeType']) == CATEGORY_GOOGLE_DOC
 
     def IsAudioFile(self, f):
-        if self.aud_regex.search(f['mimeType']):
-            return True
-        else:
-            return False
+        return MimeCategory(f['mimeType']) == CATEGORY_AUDIO
 
     def IsVideoFile(self, f):
-        if self.vid_regex.search(f['mimeType']):
-            return True
-        else:
-            return False
+        return MimeCategory(f['mimeType']) == CATEGORY_MOVIES
 
     def IsImageFile(self, f):
-        if self.img_regex.search(f['mimeType']):
-            return True
-        else:
-            return False
+        return MimeCategory(f['mimeType']) == CATEGORY_PHOTO
 
     def IsDocument(self, f):
-        if self.doc_regex.search(f['mimeType']):
-            return True
-        elif any(f['mimeType'] in s for s in document_file_mimelist):
-            return True
-        else:
-            return False
+        return MimeCategory(f['mimeType']) == CATEGORY_DOCUMENT
 
     def TotalFilesInDrive(self):
         return self.TotalFilesInFolder()
 
     def IsMonitoringAll(self):
-        if self.sync_selection[0][1] == '':
-            return True
-        else:
-            return False
+        return GoSyncRemoteChanges.IsMonitoringAll(self.sync_selection)
 
     def IsDirectoryMonitored(self, dir, absolute_path=True):
         if self.IsMonitoringAll():
@@ -1459,45 +1864,39 @@ class GoSyncModel(object):
 
 #### DownloadFileByObject
     #### DownloadFileByObject
-    #def DownloadFileByObject(self, file_obj, download_path):
-    def DownloadFileByObject(self, file_obj, download_path):
-        PreviousFile = ''
-        NewFile = ''
-        #LargeFileSize = 2500000
-        #LargeBlockSize = 1000000
-        LargeFileSize = 250000000
-        LargeBlockSize = 1000000000
+    def DownloadFileByObject(self, file_obj, download_path, cancel=None):
+        """
+        Download 'file_obj' into the directory 'download_path'. The
+        content is streamed to disk; 'cancel' is checked as it comes, and
+        a download that stalls or fails is resumed from where it stopped,
+        up to 5 times. A file that comes out with the wrong size, or a
+        resumed one with the wrong MD5, is downloaded again from the
+        start. A cancelled download is removed, and SyncCancelled raised.
+        """
         # Handle Retries
         def RetryAndContinue(retryCounter, exceptionMsg):
             retryCounter -= 1
             if retryCounter > 0 :
                 self.SendlToLog(1, "DownloadFileByObject: Download error (%s). Retrying... (%s)" % (exceptionMsg,str(retryCounter)))
-                time.sleep(5)
+                self.request_gate.CountRetries(1)
+                delay = self.request_gate.BackoffDelay(5 - retryCounter)
+                if cancel is not None:
+                    # The next attempt finds out if it got cancelled
+                    cancel.Wait(delay)
+                else:
+                    time.sleep(delay)
             else:
                 self.SendlToLog(1, "DownloadFileByObject: Download error (%s). Aborting..." % exceptionMsg)
             return retryCounter
-        #def partial(self, total_byte_len, part_size_limit):
-        def partial(total_byte_len, part_size_limit):
-            s = []
-            for p in range(0, total_byte_len, part_size_limit):
-                last = min(total_byte_len - 1, p + part_size_limit - 1)
-                s.append([p, last])
-            return s
-        def PrepareDownload(download_path) :
-            pass
-
-        def AbortingDownload():
-            return not self.syncRunning.is_set() or self.shutting_down
 
         def CleanUpDownload(download_path):
             if os.path.exists(download_path):
                 os.remove(download_path)
 
         abs_filepath = os.path.join(download_path, file_obj['name'])
-        PrepareDownload(abs_filepath)
 
         if os.path.exists(abs_filepath):
-            if self.HashOfFile(abs_filepath) == file_obj['md5Checksum']:
+            if self.HashOfFile(abs_filepath, cancel) == file_obj['md5Checksum']:
                 self.SendlToLog(3,'DownloadFileByObject: Skipping File (%s) - same as remote.\n' % abs_filepath)
                 return
             else:
@@ -1506,159 +1905,158 @@ class GoSyncModel(object):
         self.SendlToLog(3,'DownloadFileByObject: Download Started - File (%s), size (%s)' % (abs_filepath, file_obj['size']))
         total_size = int(file_obj['size'])
         fd = abs_filepath.split(self.mirror_directory+'/')[1]
+        shown = [-1]
+        def Progress(done):
+            percent = done * 100 // total_size
+            if percent != shown[0]:
+                shown[0] = percent
+                GoSyncEventController().PostEvent(GOSYNC_EVENT_SYNC_UPDATE, {'Downloading (%s) %s%%\n' % (fd, percent)})
+
         retries = 5
+        # Bytes on disk from an earlier attempt, None before the first
+        resume_from = None
+        GoSyncEventController().PostEvent(GOSYNC_EVENT_BUSY_STARTED, {'Downloading %s' % fd})
         while True:
             try:
                 if (total_size == 0) :
-                    GoSyncEventController().PostEvent(GOSYNC_EVENT_BUSY_STARTED, {'Downloading %s' % fd})
                     self.SendlToLog(3, "Downloading zero size file %s" % fd)
                     open(abs_filepath, 'a').close()
                     break
-                elif (total_size < LargeFileSize) :
-                    GoSyncEventController().PostEvent(GOSYNC_EVENT_BUSY_STARTED, {'Downloading %s' % fd})
-                    self.SendlToLog(3, "Downloading small file %s" % fd)
-                    request = self.drive.files().get_media(fileId=file_obj['id'])
-                    self.SendlToLog(3, "Got media request")
-                    fh = io.FileIO(abs_filepath, 'wb')
-                    self.SendlToLog(3, "FileIO created")
-                    downloader = MediaIoBaseDownload(fh, request)
-                    self.SendlToLog(3, "Downloader aquired")
-                    done = False
-                    while done is False:
-                        if AbortingDownload() :
-                            break
-                        else :
-                            self.SendlToLog(3, "Downloading next chunk")
-                            status, done = downloader.next_chunk()
-                    fh.close()
-                    self.SendlToLog(3, "Closing file")
-                    break
-                else :
-                    # Downloading large files : 100M chunk size
-                    GoSyncEventController().PostEvent(GOSYNC_EVENT_BUSY_STARTED, {'Downloading %s' % fd})
-                    s = partial(total_size, LargeBlockSize)
-                    with open(abs_filepath, 'wb') as file:
-                        for bytes in s:
-                            if AbortingDownload() :
-                                break
-                            else :
-                                request = self.drive.files().get_media(fileId=file_obj['id'])
-                                GoSyncEventController().PostEvent(GOSYNC_EVENT_SYNC_UPDATE, {'Downloading (%s) %s%%\n' % (fd, str(int(bytes[1]/total_size*100)))})
-                                request.headers["Range"] = "bytes={}-{}".format(bytes[0], bytes[1])
-                                fh = io.BytesIO(request.execute())
-                                file.write(fh.getvalue())
-                                file.flush()
-                    break
+
+                # Appending carries on from where the last attempt stopped
+                with open(abs_filepath, 'wb' if resume_from is None else 'ab') as fh:
+                    resume_from = fh.tell()
+                    self.SendlToLog(3, "Downloading %s from byte %d" % (fd, resume_from))
+                    # The download limit goes by the time Drive takes to
+                    # answer, not by how long the file takes to come
+                    self.request_gate.Execute(lambda: self.client_factory.Download(file_obj['id'], fh, fh.tell(),
+                                                                                   cancel, Progress,
+                                                                                   self.download_limit.FirstByte),
+                                              limit=self.download_limit, cancel=cancel)
+
+                # Check the file before taking it as downloaded. The MD5
+                # is only worth its cost when the file was pieced
+                # together from several attempts.
+                if (os.path.getsize(abs_filepath) != total_size
+                    or (resume_from and file_obj.get('md5Checksum')
+                        and self.HashOfFile(abs_filepath, cancel) != file_obj['md5Checksum'])):
+                    # Start again from scratch
+                    resume_from = None
+                    raise DownloadCorrupted()
+                break
+            except SyncCancelled:
+                CleanUpDownload(abs_filepath)
+                self.SendlToLog(2,'DownloadFileByObject: Download Aborted - File (%s)\n' % abs_filepath)
+                GoSyncEventController().PostEvent(GOSYNC_EVENT_BUSY_DONE, {'Download Aborted'})
+                # The callers must not take the file as downloaded
+                raise
             except Exception as err:
+                if isinstance(err, TransferStalled):
+                    err = "no data for %ds" % self.client_factory.stall_timeout
+                elif isinstance(err, DownloadCorrupted):
+                    err = "content doesn't match Drive"
                 retries = RetryAndContinue(retries, str(err))
                 if retries > 0 :
                     continue
                 else :
                     CleanUpDownload(abs_filepath)
                     raise
-        if AbortingDownload() :
-            CleanUpDownload(abs_filepath)
-            self.updates_done = 1
-            self.SendlToLog(2,'DownloadFileByObject: Download Aborted - File (%s)\n' % abs_filepath)
-            GoSyncEventController().PostEvent(GOSYNC_EVENT_BUSY_DONE, {'Download Aborted'})
-        else :
-            self.updates_done = 1
-            self.SendlToLog(2,'DownloadFileByObject: Download Completed - File (%s)\n' % abs_filepath)
-            GoSyncEventController().PostEvent(GOSYNC_EVENT_BUSY_DONE, {''})
+        self.updates_done = 1
+        self.SendlToLog(2,'DownloadFileByObject: Download Completed - File (%s)\n' % abs_filepath)
+        GoSyncEventController().PostEvent(GOSYNC_EVENT_BUSY_DONE, {''})
 
 
 #### SyncRemoteDirectory
+    def ListRemoteFolder(self, folder_id, cancel):
+        """
+        List a folder for the crawler of SyncRemoteDirectory. Called from
+        the crawler's worker threads. If the network goes down, wait for
+        it to come back. SyncCancelled is raised if 'cancel' is cancelled
+        first, so that the folder isn't taken for an empty one.
+        """
+        while True:
+            try:
+                return list(self.IterFileList("'%s' in parents and trashed=false" % folder_id,
+                                              cancel=cancel))
+            except InternetNotReachable:
+                self.SendlToLog(1, "ListRemoteFolder - Network has gone down")
+                if not self.connectivity.WaitUntilUp(cancel.IsCancelled):
+                    raise SyncCancelled()
+                self.SendlToLog(2, "ListRemoteFolder - Network is up!")
+
     def SyncRemoteDirectory(self, parent, pwd, recursive=True):
         self.SendlToLog(3,"### SyncRemoteDirectory: - Sync Started - Remote Directory (%s) ... Recursive = %s\n" % (pwd, recursive))
-        if not self.syncRunning.is_set() or self.shutting_down:
+        cancel = self.cancel_token
+        SyncAborted = cancel.IsCancelled
+
+        if SyncAborted():
             self.SendlToLog(2,"SyncRemoteDirectory: Sync has been paused. Aborting.\n")
-            return
+            raise SyncCancelled()
 
         if not os.path.exists(os.path.join(self.mirror_directory, pwd)):
             os.makedirs(os.path.join(self.mirror_directory, pwd))
 
+        # Folders are listed by a pool of workers, breadth first by
+        # default. Their content comes back here as it arrives, a folder
+        # always before what is in it, so the local directories are made
+        # before anything is downloaded into them.
+        crawler = RemoteCrawler(lambda folder_id: self.ListRemoteFolder(folder_id, cancel), SyncAborted,
+                                MAX_CRAWL_WORKERS, self.crawl_order, self.listing_limit)
+        f = None
         try:
-            if not self.syncRunning.is_set() or self.shutting_down:
-                self.SendlToLog(2, "SyncRemoteDirectory: Sync has been paused. Aborting.")
-                return
-
-            file_list = self.MakeFileListQuery("'%s' in parents and trashed=false" % parent)
-
-            #This direcotry is empty nothing to sync.
-            if not file_list:
-                return
-
-            for f in file_list:
-                if not self.syncRunning.is_set() or self.shutting_down:
+            for fparent, fpwd, f in crawler.Crawl(parent, pwd, recursive):
+                if SyncAborted():
                     self.SendlToLog(3,"SyncRemoteDirectory: Sync has been paused. Aborting.\n")
-                    return
+                    raise SyncCancelled()
 
                 self.SendlToLog(3, "Checking: %s\n" % f['name'])
                 GoSyncEventController().PostEvent(GOSYNC_EVENT_SYNC_UPDATE, {"Checking: %s" % f['name']})
-                if not self.syncRunning.is_set():
-                    self.SendlToLog(2,"SyncRemoteDirectory: Sync has been paused. Aborting.\n")
-                    return
 
                 if f['mimeType'] == 'application/vnd.google-apps.folder':
                     if not recursive:
                         continue
 
-                    abs_dirpath = os.path.join(self.mirror_directory, pwd, f['name'])
+                    abs_dirpath = os.path.join(self.mirror_directory, fpwd, f['name'])
                     self.SendlToLog(3,"SyncRemoteDirectory: Checking directory (%s)" % f['name'])
                     if not os.path.exists(abs_dirpath):
                         self.SendlToLog(3,"SyncRemoteDirectory: Creating directory (%s)" % abs_dirpath)
                         os.makedirs(abs_dirpath)
-                        self.driveTree.AddFolder(parent, f['id'], f['name'], f)
+                        self.driveTree.AddFolder(fparent, f['id'], f['name'], f)
                         self.SendlToLog(3,"SyncRemoteDirectory: Created directory (%s)" % abs_dirpath)
-                    self.SendlToLog(3,"SyncRemoteDirectory: Syncing directory (%s)\n" % f['name'])
-                    while True:
-                        try:
-                            self.SyncRemoteDirectory(f['id'], os.path.join(pwd, f['name']))
-                            break
-                        except InternetNotReachable:
-                            GoSyncEventController().PostEvent(GOSYNC_EVENT_INTERNET_UNREACHABLE, 1)
-                            self.SendlToLog(1, "SyncRemoteDirectory - Network has gone down")
-                            while True:
-                                if self.IsInternetReachable():
-                                    GoSyncEventController().PostEvent(GOSYNC_EVENT_INTERNET_UNREACHABLE, 0)
-                                    self.SendlToLog(2, "SyncRemoteDirectory - Network is up!")
-                                    break
-                                else:
-                                    time.sleep(5)
-                                    continue
-                    if not self.syncRunning.is_set() or self.shutting_down:
-                        self.SendlToLog(3,"SyncRemoteDirectory: Sync has been paused. Aborting.\n")
-                        return
                 else:
-                    if not self.syncRunning.is_set() or self.shutting_down:
-                        self.SendlToLog(3, "SyncRemoteDirectory: Sync has been paused. Aborting download")
-                        return
-
                     self.SendlToLog(3,"SyncRemoteDirectory: Checking file (%s)" % f['name'])
                     if not self.IsGoogleDocument(f):
-                        _fp = os.path.join(self.mirror_directory, pwd, f['name'])
-                        _ddr = os.path.join(self.mirror_directory, pwd)
-                        if os.path.exists(_fp) and self.HashOfFile(_fp) == f['md5Checksum']:
+                        _fp = os.path.join(self.mirror_directory, fpwd, f['name'])
+                        _ddr = os.path.join(self.mirror_directory, fpwd)
+                        if os.path.exists(_fp) and self.HashOfFile(_fp, cancel) == f['md5Checksum']:
                             self.SendlToLog(3,"SyncRemoteDirectory: File %s same as Remote\n" % _fp)
                         else:
                             self.SendlToLog(3, "SyncRemoteDirectory: File %s is in conflict with server" % _fp)
                             if self.in_conflict_server_presides:
                                 self.SendlToLog(2, "SyncRemoteDirectory: CONFLICT: User wants server to preside")
                                 self.SendlToLog(2, "SyncRemoteDirectory: Downloading file %s: (root: %s)" % (_fp, _ddr))
-                                self.DownloadFileByObject(f, _ddr)
-                                self.driveTree.AddFile(parent, f['id'], f['name'], f)
+                                self.DownloadFileByObject(f, _ddr, cancel)
+                                self.driveTree.AddFile(fparent, f['id'], f['name'], f)
                             else:
                                 self.SendlToLog(2, "SyncRemoteDirectory: CONFLICT: User wants local to preside")
-                                self.SendlToLog(2, "SyncRemoteDirectory: File %s: (root: %s) left to be uploaded at SyncLocal time" % (dirpath, root))
+                                self.SendlToLog(2, "SyncRemoteDirectory: File %s: (root: %s) left to be uploaded at SyncLocal time" % (_fp, _ddr))
                     else:
                         self.SendlToLog(3,"SyncRemoteDirectory: Skipping file (%s) is a google document.\n" % f['name'])
+            # The crawler stops quietly once cancelled, with folders
+            # left unlisted
+            if SyncAborted():
+                self.SendlToLog(3,"SyncRemoteDirectory: Sync has been paused. Aborting.\n")
+                raise SyncCancelled()
         except InternetNotReachable:
             self.SendlToLog(1, "SyncRemoteDirectory: Internet not reachable\n")
             raise
+        except SyncCancelled:
+            raise
         except:
-            self.SendlToLog(1,"SyncRemoteDirectory: Failed to sync directory (%s)" % f['name'])
+            self.SendlToLog(1,"SyncRemoteDirectory: Failed to sync directory (%s)" % (f['name'] if f else pwd))
             raise
-        self.SendlToLog(3,"### SyncRemoteDirectory: - Sync Completed - Remote Directory (%s) ... Recursive = %s\n" % (pwd, recursive))
+        self.SendlToLog(3,"### SyncRemoteDirectory: - Sync Completed - Remote Directory (%s) ... Recursive = %s (%d folders listed)\n"
+                        % (pwd, recursive, crawler.folders_listed))
 
     def SyncNewSelections(self):
         # No new selection
@@ -1699,44 +2097,116 @@ class GoSyncModel(object):
 
 #### validate_sync_settings
     def validate_sync_settings(self):
+        selections = []
         for d in self.sync_selection:
             if d[0] != 'root':
-                try:
-                    self.SendlToLog(3, "validate_sync_settings - Locating %s on remote" % d[0])
-                    f = self.LocateFolderOnDrive(d[0])
-                    if f['id'] != d[1]:
-                        self.SendlToLog(1, "validate_sync_settings - %s not found on remote" % d[0])
-                        raise FolderNotFound(d[0], d[1])
-                    self.SendlToLog(3, "validate_sync_settings - Found")
-                    break
-                except FolderNotFound:
-                    self.SendlToLog(1, "validate_sync_settings - %s not found" % d[0])
-                    raise FolderNotFound(d[0], d[1])
-                except:
-                    self.SendlToLog(1, "validate_sync_settings - unknown error")
-                    raise
+                selections.append(d)
             else:
                 if d[1] != '':
                     self.SendlToLog(1, "validate_sync_settings - sync selection set to root but SHA is not right")
                     raise FolderNotFound('root', 'root')
+
+        if selections:
+            # All the selections are checked together: their metadata in
+            # one batch, then their ancestors one batch per level.
+            try:
+                self.SendlToLog(3, "validate_sync_settings - Locating %d selections on remote" % len(selections))
+                ids = [d[1] for d in selections]
+                found = self.GetFilesMetaDataByID(ids)
+                paths = self.GetFolderPathsOnDriveByID([fid for fid in ids if fid in found], found)
+            except InternetNotReachable:
+                raise
+            except:
+                self.SendlToLog(1, "validate_sync_settings - unknown error")
+                raise
+
+            for d in selections:
+                f = found.get(d[1])
+                if f is None or f.get('trashed') or paths.get(d[1]) != '/' + d[0]:
+                    self.SendlToLog(1, "validate_sync_settings - %s not found on remote" % d[0])
+                    raise FolderNotFound(d[0], d[1])
         self.SendlToLog(3, "Sync settings looks good")
 
 #### run (Sync Local and Remote Directory)
-    def GetChangeListSinceLastToken(self, last_token):
-        return self.drive.changes().list(pageToken=last_token,
-                                         space='drive').execute()
+    def GetChangeListSinceLastToken(self, last_token, cancel=None):
+        # The metadata sync needs comes with each change, so that no
+        # files().get is needed per change.
+        return self.Execute(self.drive.changes().list(pageToken=last_token,
+                                                      spaces='drive',
+                                                      pageSize=CHANGES_PAGE_SIZE,
+                                                      fields=CHANGES_FIELDS),
+                            cancel=cancel)
+
+    def GetChangePathFromTree(self, fdata):
+        """
+        Return the drive path of a changed file from its parent in the
+        drive tree, or None if the parent isn't in the tree.
+        """
+        parents = fdata.get('parents')
+        if not parents:
+            return None
+
+        pid = parents[0]
+        if pid == self.root_id:
+            pid = 'root'
+
+        parent = self.driveTree.FindFolder(pid)
+        if parent is None or parent.IsFile():
+            return None
+
+        return '/' + os.path.join(parent.GetPath(), fdata.get('name'))
+
+    def IsChangeMonitored(self, fid, change, path=None):
+        """
+        Tell whether a change from the change feed can touch the sync
+        selection, see GoSyncRemoteChanges.IsChangeMonitored().
+        """
+        return GoSyncRemoteChanges.IsChangeMonitored(self.driveTree, self.sync_selection,
+                                                     self.root_id, fid, change, path)
+
+    def ApplyChangeToTree(self, fid, change):
+        """
+        Bring the drive tree up to date with a change outside the sync
+        selection. Nothing is done on disk or on remote.
+        """
+        GoSyncRemoteChanges.ApplyChangeToTree(self.driveTree, self.root_id, fid, change)
+
+    def ApplyRemoteMove(self, node, fdata, new_abs_path):
+        """
+        If the file or folder in 'node' was renamed or moved on remote,
+        rename the local copy and move the node in the drive tree
+        instead of downloading it again. Returns True if it had moved.
+        """
+        def LocalMove(old_rel_path, new_rel_path, done):
+            self.SendlToLog(2, "ApplyRemoteMove - %s moved to %s on remote" % (old_rel_path, new_rel_path))
+            if done == GoSyncRemoteChanges.LOCAL_MOVED:
+                GoSyncEventController().PostEvent(GOSYNC_EVENT_SYNC_UPDATE,
+                                                  {"Moving: %s" % old_rel_path})
+            elif done == GoSyncRemoteChanges.LOCAL_DELETED:
+                # Moved out of the synced folders, same as a folder that
+                # isn't monitored.
+                self.SendlToLog(2, "ApplyRemoteMove - %s is not synced anymore. Deleted locally" % old_rel_path)
+
+        moved = GoSyncRemoteChanges.ApplyRemoteMove(self.driveTree, self.sync_selection,
+                                                    self.mirror_directory, self.root_id,
+                                                    node, fdata, new_abs_path, LocalMove)
+        if moved and not node.IsFile():
+            self.SaveConfig()
+            GoSyncEventController().PostEvent(GOSYNC_EVENT_CALCULATE_USAGE_DONE, 0)
+
+        return moved
 
     def RunSyncSincePageToken(self, last_page_token):
         # Where to pick if we are shutdown in between
         restart_token = last_page_token
         page = 1
-        def AbortingDownload():
-            return not self.syncRunning.is_set() or self.shutting_down
+        cancel = self.cancel_token
+        AbortingDownload = cancel.IsCancelled
 
         cur_token = last_page_token
         while True:
             self.SendlToLog(3, "*** RunSyncSincePageToken - Page %d (Token: %s)  ***" % (page, cur_token))
-            response = self.drive.changes().list(pageToken=cur_token).execute()
+            response = self.GetChangeListSinceLastToken(cur_token, cancel)
 
             if not response.get('changes', []):
                 self.SendlToLog(2, "RunSyncSincePageToken - No changes after %s" % cur_token)
@@ -1744,38 +2214,73 @@ class GoSyncModel(object):
 
             self.SendlToLog(3, "RunSyncSincePageToken - retrieved change list since %s" % last_page_token)
 
+            # Paths are taken from the drive tree as each change is handled,
+            # so that earlier changes on the page are taken into account.
+            # Only the files whose parent isn't in the tree are looked up
+            # on remote, all of them together.
+            page_meta = {}
             for change in response.get('changes', []):
-                fid = change.get('fileId')
-                fmeta = change.get('file', {})
-                mime_type = fmeta.get('mimeType')
-
-                GoSyncEventController().PostEvent(GOSYNC_EVENT_SYNC_UPDATE,
-                                                  {"Checking %s" % fmeta.get('name')})
-
+                fdata = change.get('file')
+                if not change.get('removed') and fdata and self.GetChangePathFromTree(fdata) is None:
+                    page_meta[change.get('fileId')] = fdata
+            page_paths = {}
+            page_filtered = 0
+            self.changes_looked_up += len(page_meta)
+            if page_meta:
                 try:
-                    fdata = self.GetFileMetaDataByID(fid)
-                except FileNotFound:
-                    self.SendlToLog(1, "Error 404: %s (Name: %s)" % (fid, fmeta.get('name')))
-                    continue
+                    page_paths = self.GetFolderPathsOnDriveByID(list(page_meta.keys()), page_meta, cancel)
+                except InternetNotReachable:
+                    raise
+                except SyncCancelled:
+                    self.SendlToLog(3, "RunSyncSincePageToken - Sync paused, will start from %s" % restart_token)
+                    return restart_token
                 except:
-                    self.SendlToLog(1, "Error while fetching information from remote for file.")
-                    continue
+                    self.SendlToLog(1, "RunSyncSincePageToken - Failed to look up the paths of %d files" % len(page_meta))
 
-                try:
-                    folder_path = self.GetFolderPathOnDriveByID(fid)
-                except:
-                    self.SendlToLog(1, "Error getting folder path on drive")
+            for change in response.get('changes', []):
+                fid = change.get('fileId')
+                self.ForgetChange(fid, change.get('file'))
+                self.changes_seen += 1
+                if not self.IsChangeMonitored(fid, change, page_paths.get(fid)):
+                    # Nothing to do on disk, only the tree needs to know
+                    self.changes_filtered += 1
+                    page_filtered += 1
+                    self.ApplyChangeToTree(fid, change)
                     continue
 
+                if change.get('removed'):
+                    # Gone for good, all there is to know is in the tree
+                    node = self.driveTree.FindFile(fid)
+                    if node is None:
+                        self.SendlToLog(3, "RunSyncSincePageToken - Removed file %s not in local cache" % fid)
+                        continue
+                    fdata = node.GetData()
+                    folder_path = '/' + node.GetPath()
+                else:
+                    fdata = change.get('file')
+                    if not fdata:
+                        self.SendlToLog(1, "RunSyncSincePageToken - No metadata for %s" % fid)
+                        continue
+                    folder_path = self.GetChangePathFromTree(fdata)
+                    if folder_path is None:
+                        folder_path = page_paths.get(fid)
+                    if folder_path is None:
+                        self.SendlToLog(1, "Error getting folder path on drive")
+                        continue
+
+                mime_type = fdata.get('mimeType')
+                GoSyncEventController().PostEvent(GOSYNC_EVENT_SYNC_UPDATE,
+                                                  {"Checking %s" % fdata.get('name')})
+
                 finpath = self.mirror_directory + folder_path
 
                 if AbortingDownload():
-                    self.SendlToLog(3, "RunSyncSincePageToken - GoSync is shutting down will start from %s" % token_done)
+                    self.SendlToLog(3, "RunSyncSincePageToken - GoSync is shutting down will start from %s" % restart_token)
                     # Restart later from last token onwards i.e. the changes we are processing now.
                     return restart_token
 
-                self.SendlToLog(3, "RunSyncSincePageToken - FID %s changed (%s)" % (fid, fmeta.get('mimeType')))
-                if change.get('removed', None) is False:
+                self.SendlToLog(3, "RunSyncSincePageToken - FID %s changed (%s)" % (fid, mime_type))
+                if not change.get('removed'):
                     #The file/folder hasn't been permanently delete. Probably trashed.
                     self.SendlToLog(3, "RunSyncSincePageToken - Change detected in %s" % finpath)
 
@@ -1790,8 +2295,9 @@ class GoSyncModel(object):
                                 ##
                                 #TrashFileCallback should delete the directory from the selection list
                                 ##
-                                self.driveTree.DeleteFolder(fid, self.TrashFileCallback)
-                                self.SendlToLog(3, "RunSyncSincePageToken - Folder %s deleted from local directory tree" % folder_path)
+                                removed = self.driveTree.DeleteFolder(fid, self.TrashFileCallback)
+                                self.SendlToLog(3, "RunSyncSincePageToken - Folder %s deleted from local directory tree (%d entries)"
+                                                % (folder_path, len(removed)))
                                 #
                                 # Since the folder would have been deleted from sync selection, this notification
                                 # would tell UI to update the screen
@@ -1814,8 +2320,21 @@ class GoSyncModel(object):
                                 os.remove(finpath)
                             else:
                                 self.SendlToLog(3, "RunSyncSincePageToken - File %s is trashed on remote. Doesn't exist locally" % finpath)
+                            if self.driveTree.FindFile(fid) is not None:
+                                self.driveTree.DeleteFolder(fid)
                     else:
                         self.SendlToLog(3, "RunSyncSincePageToken - Neither trashed not removed means its modified or new file/folder")
+                        node = self.driveTree.FindFile(fid)
+                        old_md5 = None
+                        moved = False
+                        if node is not None:
+                            if node.IsFile():
+                                old_md5 = node.GetMD5()
+                            try:
+                                moved = self.ApplyRemoteMove(node, fdata, finpath)
+                            except:
+                                self.logger.exception("RunSyncSincePageToken - Failed to apply remote move of %s" % fid)
+
                         if mime_type == 'application/vnd.google-apps.folder':
                             self.SendlToLog(3, "RunSyncSincePageToken - %s is a folder" % fdata.get('name'))
                             #
@@ -1843,7 +2362,7 @@ class GoSyncModel(object):
                             self.SendlToLog(3, "RunSyncSincePageToken - Parent: %s ID: %s Name: %s" % (pf, fdata.get('id'), fdata.get('name')))
                             self.driveTree.AddFolder(pf, fdata.get('id'), fdata.get('name'), fdata)
                             GoSyncEventController().PostEvent(GOSYNC_EVENT_CALCULATE_USAGE_DONE, 0)
-                            pickle.dump(self.driveTree, open(self.tree_pickle_file, "wb"))
+                            self.SaveState()
                             self.SendlToLog(3, "RunSyncSincePageToken - ok")
                         else:
                             self.SendlToLog(3, "Download")
@@ -1856,9 +2375,16 @@ class GoSyncModel(object):
                                     else:
                                         pf = fdata.get('parents')[0]
 
+                                    if moved and old_md5 == fdata.get('md5Checksum') and os.path.exists(finpath):
+                                        self.SendlToLog(3, "File %s only moved, content is the same. Not downloading" % fdata.get('name'))
+                                    else:
                                         self.SendlToLog(3, "Downloading File %s to %s" % (fdata.get('name'), os.path.dirname(finpath)))
-                                        self.DownloadFileByObject(fdata, os.path.dirname(finpath))
-                                        self.driveTree.AddFile(pf, fdata.get('id'), fdata.get('name'), fdata)
+                                        try:
+                                            self.DownloadFileByObject(fdata, os.path.dirname(finpath), cancel)
+                                        except SyncCancelled:
+                                            self.SendlToLog(3, "RunSyncSincePageToken - Sync paused, will start from %s" % restart_token)
+                                            return restart_token
+                                    self.driveTree.AddFile(pf, fdata.get('id'), fdata.get('name'), fdata)
                                 else:
                                     self.SendlToLog(2, "Folder %s not in sync selection. Therefore, file %s not being downloaded" % (os.path.dirname(finpath), fdata.get('name')))
                             else:
@@ -1874,7 +2400,7 @@ class GoSyncModel(object):
                             GoSyncEventController().PostEvent(GOSYNC_EVENT_SYNC_UPDATE,
                                                               {"%s deleted on remote." % self.GetRelativeFolder(finpath, True)})
 
-                            rmtree(finpath, True)
+                            shutil.rmtree(finpath, True)
                     else:
                         if os.path.exists(finpath):
                             self.SendlToLog(3, "File %s exists. Deleting local copy" % finpath)
@@ -1884,7 +2410,12 @@ class GoSyncModel(object):
                         else:
                             self.SendlToLog(3, "File %s permanently delete on remote. Doesn't exist locally." % finpath)
 
+                    removed = self.driveTree.DeleteFolder(fid, self.TrashFileCallback)
+                    self.SendlToLog(3, "RunSyncSincePageToken - %d entries removed from local cache" % len(removed))
 
+
+            self.SendlToLog(2, "RunSyncSincePageToken - Page %d: %d changes, %d outside the sync selection, %d paths looked up on remote"
+                            % (page, len(response.get('changes', [])), page_filtered, len(page_meta)))
             restart_token = cur_token
             cur_token = response.get('nextPageToken')
             if not cur_token:
@@ -1931,6 +2462,10 @@ class GoSyncModel(object):
             self.SendlToLog(2, "SyncThread - run - Internet not reachable")
             GoSyncEventController().PostEvent(GOSYNC_EVENT_INTERNET_UNREACHABLE, 1)
             raise e
+        except SyncCancelled:
+            self.SendlToLog(2, "SyncThread - run - Sync has been paused")
+            GoSyncEventController().PostEvent(GOSYNC_EVENT_SYNC_DONE, 0)
+            raise
         except:
             self.SendlToLog(1, "SyncThread - run - Unknown exception")
             GoSyncEventController().PostEvent(GOSYNC_EVENT_SYNC_DONE, -1)
@@ -1939,33 +2474,52 @@ class GoSyncModel(object):
     def run(self):
         refresh_connection = 10
 
+        # Startup may have used the account details of the last run
         try:
-            root_meta = self.GetFileMetaDataByID('root')
+            self.RetrieveAbout_Drive()
         except:
-            self.SendlToLog(1, "Failed to get root directory ID")
-            exit()
+            self.SendlToLog(1, "SyncThread - run - Failed to refresh the account details")
         else:
-            self.root_id = root_meta.get('id')
-            self.SendlToLog(2, "Root folder ID: %s" % self.root_id)
+            if self.about_drive['user']['emailAddress'] != self.user_email:
+                self.SendlToLog(1, "SyncThread - run - Logged in as %s but started for %s. Restart GoSync."
+                                % (self.about_drive['user']['emailAddress'], self.user_email))
+
+        # GoSync may have started offline, from the account details of
+        # the last run. Nothing can be synced before the root is known.
+        attempt = 0
+        while self.root_id is None:
+            try:
+                root_meta = self.GetFileMetaDataByID('root')
+            except InternetNotReachable:
+                self.SendlToLog(1, "SyncThread - run - Internet is down. Waiting for it to get the root directory ID")
+                if not self.connectivity.WaitUntilUp(lambda: self.shutting_down):
+                    self.SendlToLog(2, "SyncThread - run - GoSync is shutting down!")
+                    return
+            except:
+                delay = self.request_gate.BackoffDelay(attempt)
+                attempt += 1
+                self.SendlToLog(1, "SyncThread - run - Failed to get root directory ID. Retrying in %ds" % delay)
+                # A second at a time, to notice a shutdown
+                for _ in range(int(delay) + 1):
+                    if self.shutting_down:
+                        self.SendlToLog(2, "SyncThread - run - GoSync is shutting down!")
+                        return
+                    time.sleep(1)
+            else:
+                self.root_id = root_meta.get('id')
+                self.SendlToLog(2, "Root folder ID: %s" % self.root_id)
 
         while not self.shutting_down:
             self.SendlToLog(3, "SyncThread - run - Waiting for Sync to be enabled")
-            self.syncRunning.wait()
-
-            if self.shutting_down:
-                self.SendToLog(2, "SyncThread - run - GoSync is shutting down!")
+            if not self.WaitForSyncEnabled():
+                self.SendlToLog(2, "SyncThread - run - GoSync is shutting down!")
                 break
 
             if not self.IsInternetReachable():
-                self.SendlToLog(2, "SyncThread - run - Internet is down. Clearing running.")
-                GoSyncEventController().PostEvent(GOSYNC_EVENT_INTERNET_UNREACHABLE, 1)
-                while True:
-                    if not self.IsInternetReachable():
-                        time.sleep(5)
-                    else:
-                        self.SendlToLog(2, "SyncThread - run - Internet is up!")
-                        GoSyncEventController().PostEvent(GOSYNC_EVENT_INTERNET_UNREACHABLE, 0)
-                        break
+                self.SendlToLog(2, "SyncThread - run - Internet is down. Waiting for it.")
+                if not self.connectivity.WaitUntilUp(self.cancel_token.IsCancelled):
+                    continue
+                self.SendlToLog(2, "SyncThread - run - Internet is up!")
 
             self.SendlToLog(3, "SyncThread - run - Trying to acquire lock.")
             self.sync_lock.acquire()
@@ -1990,10 +2544,12 @@ class GoSyncModel(object):
 
             self.SendlToLog(2, "SyncThread - run - Staring the sync now")
             self.syncing_now = True
+            tree = self.driveTree
+            start_generation = tree.GetGeneration()
             if self.last_page_token is None or self.force_full_sync == True:
                 try:
                     self.RunFullSync()
-                except InternetNotReachable:
+                except (InternetNotReachable, SyncCancelled):
                     self.sync_lock.release()
                     self.syncing_now = False
                     continue
@@ -2002,7 +2558,7 @@ class GoSyncModel(object):
                 else:
                     self.last_page_token = self.GetStartPageToken()
                     self.SendlToLog(2, "SyncThread - run - last token %s" % self.last_page_token)
-                    self.SaveConfig()
+                    self.SaveState()
                 self.force_full_sync = False
             else:
                 try:
@@ -2019,17 +2575,29 @@ class GoSyncModel(object):
                     self.SendlToLog(2, "SyncThread - run - Syncing local folders")
                     self.SyncLocalDirectory()
                     self.SendlToLog(2, "SyncThread - run - All sync done successfully")
-                except InternetNotReachable:
+                except (InternetNotReachable, SyncCancelled):
                     self.sync_lock.release()
                     self.syncing_now = False
                     continue
                 except:
                     self.SendlToLog(1, "SyncThread - run - Unkown exception during sync after page token %s" % self.last_page_token)
                 else:
-                    self.SaveConfig()
-                    pickle.dump(self.driveTree, open(self.tree_pickle_file, "wb"))
+                    self.SaveState()
 
-            self.SendlToLog(2, "SyncThread - run - Sync done")
+            changes = tree.ChangesSince(start_generation)
+            if changes is None:
+                self.SendlToLog(2, "SyncThread - run - Sync done, %d changes to the drive tree"
+                                % (tree.GetGeneration() - start_generation))
+            else:
+                counts = {}
+                for _, kind, _ in changes:
+                    counts[kind] = counts.get(kind, 0) + 1
+                self.SendlToLog(2, "SyncThread - run - Sync done, %d changes to the drive tree %s"
+                                % (len(changes), counts))
+            self.SendlToLog(2, "SyncThread - run - Drive calls so far: %s" % self.request_gate.GetStats())
+            self.SendlToLog(2, "SyncThread - run - Concurrency limits: listing %d, download %d, upload %d"
+                            % (self.listing_limit.GetLimit(), self.download_limit.GetLimit(),
+                               self.upload_limit.GetLimit()))
             self.sync_lock.release()
             self.syncing_now = False
 
@@ -2057,12 +2625,21 @@ class GoSyncModel(object):
                                                           {'Sync starts in %02dm:%02ds' % ((self.time_left/60),
                                                                                            (self.time_left % 60))})
                 self.time_left -= 1
-                if self.shutting_down:
+                if not self.WaitForSyncEnabled():
                     self.SendlToLog(2, "SyncThread - run - GoSync is shutting down!")
                     break
-                self.syncRunning.wait()
                 time.sleep(1)
 
+    def WaitForSyncEnabled(self):
+        """
+        Block while sync is paused. Return False if GoSync is shutting
+        down, True once sync is enabled.
+        """
+        while not self.syncRunning.wait(1):
+            if self.shutting_down:
+                return False
+        return not self.shutting_down
+
 #### GetFileSize
     def GetFileSize(self, f):
         try:
@@ -2074,47 +2651,6 @@ class GoSyncModel(object):
             self.SendlToLog(1,"Failed to get size of file %s (mime: %s)\n" % (f['name'], f['mimeType']))
             return 0
 
-#### calculateUsageOfFolder
-    def calculateUsageOfFolder(self, folder_id):
-        try:
-            if self.shutting_down:
-                self.SendlToLog(3, "calculateUsageOfFolder: GoSync is shutting down!")
-                return
-
-            file_list = self.MakeFileListQuery("'%s' in parents and trashed=false" % folder_id)
-
-            #Folder is empty
-            if not file_list:
-                return
-
-            for f in file_list:
-                if self.shutting_down:
-                    self.SendlToLog(3, "calculateUsageOfFolder: GoSync is shutting down!")
-                    return
-
-                self.fcount += 1
-                self.SendlToLog(3, "Scanning: %s (%s -> %s)\n" % (f['name'], f['id'], folder_id))
-                GoSyncEventController().PostEvent(GOSYNC_EVENT_SCAN_UPDATE, {'Scanning Folder: %s' % f['name']})
-                if f['mimeType'] == 'application/vnd.google-apps.folder':
-                    self.driveTree.AddFolder(folder_id, f['id'], f['name'], f)
-                    self.calculateUsageOfFolder(f['id'])
-                else:
-                    if not self.IsGoogleDocument(f):
-                        if self.IsAudioFile(f):
-                            self.driveAudioUsage += self.GetFileSize(f)
-                        elif  self.IsImageFile(f):
-                            self.drivePhotoUsage += self.GetFileSize(f)
-                        elif self.IsVideoFile(f):
-                            self.driveMoviesUsage += self.GetFileSize(f)
-                        elif self.IsDocument(f):
-                            self.driveDocumentUsage += self.GetFileSize(f)
-                        else:
-                            self.driveOthersUsage += self.GetFileSize(f)
-                            self.SendlToLog(3,"calculateUsageOfFolder: Unknown Mime %s\n" % f['mimeType'])
-                        GoSyncEventController().PostEvent(GOSYNC_EVENT_CALCULATE_USAGE_UPDATE, self.fcount)
-        except:
-            raise
-
 #### calculateUsage
     def calculateUsage(self):
         while not self.shutting_down:
@@ -2127,63 +2663,128 @@ class GoSyncModel(object):
 
             self.sync_lock.acquire()
             self.SendlToLog(3,"CalculateUsage: SyncLock acquired")
+            try:
+                self.CalculateUsageLocked()
+            finally:
+                self.calculatingDriveUsage = False
+                self.sync_lock.release()
 
-            if self.force_usage_calculation == True:
-                # Usage calculation is forced by user, wipe the slate clean
-                self.drive_usage_dict = {}
-                self.driveTree = GoogleDriveTree()
+    def CalculateUsageLocked(self):
+        """
+        The body of calculateUsage, run with sync_lock held.
+        """
+        forced = self.force_usage_calculation
+        self.force_usage_calculation = False
+        if forced:
+            # Usage calculation is forced by user, wipe the slate clean
+            self.drive_usage_dict = {}
 
-            if self.drive_usage_dict and not self.updates_done:
-                self.SendlToLog(3,"CalculateUsage: No calculation to be done")
-                GoSyncEventController().PostEvent(GOSYNC_EVENT_CALCULATE_USAGE_DONE, 0)
-                self.sync_lock.release()
-                continue
+        if self.drive_usage_dict and not self.updates_done:
+            self.SendlToLog(3,"CalculateUsage: No calculation to be done")
+            GoSyncEventController().PostEvent(GOSYNC_EVENT_CALCULATE_USAGE_DONE, self.GetUsageSnapshot())
+            return
 
-            self.SendlToLog(3,"CalculateUsage: Started")
-            self.updates_done = 0
-            self.calculatingDriveUsage = True
-            self.driveAudioUsage = 0
-            self.driveMoviesUsage = 0
-            self.driveDocumentUsage = 0
-            self.drivePhotoUsage = 0
-            self.driveOthersUsage = 0
-            self.fcount = 0
+        self.SendlToLog(3,"CalculateUsage: Started")
+        self.updates_done = 0
+        self.calculatingDriveUsage = True
+        self.driveAudioUsage = 0
+        self.driveMoviesUsage = 0
+        self.driveDocumentUsage = 0
+        self.drivePhotoUsage = 0
+        self.driveOthersUsage = 0
+        self.fcount = 0
+        try:
             self.RetrieveAbout_Drive()
+        except:
+            # The quota of the last refresh, or of the last run, will do
+            self.SendlToLog(1, "CalculateUsage: Failed to refresh the account details, using the saved ones")
+        try:
+            GoSyncEventController().PostEvent(GOSYNC_EVENT_CALCULATE_USAGE_STARTED, 0)
+            self.SendlToLog(3,"CalculateUsage: Scanning files...\n")
             try:
-                GoSyncEventController().PostEvent(GOSYNC_EVENT_CALCULATE_USAGE_STARTED, 0)
-                self.SendlToLog(3,"CalculateUsage: Scanning files...\n")
-                try:
-                    self.calculateUsageOfFolder('root')
-                    GoSyncEventController().PostEvent(GOSYNC_EVENT_CALCULATE_USAGE_DONE, 0)
-                    #self.drive_usage_dict['Total Files'] = self.totalFilesToCheck
-                    self.drive_usage_dict['Total Size'] = long(self.about_drive['storageQuota']['limit'])
-                    self.drive_usage_dict['Audio Size'] = self.driveAudioUsage
-                    self.drive_usage_dict['Movies Size'] = self.driveMoviesUsage
-                    self.drive_usage_dict['Document Size'] = self.driveDocumentUsage
-                    self.drive_usage_dict['Photo Size'] = self.drivePhotoUsage
-                    self.drive_usage_dict['Others Size'] = self.driveOthersUsage
-                    pickle.dump(self.driveTree, open(self.tree_pickle_file, "wb"))
-                    self.config_dict['Drive Usage'] = self.drive_usage_dict
-                    self.SaveConfig()
-                except:
-                    self.driveAudioUsage = 0
-                    self.driveMoviesUsage = 0
-                    self.driveDocumentUsage = 0
-                    self.drivePhotoUsage = 0
-                    self.driveOthersUsage = 0
-                    GoSyncEventController().PostEvent(GOSYNC_EVENT_CALCULATE_USAGE_DONE, -1)
+                if forced or not self.driveTree.GetRoot().GetChildren():
+                    # Bootstrap: the tree is built from one listing of
+                    # the whole drive. After that the change feed keeps
+                    # it up to date.
+                    tree = self.ScanWholeDrive()
+                    if tree is None:
+                        raise RuntimeError("Drive scan aborted")
+                    self.driveTree = tree
+                snapshot = self.UpdateDriveUsage()
+                self.fcount = len(snapshot) - 1
+                # Built here, the UI only has to draw it
+                GoSyncEventController().PostEvent(GOSYNC_EVENT_CALCULATE_USAGE_DONE, snapshot)
+                #self.drive_usage_dict['Total Files'] = self.totalFilesToCheck
+                self.drive_usage_dict['Total Size'] = long(self.about_drive['storageQuota']['limit'])
+                self.drive_usage_dict['Audio Size'] = self.driveAudioUsage
+                self.drive_usage_dict['Movies Size'] = self.driveMoviesUsage
+                self.drive_usage_dict['Document Size'] = self.driveDocumentUsage
+                self.drive_usage_dict['Photo Size'] = self.drivePhotoUsage
+                self.drive_usage_dict['Others Size'] = self.driveOthersUsage
+                self.drive_usage_dict['Files Scanned'] = self.fcount
+                self.config_dict['Drive Usage'] = self.drive_usage_dict
+                self.SaveState()
             except:
+                self.driveAudioUsage = 0
+                self.driveMoviesUsage = 0
+                self.driveDocumentUsage = 0
+                self.drivePhotoUsage = 0
+                self.driveOthersUsage = 0
                 GoSyncEventController().PostEvent(GOSYNC_EVENT_CALCULATE_USAGE_DONE, -1)
-                self.SendlToLog(1,"Failed to get the total number of files in drive\n")
-
-            self.calculatingDriveUsage = False
-            self.sync_lock.release()
+        except:
+            GoSyncEventController().PostEvent(GOSYNC_EVENT_CALCULATE_USAGE_DONE, -1)
+            self.SendlToLog(1,"Failed to get the total number of files in drive\n")
 
     def GetDriveDirectoryTree(self):
-        self.sync_lock.acquire()
-        ref_tree = copy.deepcopy(self.driveTree)
-        self.sync_lock.release()
-        return ref_tree
+        # An immutable snapshot of the folders, cheap to take and safe to
+        # walk from the UI while the sync thread changes the tree.
+        return self.driveTree.GetDirectorySnapshot()
+
+    def GetUsageSnapshot(self):
+        """
+        Return a UsageSnapshot of the drive tree. It is taken again only
+        when the tree has changed since the last one, which walks the
+        whole tree: not to be called from the UI thread, see
+        GetLastUsageSnapshot().
+        """
+        tree = self.driveTree
+        snapshot = self.usage_snapshot
+        if (snapshot is None or self.usage_snapshot_tree is not tree
+            or snapshot.generation != tree.GetGeneration()):
+            snapshot = UsageSnapshot(tree)
+            self.usage_snapshot = snapshot
+            self.usage_snapshot_tree = tree
+
+        return snapshot
+
+    def GetLastUsageSnapshot(self):
+        """
+        Return the UsageSnapshot last taken by the usage thread, or None.
+        """
+        return self.usage_snapshot
+
+    def SearchDrive(self, query, prefix=False, folders_only=False, limit=100):
+        """
+        Find files and folders in the drive tree by name, without asking
+        Drive. Returns the matching nodes.
+        """
+        index = self.search_index
+        tree = self.driveTree
+        if index is None or index.tree is not tree:
+            index = SearchIndex(tree)
+            self.search_index = index
+
+        return index.Search(query, prefix, folders_only, limit)
+
+    def UpdateDriveUsage(self):
+        snapshot = self.GetUsageSnapshot()
+        totals = snapshot.CategoryTotals()
+        self.driveAudioUsage = int(totals[CATEGORY_AUDIO])
+        self.drivePhotoUsage = int(totals[CATEGORY_PHOTO])
+        self.driveMoviesUsage = int(totals[CATEGORY_MOVIES])
+        self.driveDocumentUsage = int(totals[CATEGORY_DOCUMENT])
+        self.driveOthersUsage = int(totals[CATEGORY_OTHERS])
+        return snapshot
 
     def IsCalculatingDriveUsage(self):
         return self.calculatingDriveUsage
@@ -2204,10 +2805,21 @@ class GoSyncModel(object):
         return self.drivePhotoUsage
 
     def StartSync(self):
+        if self.cancel_token.IsCancelled() and not self.shutting_down:
+            self.cancel_token = CancelToken()
         self.syncRunning.set()
 
     def StopSync(self):
         self.syncRunning.clear()
+        self.cancel_token.Cancel()
+        self.AbortRequests()
+
+    def AbortRequests(self):
+        # Reads blocked on Drive end now rather than at their timeout.
+        # The calls of a cancelled sync raise SyncCancelled, others are
+        # retried.
+        if self.client_factory is not None:
+            self.client_factory.Abort()
 
     def IsSyncRunning(self):
         return self.syncing_now
@@ -0,0 +1,204 @@
+# gosync is an open source Google Drive(TM) sync application for Linux
+#
+# Copyright (C) 2015 Himanshu Chauhan
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+
+import os, shutil
+try :
+    from .GoSyncDriveTree import FOLDER_MIME_TYPE
+except (ImportError, ValueError):
+    from GoSyncDriveTree import FOLDER_MIME_TYPE
+
+# What MoveLocalCopy() did with the local copy
+LOCAL_MOVED = 'moved'
+LOCAL_DELETED = 'deleted'
+
+# How the drive tree and the sync selection follow the changes from
+# Drive's change feed. 'sync_selection' is the list of [drive path,
+# folder id] pairs of the model, [['root', '']] when the whole drive is
+# synced, and is changed in place. These don't log nor post events; the
+# model does that around them.
+
+def RemoteParentId(fdata, root_id):
+    """
+    Return the first parent of the file 'fdata', 'root' for the ID of
+    My Drive 'root_id', or None if it has none.
+    """
+    pid = (fdata.get('parents') or [None])[0]
+    if pid == root_id:
+        pid = 'root'
+    return pid
+
+def IsMonitoringAll(sync_selection):
+    return sync_selection[0][1] == ''
+
+def AddNodeToTree(tree, parent, f):
+    """
+    Add the file or folder 'f' under 'parent' in the drive tree, if the
+    parent is in the tree.
+    """
+    pnode = tree.FindFolder(parent)
+    if pnode is None or pnode.IsFile():
+        return
+
+    if f['mimeType'] == FOLDER_MIME_TYPE:
+        tree.AddFolder(parent, f['id'], f['name'], f)
+    else:
+        tree.AddFile(parent, f['id'], f['name'], f)
+
+def IsChangeMonitored(tree, sync_selection, root_id, fid, change, path=None):
+    """
+    Tell whether a change from the change feed can touch the sync
+    selection: whether the file was, or now is, in a selected folder
+    (or below one) or in the root folder, or is a folder with a
+    selected folder below it. This is decided from the ancestry of
+    the file in the drive tree. 'path' is the drive path of the file
+    as looked up on remote, for files whose parent the tree doesn't
+    know. A change that can't be placed is passed on.
+    """
+    if IsMonitoringAll(sync_selection):
+        return True
+
+    selected = set(d[1] for d in sync_selection if d[1])
+
+    def InSelection(pid):
+        return pid == 'root' or tree.HasAncestorIn(pid, selected)
+
+    node = tree.FindFile(fid)
+    if node is not None:
+        if InSelection(node.GetParentId()):
+            return True
+        if not node.IsFile() and any(tree.HasAncestorIn(s, (fid,)) for s in selected):
+            return True
+
+    if change.get('removed'):
+        return node is None
+
+    fdata = change.get('file')
+    if fdata is None:
+        return True
+
+    pid = RemoteParentId(fdata, root_id)
+    if pid is None:
+        return False
+
+    if tree.FindFolder(pid) is not None:
+        return InSelection(pid)
+
+    if path is None:
+        return True
+
+    dirpath = os.path.dirname(path).strip('/')
+    for d in sync_selection:
+        spath = d[0].strip('/')
+        if dirpath == spath or dirpath.startswith(spath + '/'):
+            return True
+
+    return dirpath == ''
+
+def ApplyChangeToTree(tree, root_id, fid, change):
+    """
+    Bring the drive tree up to date with a change outside the sync
+    selection. Nothing is done on disk or on remote.
+    """
+    node = tree.FindFile(fid)
+    fdata = change.get('file')
+    if change.get('removed') or fdata.get('trashed'):
+        if node is not None:
+            tree.DeleteFolder(fid)
+        return
+
+    pid = RemoteParentId(fdata, root_id)
+    pnode = tree.FindFolder(pid) if pid else None
+    if pnode is None or pnode.IsFile():
+        # Somewhere the tree doesn't know about
+        if node is not None:
+            tree.DeleteFolder(fid)
+        return
+
+    if node is None:
+        AddNodeToTree(tree, pid, fdata)
+        return
+
+    if node.GetParentId() != pid or node.GetName() != fdata.get('name'):
+        tree.MoveNode(fid, pid, fdata.get('name'))
+    if node.IsFile():
+        tree.AddFile(pid, fid, fdata.get('name'), fdata)
+
+def MoveLocalCopy(old_abs_path, new_abs_path):
+    """
+    Move the local copy of a file or folder moved on remote from
+    'old_abs_path' to 'new_abs_path'. If the new place isn't synced,
+    i.e. its folder doesn't exist locally, the local copy is deleted.
+    Returns LOCAL_MOVED, LOCAL_DELETED, or None if there was nothing to
+    move or something is in the way.
+    """
+    if not os.path.exists(old_abs_path) or os.path.exists(new_abs_path):
+        return None
+
+    if os.path.isdir(os.path.dirname(new_abs_path)):
+        os.rename(old_abs_path, new_abs_path)
+        return LOCAL_MOVED
+
+    if os.path.isdir(old_abs_path):
+        shutil.rmtree(old_abs_path, True)
+    else:
+        os.remove(old_abs_path)
+    return LOCAL_DELETED
+
+def ApplyRemoteMove(tree, sync_selection, mirror_directory, root_id, node, fdata,
+                    new_abs_path, on_local_move=None):
+    """
+    If the file or folder in 'node' was renamed or moved on remote,
+    rename the local copy under 'mirror_directory' and move the node in
+    the drive tree instead of downloading it again. Returns True if it
+    had moved.
+
+    Selected folders at or below a moved folder follow it. If the new
+    parent isn't in the tree the node is dropped from it, and the
+    folders removed with it from the selection; the whole drive is
+    synced once nothing is left selected. on_local_move(old relative
+    path, new relative path, LOCAL_*) is called once the local copy is
+    dealt with.
+    """
+    parent = RemoteParentId(fdata, root_id)
+    if node.GetParentId() == parent and node.GetName() == fdata.get('name'):
+        return False
+
+    old_rel_path = node.GetPath()
+    old_abs_path = os.path.join(mirror_directory, old_rel_path)
+    new_rel_path = os.path.relpath(new_abs_path, mirror_directory)
+    done = MoveLocalCopy(old_abs_path, new_abs_path)
+    if on_local_move is not None:
+        on_local_move(old_rel_path, new_rel_path, done)
+
+    try:
+        tree.MoveNode(node.GetId(), parent, fdata.get('name'))
+    except NameError:
+        # The new parent isn't in the tree, forget about the node
+        removed = set(tree.DeleteFolder(node.GetId()))
+        sync_selection[:] = [d for d in sync_selection if d[1] not in removed]
+        if not sync_selection:
+            sync_selection.append(['root', ''])
+        return True
+
+    if not node.IsFile():
+        for d in sync_selection:
+            if d[0] == old_rel_path or d[0].startswith(old_rel_path + os.sep):
+                d[0] = new_rel_path + d[0][len(old_rel_path):]
+
+    return True
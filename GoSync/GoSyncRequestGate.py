@@ -0,0 +1,242 @@
+# gosync is an open source Google Drive(TM) sync application for Linux
+#
+# Copyright (C) 2015 Himanshu Chauhan
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+import random, threading, time
+import httplib2
+from email.utils import parsedate_to_datetime
+from apiclient.errors import HttpError
+
+# Drive's default per-user quota: 12,000 calls a minute
+DRIVE_USER_QUOTA = 12000
+DRIVE_QUOTA_PERIOD = 60.0
+DEFAULT_BURST = 100
+
+# Statuses of calls that may well succeed when sent again a bit later
+TRANSIENT_STATUS = (408, 429, 500, 502, 503, 504)
+
+def Sleep(seconds, cancel=None):
+    if cancel is None:
+        time.sleep(seconds)
+    else:
+        cancel.Sleep(seconds)
+
+def IsRateLimited(error):
+    """
+    True if 'error' is Drive telling us to slow down: a 429, or a 403
+    with one of the *RateLimitExceeded reasons. Any other 403 is a
+    permission problem and won't go away by waiting.
+    """
+    if not isinstance(error, HttpError):
+        return False
+    if error.resp.status == 429:
+        return True
+    return error.resp.status == 403 and b'ratelimitexceeded' in (error.content or b'').lower()
+
+def IsNetworkError(error):
+    """
+    True if 'error' means the call got no answer at all.
+    """
+    return (not isinstance(error, HttpError)
+            and isinstance(error, (OSError, httplib2.HttpLib2Error)))
+
+def IsTransient(error):
+    """
+    True if the call that failed with 'error' is worth sending again.
+    """
+    if isinstance(error, HttpError):
+        return error.resp.status in TRANSIENT_STATUS or IsRateLimited(error)
+    if isinstance(error, httplib2.ServerNotFoundError):
+        # No name resolution, most likely no network at all. Callers
+        # check the connection themselves.
+        return False
+    return IsNetworkError(error)
+
+def RetryAfter(error):
+    """
+    Return the seconds the server asked us to wait in a Retry-After
+    header, or None.
+    """
+    if not isinstance(error, HttpError):
+        return None
+    value = error.resp.get('retry-after')
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+class RequestGate(object):
+    """
+    Single gate for all Drive calls of an account, shared by every
+    thread that makes them.
+
+    A token bucket holding 'burst' calls and refilled at 'rate' calls a
+    second keeps us under the per-user quota. A call failing with a
+    transient error is sent again after a full jitter exponential
+    backoff (a random wait between 0 and base_delay * 2^attempt, capped
+    at max_delay), or after Retry-After if the server asks for longer.
+    When Drive says we are over the rate limit the whole gate is paused
+    for that time, not just the one call, so that the other threads
+    don't carry on hammering. Permanent errors are raised at once.
+
+    If a ConnectivityMonitor is given as 'monitor', the outcome of every
+    call is reported to it. A network error is only retried here while
+    the monitor still takes the link for up; once it is down the error
+    is raised at once, for the callers to wait on the monitor.
+
+    The counters are: calls let through, calls held back for a token
+    or a pause (throttled), calls sent again (retried) and calls given
+    up on (failed).
+    """
+    def __init__(self, rate=DRIVE_USER_QUOTA / DRIVE_QUOTA_PERIOD, burst=DEFAULT_BURST,
+                 max_retries=5, base_delay=1.0, max_delay=64.0, monitor=None):
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.monitor = monitor
+        self.lock = threading.Lock()
+        self.tokens = self.burst
+        self.stamp = time.monotonic()
+        self.paused_until = 0.0
+        self.calls = 0
+        self.throttled = 0
+        self.retried = 0
+        self.failed = 0
+
+    def Acquire(self, cost=1, cancel=None):
+        """
+        Take 'cost' tokens (a batch request costs one per call in it),
+        waiting for them if the bucket is short or the gate is paused.
+        The wait ends with SyncCancelled if the CancelToken 'cancel' is
+        cancelled meanwhile.
+        """
+        cost = min(cost, self.burst)
+        waited = False
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+                self.stamp = now
+                wait = self.paused_until - now
+                if wait <= 0:
+                    if self.tokens >= cost:
+                        self.tokens -= cost
+                        self.calls += 1
+                        if waited:
+                            self.throttled += 1
+                        return
+                    wait = (cost - self.tokens) / self.rate
+            waited = True
+            Sleep(wait, cancel)
+
+    def Pause(self, delay):
+        """
+        Hold back every call through the gate for 'delay' seconds.
+        """
+        with self.lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + delay)
+
+    def BackoffDelay(self, attempt):
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+
+    def RetryDelay(self, error, attempt):
+        """
+        Return how long to wait before sending again a call that failed
+        with 'error' on its 'attempt'th retry, or None if it shouldn't be
+        sent again.
+        """
+        if attempt >= self.max_retries or not IsTransient(error):
+            return None
+
+        delay = self.BackoffDelay(attempt)
+        retry_after = RetryAfter(error)
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+        return delay
+
+    def CountRetries(self, count, delay=None):
+        """
+        Account for 'count' calls that are being sent again outside of
+        Execute(), e.g. calls of a batch. If 'delay' is given the gate
+        is paused for that long.
+        """
+        with self.lock:
+            self.retried += count
+        if delay is not None:
+            self.Pause(delay)
+
+    def Execute(self, call, cost=1, limit=None, cancel=None):
+        """
+        Return call(), made once 'cost' tokens are available, and inside
+        a slot of the AIMDLimit 'limit' if one is given. Transient
+        errors are retried as described above; the last error is raised
+        when the retries run out. If the CancelToken 'cancel' is
+        cancelled, SyncCancelled is raised instead of making or retrying
+        the call.
+        """
+        attempt = 0
+        while True:
+            if cancel is not None:
+                cancel.Check()
+            self.Acquire(cost, cancel)
+            try:
+                if limit is None:
+                    response = call()
+                else:
+                    with limit.Slot():
+                        response = call()
+            except Exception as error:
+                if cancel is not None:
+                    # Most likely the call was cut short for that
+                    cancel.Check()
+                delay = self.RetryDelay(error, attempt)
+                if self.monitor is not None:
+                    if IsNetworkError(error):
+                        self.monitor.ReportFailure()
+                        if not self.monitor.IsUp():
+                            delay = None
+                    elif isinstance(error, HttpError):
+                        self.monitor.ReportSuccess()
+                if delay is None:
+                    with self.lock:
+                        self.failed += 1
+                    raise
+                rate_limited = IsRateLimited(error)
+            else:
+                if self.monitor is not None:
+                    self.monitor.ReportSuccess()
+                return response
+
+            attempt += 1
+            if rate_limited:
+                self.CountRetries(1, delay)
+            else:
+                self.CountRetries(1)
+                Sleep(delay, cancel)
+
+    def GetStats(self):
+        with self.lock:
+            return {'calls': self.calls, 'throttled': self.throttled,
+                    'retried': self.retried, 'failed': self.failed}
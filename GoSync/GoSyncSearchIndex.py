@@ -0,0 +1,163 @@
+# gosync is an open source Google Drive(TM) sync application for Linux
+#
+# Copyright (C) 2015 Himanshu Chauhan
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+import threading
+from bisect import bisect_right
+try :
+    from .GoSyncDriveTree import CHANGE_UPDATE
+except (ImportError, ValueError):
+    from GoSyncDriveTree import CHANGE_UPDATE
+
+# Separates the names in the index text. Not allowed in a query.
+NAME_SEP = '\0'
+
+class SearchIndex(object):
+    """
+    Filename index over a GoogleDriveTree for substring and prefix
+    search.
+
+    All lower-cased names are kept in one string, separated by NAME_SEP,
+    with the offset of every name next to it. A query is a str.find()
+    loop over that string, which is a plain memory scan, and a bisect to
+    map each hit back to its node. This costs a few bytes per name where
+    an n-gram index would cost a set entry per character.
+
+    The index follows the tree through its change log. Names added or
+    renamed since the last rebuild are kept on the side and the stale
+    entries in the string are skipped; once there are too many of
+    them, or the log doesn't reach back far enough, the string is built
+    again.
+    """
+    # Rebuild once this many names have changed since the last build
+    REBUILD_AFTER = 20000
+
+    def __init__(self, tree):
+        self.tree = tree
+        self.lock = threading.Lock()
+        self.text = ''
+        self.offsets = []
+        self.ids = []
+        # id -> lower-cased name, for nodes added or renamed since the
+        # last rebuild
+        self.recent = {}
+        # ids whose entry in 'text' is out of date
+        self.stale = set()
+        self.generation = None
+
+    def __Rebuild(self):
+        with self.tree.lock.read_locked():
+            self.generation = self.tree.GetGeneration()
+            nodes = self.tree.GetAllNodes()
+
+        names = []
+        self.offsets = []
+        self.ids = []
+        offset = 0
+        for node in nodes:
+            name = node.GetName().lower().replace(NAME_SEP, ' ')
+            # Every name is preceded by a separator, so that prefix
+            # matches are the hits found right after one.
+            offset += 1
+            self.offsets.append(offset)
+            self.ids.append(node.GetId())
+            names.append(name)
+            offset += len(name)
+
+        self.text = NAME_SEP + NAME_SEP.join(names)
+        self.recent = {}
+        self.stale = set()
+
+    def Refresh(self):
+        """
+        Bring the index up to date with the tree.
+        """
+        with self.lock:
+            changes = None
+            if self.generation is not None:
+                changes = self.tree.ChangesSince(self.generation)
+
+            if changes is None:
+                self.__Rebuild()
+                return
+
+            if not changes:
+                return
+
+            for generation, kind, fid in changes:
+                # A metadata update leaves the name as it was
+                if kind == CHANGE_UPDATE:
+                    continue
+
+                self.stale.add(fid)
+                node = self.tree.FindFile(fid)
+                if node is None:
+                    self.recent.pop(fid, None)
+                else:
+                    self.recent[fid] = node.GetName().lower()
+            self.generation = changes[-1][0]
+
+            if len(self.stale) > self.REBUILD_AFTER:
+                self.__Rebuild()
+
+    def Search(self, query, prefix=False, folders_only=False, limit=100):
+        """
+        Return up to 'limit' nodes whose name contains 'query', or starts
+        with it if 'prefix' is True. Case is ignored.
+        """
+        query = query.lower()
+        if not query or NAME_SEP in query:
+            return []
+
+        self.Refresh()
+        with self.lock:
+            text = self.text
+            offsets = self.offsets
+            ids = self.ids
+            stale = self.stale
+            recent = list(self.recent.items())
+
+        results = []
+        seen = set()
+
+        def Take(fid):
+            if fid in seen:
+                return False
+            seen.add(fid)
+            node = self.tree.FindFile(fid)
+            if node is None or (folders_only and node.IsFile()):
+                return False
+            results.append(node)
+            return len(results) >= limit
+
+        for fid, name in recent:
+            if (name.startswith(query) if prefix else query in name) and Take(fid):
+                return results
+
+        pattern = NAME_SEP + query if prefix else query
+        pos = text.find(pattern)
+        while pos != -1:
+            hit = pos + 1 if prefix else pos
+            i = bisect_right(offsets, hit) - 1
+            fid = ids[i]
+            if fid not in stale and Take(fid):
+                break
+            # Carry on after this name, one hit per name is enough
+            next_name = offsets[i + 1] if i + 1 < len(offsets) else len(text)
+            pos = text.find(pattern, next_name - 1 if prefix else next_name)
+
+        return results
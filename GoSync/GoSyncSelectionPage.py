@@ -38,6 +38,10 @@ class SelectionPage(wx.Panel):
 
         self.sync_model = sync_model
         self.dstc = GoSyncDriveTree(self, pos=(0,0))
+        # Folder ID -> tree item, filled by MakeDriveTree
+        self.tree_items = {}
+        self.search_results = []
+        self.search_pos = 0
 
         self.t1 = wx.StaticText(self, -1, "Choose the directories to sync:", pos=(0,0))
         self.t1.SetFont(headerFont)
@@ -48,6 +52,12 @@ class SelectionPage(wx.Panel):
         self.dstc.Disable()
         self.cb.Bind(wx.EVT_CHECKBOX, self.SyncSetting)
 
+        self.search = wx.SearchCtrl(self, -1, style=wx.TE_PROCESS_ENTER)
+        self.search.SetDescriptiveText("Find folder")
+        self.search.Bind(wx.EVT_TEXT_ENTER, self.FindFolder)
+        self.search.Bind(wx.EVT_SEARCHCTRL_SEARCH_BTN, self.FindFolder)
+        self.search.Bind(wx.EVT_TEXT, self.SearchTextChanged)
+
         self.Bind(CT.EVT_TREE_ITEM_CHECKED, self.ItemChecked)
 
         GoSyncEventController().BindEvent(self, GOSYNC_EVENT_CALCULATE_USAGE_DONE,
@@ -60,6 +70,7 @@ class SelectionPage(wx.Panel):
         sizer = wx.BoxSizer(wx.VERTICAL)
         sizer.Add(self.t1, 0, wx.ALL)
         sizer.Add(self.cb, 0, wx.ALL)
+        sizer.Add(self.search, 0, wx.ALL|wx.EXPAND, 2)
         sizer.Add(self.dstc, 1, wx.EXPAND,2)
         self.SetSizer(sizer)
 
@@ -93,6 +104,25 @@ class SelectionPage(wx.Panel):
         #else:
         #    self.sync_model.RemoveSyncSelection(folder)
 
+    def SearchTextChanged(self, event):
+        self.search_results = []
+
+    def FindFolder(self, event):
+        # Enter again moves on to the next folder that matches
+        if not self.search_results:
+            folders = self.sync_model.SearchDrive(self.search.GetValue(), folders_only=True)
+            self.search_results = [self.tree_items[f.GetId()] for f in folders
+                                   if f.GetId() in self.tree_items]
+            self.search_pos = 0
+            if not self.search_results:
+                return
+        else:
+            self.search_pos = (self.search_pos + 1) % len(self.search_results)
+
+        item = self.search_results[self.search_pos]
+        self.dstc.EnsureVisible(item)
+        self.dstc.SelectItem(item)
+
     def MakeDriveTree(self, gnode, tnode):
         if gnode.IsFile():
             return
@@ -103,6 +133,7 @@ class SelectionPage(wx.Panel):
                 continue
             nnode = self.dstc.AppendItem(tnode, f.GetName(), ct_type=1)
             self.dstc.SetPyData(nnode, f)
+            self.tree_items[f.GetId()] = nnode
             self.MakeDriveTree(f, nnode)
 
     def GetItemsToBeChecked(self, checklist, itemParent = None, itemToBeChecked = None):
@@ -131,6 +162,8 @@ class SelectionPage(wx.Panel):
         self.t1.SetLabel("Choose the directories to sync:")
         self.cb.Enable()
         self.dstc.DeleteAllItems()
+        self.tree_items = {}
+        self.search_results = []
         self.dstc_root = self.dstc.AddRoot("Google Drive Root")
         self.MakeDriveTree(driveTree.GetRoot(), self.dstc_root)
         self.dstc.Expand(self.dstc_root)
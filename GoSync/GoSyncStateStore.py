@@ -0,0 +1,205 @@
+# gosync is an open source Google Drive(TM) sync application for Linux
+#
+# Copyright (C) 2015 Himanshu Chauhan
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+import os, sqlite3, threading, json
+from urllib.request import pathname2url
+from collections import defaultdict
+try :
+    from .GoSyncDriveTree import GoogleDriveTree
+except (ImportError, ValueError):
+    from GoSyncDriveTree import GoogleDriveTree
+
+class StateStoreFailed(RuntimeError):
+    """Failed to read or write the GoSync state database"""
+
+class StateStore(object):
+    """
+    Persistent state of one account: the drive tree, the last page
+    token, the sync selections and the settings, all in one SQLite
+    database in WAL mode.
+
+    Save() writes the tree nodes that changed since the previous save
+    and the given values in a single transaction, so the page token and
+    the tree can never get out of step on disk. What changed is read
+    from the tree's change log; a tree the store has not written before,
+    or one whose log no longer goes back to the last save, is written
+    out completely.
+
+    With 'read_only' the database is opened read only and left as it
+    is, schema included, so that it can be looked at while GoSync runs.
+    """
+    def __init__(self, db_path, read_only=False):
+        self.db_path = db_path
+        self.lock = threading.Lock()
+        # The tree on disk is saved_tree as of generation saved_generation
+        self.saved_tree = None
+        self.saved_generation = 0
+        try:
+            if read_only:
+                uri = 'file:%s?mode=ro' % pathname2url(os.path.abspath(db_path))
+                self.db = sqlite3.connect(uri, uri=True, check_same_thread=False,
+                                          isolation_level=None)
+                return
+
+            self.db = sqlite3.connect(db_path, check_same_thread=False,
+                                      isolation_level=None)
+            self.db.execute("PRAGMA journal_mode=WAL")
+            self.db.execute("PRAGMA synchronous=NORMAL")
+            self.db.execute("CREATE TABLE IF NOT EXISTS nodes ("
+                            "id TEXT PRIMARY KEY, "
+                            "parent TEXT NOT NULL, "
+                            "name TEXT NOT NULL, "
+                            "is_folder INTEGER NOT NULL, "
+                            "mime TEXT, "
+                            "size INTEGER, "
+                            "md5 BLOB)")
+            self.db.execute("CREATE TABLE IF NOT EXISTS state ("
+                            "key TEXT PRIMARY KEY, "
+                            "value TEXT)")
+        except sqlite3.Error:
+            raise StateStoreFailed()
+
+    def Close(self):
+        with self.lock:
+            self.db.close()
+
+    def GetValue(self, key, default=None):
+        with self.lock:
+            row = self.db.execute("SELECT value FROM state WHERE key=?", (key,)).fetchone()
+
+        if row is None:
+            return default
+
+        return json.loads(row[0])
+
+    def HasTree(self):
+        with self.lock:
+            row = self.db.execute("SELECT 1 FROM nodes LIMIT 1").fetchone()
+
+        return row is not None
+
+    def LoadTree(self):
+        """
+        Build a GoogleDriveTree from the saved nodes.
+        """
+        try:
+            with self.lock:
+                rows = self.db.execute("SELECT id, parent, name, is_folder, mime, size, md5 "
+                                       "FROM nodes").fetchall()
+        except sqlite3.Error:
+            raise StateStoreFailed()
+
+        children = defaultdict(list)
+        for row in rows:
+            children[row[1]].append(row)
+
+        tree = GoogleDriveTree()
+        parents = ['root']
+        while parents:
+            parent = parents.pop()
+            for fid, pid, name, is_folder, mime, size, md5 in children.pop(parent, []):
+                if is_folder:
+                    tree.AddFolder(pid, fid, name, None)
+                    parents.append(fid)
+                else:
+                    data = {'mimeType': mime, 'size': size}
+                    if md5 is not None:
+                        data['md5Checksum'] = bytes(md5).hex()
+                    tree.AddFile(pid, fid, name, data)
+
+        # Rows left in 'children' lost their parent and are dropped. The
+        # tree matches the database, there is nothing to write back.
+        self.saved_tree = tree
+        self.saved_generation = tree.GetGeneration()
+        return tree
+
+    def __NodeRow(self, node):
+        if node.IsFile():
+            md5 = node.GetMD5()
+            if md5 is not None:
+                md5 = sqlite3.Binary(bytes.fromhex(md5))
+            return (node.GetId(), node.GetParentId(), node.GetName(), 0,
+                    node.GetMimeType(), node.size, md5)
+        else:
+            return (node.GetId(), node.GetParentId(), node.GetName(), 1,
+                    None, None, None)
+
+    def __TreeRows(self, tree):
+        """
+        Return (full, removed, rows, generation) for the tree changes
+        to write. Taken under the tree's read lock so that the rows
+        match the generation.
+        """
+        with tree.lock.read_locked():
+            generation = tree.GetGeneration()
+            changes = None
+            if tree is self.saved_tree:
+                changes = tree.ChangesSince(self.saved_generation)
+
+            if changes is None:
+                rows = [self.__NodeRow(n) for n in tree.GetAllNodes()]
+                return True, [], rows, generation
+
+            # Only the latest state of each node matters
+            removed = []
+            rows = []
+            for fid in set(fid for _, _, fid in changes):
+                node = tree.FindFile(fid)
+                if node is None:
+                    removed.append((fid,))
+                else:
+                    rows.append(self.__NodeRow(node))
+
+            return False, removed, rows, generation
+
+    def Save(self, tree=None, values=None):
+        """
+        Write the changes of 'tree' since the last save and the key/value
+        pairs in 'values' atomically.
+        """
+        full = False
+        removed = rows = None
+        if tree is not None:
+            full, removed, rows, generation = self.__TreeRows(tree)
+
+        try:
+            with self.lock:
+                self.db.execute("BEGIN")
+                try:
+                    if full:
+                        self.db.execute("DELETE FROM nodes")
+                        self.db.executemany("INSERT INTO nodes VALUES (?,?,?,?,?,?,?)", rows)
+                    elif rows or removed:
+                        self.db.executemany("DELETE FROM nodes WHERE id=?", removed)
+                        self.db.executemany("INSERT OR REPLACE INTO nodes VALUES (?,?,?,?,?,?,?)",
+                                            rows)
+
+                    if values:
+                        self.db.executemany("INSERT OR REPLACE INTO state VALUES (?,?)",
+                                            [(k, json.dumps(v)) for k, v in values.items()])
+                    self.db.execute("COMMIT")
+                except:
+                    self.db.execute("ROLLBACK")
+                    raise
+        except Exception:
+            # Nothing is marked as saved, the next Save() tries again
+            raise StateStoreFailed()
+
+        if tree is not None:
+            self.saved_tree = tree
+            self.saved_generation = generation
@@ -0,0 +1,190 @@
+# gosync is an open source Google Drive(TM) sync application for Linux
+#
+# Copyright (C) 2015 Himanshu Chauhan
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+import re
+
+# NumPy is only needed once usage is looked at. It is imported then, to
+# keep it off the startup path.
+np = None
+
+def _LoadNumPy():
+    global np
+    if np is None:
+        import numpy
+        np = numpy
+
+audio_file_mimelist = ['audio/mpeg', 'audio/x-mpeg-3', 'audio/mpeg3', 'audio/aiff', 'audio/x-aiff', 'audio/m4a', 'audio/mp4', 'audio/flac', 'audio/mp3']
+movie_file_mimelist = ['video/mp4', 'video/x-msvideo', 'video/mpeg', 'video/flv', 'video/quicktime', 'video/mkv']
+image_file_mimelist = ['image/png', 'image/jpeg', 'image/jpg', 'image/tiff']
+document_file_mimelist = ['application/powerpoint', 'applciation/mspowerpoint', \
+                              'application/x-mspowerpoint', 'application/pdf', \
+                              'application/x-dvi', 'application/vnd.ms-htmlhelp', \
+                          'application/x-mobipocket-ebook', \
+                          'application/vnd.ms-publisher']
+google_docs_re = 'application/vnd.google-apps'
+
+# Mime categories, in the order they are tested
+CATEGORY_FOLDER = 0
+CATEGORY_GOOGLE_DOC = 1
+CATEGORY_AUDIO = 2
+CATEGORY_PHOTO = 3
+CATEGORY_MOVIES = 4
+CATEGORY_DOCUMENT = 5
+CATEGORY_OTHERS = 6
+NUM_CATEGORIES = 7
+
+gd_regex = re.compile(google_docs_re, re.IGNORECASE)
+aud_regex = re.compile('audio', re.IGNORECASE)
+vid_regex = re.compile('video', re.IGNORECASE)
+img_regex = re.compile('image', re.IGNORECASE)
+doc_regex = re.compile('officedocument', re.IGNORECASE)
+
+# A drive has a few hundred distinct mime types at most, each one is
+# only matched against the regular expressions once.
+_category_cache = {}
+
+def MimeCategory(mime):
+    """
+    Return the CATEGORY_* of a mime type.
+    """
+    category = _category_cache.get(mime)
+    if category is not None:
+        return category
+
+    if mime == 'application/vnd.google-apps.folder':
+        category = CATEGORY_FOLDER
+    elif gd_regex.search(mime):
+        category = CATEGORY_GOOGLE_DOC
+    elif aud_regex.search(mime):
+        category = CATEGORY_AUDIO
+    elif img_regex.search(mime):
+        category = CATEGORY_PHOTO
+    elif vid_regex.search(mime):
+        category = CATEGORY_MOVIES
+    elif doc_regex.search(mime) or any(mime in s for s in document_file_mimelist):
+        category = CATEGORY_DOCUMENT
+    else:
+        category = CATEGORY_OTHERS
+
+    _category_cache[mime] = category
+    return category
+
+class UsageSnapshot(object):
+    """
+    Column oriented copy of the drive tree for usage analytics. Node i
+    is described by ids[i], parent[i] (index of its parent, -1 for the
+    root at index 0), depth[i], size[i] and category[i]. Parents always
+    come before their children.
+
+    The snapshot is taken once under the tree's read lock, after that
+    every query is a handful of NumPy operations over the columns.
+    """
+    def __init__(self, tree):
+        _LoadNumPy()
+        with tree.lock.read_locked():
+            self.generation = tree.GetGeneration()
+            root = tree.GetRoot()
+            self.ids = [root.GetId()]
+            parents = [-1]
+            depths = [0]
+            sizes = [0]
+            categories = [CATEGORY_FOLDER]
+
+            stack = [(root, 0)]
+            while stack:
+                folder, index = stack.pop()
+                depth = depths[index] + 1
+                for child in folder.GetChildren():
+                    child_index = len(self.ids)
+                    self.ids.append(child.GetId())
+                    parents.append(index)
+                    depths.append(depth)
+                    if child.IsFile():
+                        sizes.append(child.GetSize())
+                        categories.append(MimeCategory(child.GetMimeType()))
+                    else:
+                        sizes.append(0)
+                        categories.append(CATEGORY_FOLDER)
+                        stack.append((child, child_index))
+
+        self.parent = np.array(parents, dtype=np.int64)
+        self.depth = np.array(depths, dtype=np.int32)
+        self.size = np.array(sizes, dtype=np.int64)
+        self.category = np.array(categories, dtype=np.int8)
+        self.index = None
+        self.folder_sizes = None
+
+    def __len__(self):
+        return len(self.ids)
+
+    def IndexOf(self, node_id):
+        if self.index is None:
+            self.index = {fid: i for i, fid in enumerate(self.ids)}
+        return self.index.get(node_id)
+
+    def CategoryTotals(self):
+        """
+        Return the total size of the files in each category, indexed by
+        CATEGORY_*.
+        """
+        totals = np.zeros(NUM_CATEGORIES, dtype=np.int64)
+        np.add.at(totals, self.category, self.size)
+        return totals
+
+    def FolderSizes(self):
+        """
+        Return the size of every node with everything below it added
+        in. Children are folded into their parents one level at a time,
+        deepest level first.
+        """
+        if self.folder_sizes is None:
+            totals = self.size.copy()
+            order = np.argsort(self.depth, kind='stable')
+            levels = np.searchsorted(self.depth[order], np.arange(self.depth.max() + 2))
+            for d in range(len(levels) - 2, 0, -1):
+                nodes = order[levels[d]:levels[d + 1]]
+                np.add.at(totals, self.parent[nodes], totals[nodes])
+            self.folder_sizes = totals
+
+        return self.folder_sizes
+
+    def LargestFiles(self, count):
+        """
+        Return [(id, size)] of the 'count' largest files, largest first.
+        """
+        sizes = np.where(self.category == CATEGORY_FOLDER, -1, self.size)
+        count = min(count, len(sizes))
+        if count <= 0:
+            return []
+
+        top = np.argpartition(sizes, -count)[-count:]
+        top = top[np.argsort(sizes[top])[::-1]]
+        return [(self.ids[i], int(sizes[i])) for i in top if sizes[i] >= 0]
+
+    def SelectionBytes(self, folder_ids):
+        """
+        Return {folder id: bytes below the folder} for the given folders.
+        Folders that are not in the snapshot count as 0.
+        """
+        totals = self.FolderSizes()
+        result = {}
+        for fid in folder_ids:
+            i = self.IndexOf(fid)
+            result[fid] = 0 if i is None else int(totals[i])
+
+        return result
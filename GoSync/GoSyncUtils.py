@@ -17,6 +17,7 @@
 #
 
 import threading
+from contextlib import contextmanager
 
 class AtomicVariable(object):
     def __init__(self, initial):
@@ -32,3 +33,83 @@ class AtomicVariable(object):
             self._value = new
 
     value = property(get_value, set_value)
+
+class ReadWriteLock(object):
+    """
+    Lock that lets many readers in at once, or a single writer. Writers
+    are preferred: once a writer waits, new readers wait behind it.
+
+    A thread that holds the lock may take the read side again, and the
+    writer may take the write side again. A reader can not upgrade to a
+    writer.
+    """
+    def __init__(self):
+        self._cond = threading.Condition(threading.Lock())
+        self._readers = 0
+        self._writer = None
+        self._write_depth = 0
+        self._writers_waiting = 0
+        self._local = threading.local()
+
+    def acquire_read(self):
+        me = threading.get_ident()
+        reads = getattr(self._local, 'reads', 0)
+        if reads == 0:
+            if self._writer == me:
+                # Reading inside our own write section
+                self._local.counted = False
+            else:
+                with self._cond:
+                    while self._writer is not None or self._writers_waiting:
+                        self._cond.wait()
+                    self._readers += 1
+                self._local.counted = True
+        self._local.reads = reads + 1
+
+    def release_read(self):
+        self._local.reads -= 1
+        if self._local.reads == 0 and self._local.counted:
+            with self._cond:
+                self._readers -= 1
+                if self._readers == 0:
+                    self._cond.notify_all()
+
+    def acquire_write(self):
+        me = threading.get_ident()
+        with self._cond:
+            if self._writer == me:
+                self._write_depth += 1
+                return
+
+            if getattr(self._local, 'reads', 0):
+                raise RuntimeError("ReadWriteLock: can't upgrade a read lock")
+
+            self._writers_waiting += 1
+            while self._writer is not None or self._readers:
+                self._cond.wait()
+            self._writers_waiting -= 1
+            self._writer = me
+            self._write_depth = 1
+
+    def release_write(self):
+        with self._cond:
+            self._write_depth -= 1
+            if self._write_depth == 0:
+                self._writer = None
+                self._cond.notify_all()
+
+    @contextmanager
+    def read_locked(self):
+        self.acquire_read()
+        try:
+            yield
+        finally:
+            self.release_read()
+
+    @contextmanager
+    def write_locked(self):
+        self.acquire_write()
+        try:
+            yield
+        finally:
+            self.release_write()
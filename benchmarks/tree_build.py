@@ -0,0 +1,84 @@
+#!/usr/bin/python
+# gosync is an open source Google Drive(TM) sync application for Linux
+#
+# Copyright (C) 2015 Himanshu Chauhan
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+# Measures how long it takes to fill a GoogleDriveTree the way
+# calculateUsageOfFolder does it: folder by folder, adding every child
+# with AddFolder/AddFile.
+#
+# Usage: python benchmarks/tree_build.py [nodes ...]
+
+import os, sys, time, hashlib
+from collections import deque
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from GoSync.GoSyncDriveTree import GoogleDriveTree
+
+FILES_PER_FOLDER = 20
+FOLDERS_PER_FOLDER = 5
+
+# Build every string at run time, like the API client does, so that
+# nothing is shared between nodes by accident.
+def FileData(fid, name, parent):
+    return {'id': fid, 'name': name, 'parents': [parent],
+            'mimeType': '%s/%s' % ('application', 'pdf'),
+            'size': str(len(fid) * 1024),
+            'md5Checksum': hashlib.md5(fid.encode()).hexdigest()}
+
+def FolderData(fid, name, parent):
+    return {'id': fid, 'name': name, 'parents': [parent],
+            'mimeType': '%s/%s' % ('application', 'vnd.google-apps.folder')}
+
+def BuildTree(total_nodes):
+    tree = GoogleDriveTree()
+    pending = deque(['root'])
+    count = 0
+    next_id = 0
+
+    while pending and count < total_nodes:
+        parent = pending.popleft()
+        for i in range(FOLDERS_PER_FOLDER):
+            if count >= total_nodes:
+                break
+            fid = 'd%032x' % next_id
+            next_id += 1
+            tree.AddFolder(parent, fid, 'folder-%d' % i, FolderData(fid, 'folder-%d' % i, parent))
+            pending.append(fid)
+            count += 1
+        for i in range(FILES_PER_FOLDER):
+            if count >= total_nodes:
+                break
+            fid = 'f%032x' % next_id
+            next_id += 1
+            tree.AddFile(parent, fid, 'file-%d.pdf' % i, FileData(fid, 'file-%d.pdf' % i, parent))
+            count += 1
+
+    return tree
+
+def main():
+    sizes = [int(a) for a in sys.argv[1:]] or [10000, 100000, 1000000]
+    for n in sizes:
+        start = time.perf_counter()
+        tree = BuildTree(n)
+        elapsed = time.perf_counter() - start
+        print("%9d nodes: build %8.3f s (%6.2f us/node)" % (n, elapsed, elapsed * 1e6 / n))
+        del tree
+
+if __name__ == "__main__":
+    main()
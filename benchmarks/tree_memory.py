@@ -0,0 +1,49 @@
+#!/usr/bin/python
+# gosync is an open source Google Drive(TM) sync application for Linux
+#
+# Copyright (C) 2015 Himanshu Chauhan
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+# Measures the memory held by a GoogleDriveTree per node and the size
+# of its pickle.
+#
+# Usage: python benchmarks/tree_memory.py [nodes ...]
+
+import os, sys, gc, pickle, tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from tree_build import BuildTree
+
+def main():
+    sizes = [int(a) for a in sys.argv[1:]] or [100000]
+    for n in sizes:
+        gc.collect()
+        tracemalloc.start()
+        tree = BuildTree(n)
+        # Paths are cached on first use, count them as well
+        for node in list(tree.id_index.values()):
+            node.GetPath()
+        gc.collect()
+        used, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        pick = len(pickle.dumps(tree, pickle.HIGHEST_PROTOCOL))
+        print("%9d nodes: %7.1f bytes/node in memory, %6.1f bytes/node pickled"
+              % (n, float(used) / n, float(pick) / n))
+        del tree
+
+if __name__ == "__main__":
+    main()
@@ -34,7 +34,7 @@ setup(
         'GoSync':['resources/*.png'],
     },
 
-    install_requires=['wxpython>=4.1.0', 'google-api-python-client', 'google-auth-httplib2', 'google-auth-oauthlib', 'watchdog'],
+    install_requires=['wxpython>=4.1.0', 'google-api-python-client', 'google-auth-httplib2', 'google-auth-oauthlib', 'requests', 'watchdog', 'numpy'],
     entry_points={
         'console_scripts':[
             'GoSync=GoSync.GoSync:main',
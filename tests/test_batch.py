@@ -0,0 +1,140 @@
+# gosync is an open source Google Drive(TM) sync application for Linux
+#
+# Copyright (C) 2015 Himanshu Chauhan
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+
+import threading, time
+import httplib2
+import pytest
+from googleapiclient.errors import HttpError
+
+from GoSync.GoSyncBatch import BatchRequestEngine
+from GoSync.GoSyncCancel import CancelToken, SyncCancelled
+from GoSync.GoSyncRequestGate import RequestGate
+
+def Error(status):
+    return HttpError(httplib2.Response({'status': status}), b'')
+
+class FakeRequest(object):
+    """
+    Unexecuted API call that fails with 'status' the first 'fails' times.
+    """
+    def __init__(self, name, fails=0, status=503):
+        self.name = name
+        self.fails = fails
+        self.status = status
+        self.sent = 0
+
+    def execute(self):
+        self.sent += 1
+        if self.sent <= self.fails:
+            raise Error(self.status)
+        return {'name': self.name, 'sent': self.sent}
+
+class FakeBatch(object):
+    def __init__(self, service, callback):
+        self.service = service
+        self.callback = callback
+        self.requests = []
+
+    def add(self, request, request_id):
+        self.requests.append((request_id, request))
+
+    def execute(self):
+        self.service.batches.append(len(self.requests))
+        for request_id, request in self.requests:
+            try:
+                response = request.execute()
+            except HttpError as error:
+                self.callback(request_id, None, error)
+            else:
+                self.callback(request_id, response, None)
+
+class FakeService(object):
+    def __init__(self):
+        self.batches = []
+
+    def new_batch_http_request(self, callback):
+        return FakeBatch(self, callback)
+
+def Engine(service=None, batch_size=100, cancel=None):
+    return BatchRequestEngine(service or FakeService(), batch_size,
+                              gate=RequestGate(base_delay=0.001), cancel=cancel)
+
+def test_results_in_order():
+    service = FakeService()
+    engine = Engine(service, batch_size=3)
+    items = engine.Execute([FakeRequest(i) for i in range(7)])
+    assert [item.Result()['name'] for item in items] == list(range(7))
+    # The last call is sent on its own, without a batch
+    assert service.batches == [3, 3]
+    assert engine.requests_sent == 3
+
+def test_callbacks():
+    done = []
+    engine = Engine()
+    engine.Add(FakeRequest('a'), done.append)
+    engine.Add(FakeRequest('b'), done.append)
+    assert done == []
+    engine.Flush()
+    assert [item.response['name'] for item in done] == ['a', 'b']
+
+def test_transient_errors_are_retried():
+    service = FakeService()
+    engine = Engine(service)
+    requests = [FakeRequest('ok'), FakeRequest('flaky', fails=2), FakeRequest('gone', 5, 404)]
+    items = engine.Execute(requests)
+    assert items[0].Result()['sent'] == 1
+    assert items[1].Result()['sent'] == 3
+    with pytest.raises(HttpError):
+        items[2].Result()
+    assert requests[2].sent == 1
+    # The flaky call went again on its own
+    assert service.batches == [3]
+    assert engine.gate.GetStats()['retried'] == 2
+
+def test_retries_run_out():
+    engine = Engine()
+    requests = [FakeRequest('a', fails=99), FakeRequest('b', fails=99)]
+    items = engine.Execute(requests)
+    for item in items:
+        assert item.done
+        assert item.error.resp.status == 503
+    assert requests[0].sent == engine.retries + 1
+
+def test_single_call_goes_through_the_gate():
+    engine = Engine()
+    request = FakeRequest('one', fails=2)
+    item = engine.Execute([request])[0]
+    assert item.Result()['sent'] == 3
+    stats = engine.gate.GetStats()
+    assert stats['calls'] == 3
+    assert stats['retried'] == 2
+
+def test_backoff_is_cancelled():
+    cancel = CancelToken()
+    engine = BatchRequestEngine(FakeService(), gate=RequestGate(base_delay=30, max_delay=30),
+                                cancel=cancel)
+    engine.Add(FakeRequest('a', fails=99))
+    engine.Add(FakeRequest('b', fails=99))
+    threading.Timer(0.2, cancel.Cancel).start()
+    start = time.monotonic()
+    with pytest.raises(SyncCancelled):
+        engine.Flush()
+    assert time.monotonic() - start < 5
+    # What wasn't done stays queued
+    assert len(engine.pending) == 2
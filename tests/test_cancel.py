@@ -0,0 +1,52 @@
+# gosync is an open source Google Drive(TM) sync application for Linux
+#
+# Copyright (C) 2015 Himanshu Chauhan
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+
+import threading, time
+import pytest
+
+from GoSync.GoSyncCancel import CancelToken, SyncCancelled
+
+def test_cancel():
+    token = CancelToken()
+    assert not token.IsCancelled()
+    token.Check()
+    token.Cancel()
+    assert token.IsCancelled()
+    with pytest.raises(SyncCancelled):
+        token.Check()
+    # Stays cancelled
+    token.Cancel()
+    assert token.IsCancelled()
+
+def test_wait():
+    token = CancelToken()
+    assert not token.Wait(0.01)
+    token.Sleep(0.01)
+    token.Cancel()
+    assert token.Wait(30)
+    with pytest.raises(SyncCancelled):
+        token.Sleep(30)
+
+def test_wait_ends_on_cancel():
+    token = CancelToken()
+    threading.Timer(0.1, token.Cancel).start()
+    start = time.monotonic()
+    with pytest.raises(SyncCancelled):
+        token.Sleep(30)
+    assert time.monotonic() - start < 5
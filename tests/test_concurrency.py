@@ -0,0 +1,113 @@
+# gosync is an open source Google Drive(TM) sync application for Linux
+#
+# Copyright (C) 2015 Himanshu Chauhan
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+
+import threading, time
+import httplib2
+import pytest
+from googleapiclient.errors import HttpError
+
+from GoSync.GoSyncConcurrency import AIMDLimit
+
+def RateLimited():
+    return HttpError(httplib2.Response({'status': 429}), b'')
+
+def Run(limit, count, work=lambda: None):
+    """
+    Make 'count' requests through 'limit', all at once.
+    """
+    def Request():
+        with limit.Slot():
+            work()
+
+    threads = [threading.Thread(target=Request) for _ in range(count)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+def test_bounds():
+    assert AIMDLimit('x', 50, maximum=8).GetLimit() == 8
+    limit = AIMDLimit('x', 0, minimum=2)
+    assert limit.GetLimit() == 2
+    limit.SetLimit(1)
+    assert limit.GetLimit() == 2
+
+def test_slots_are_limited():
+    limit = AIMDLimit('x', 3, maximum=3)
+    lock = threading.Lock()
+    counts = {'now': 0, 'most': 0}
+
+    def Work():
+        with lock:
+            counts['now'] += 1
+            counts['most'] = max(counts['most'], counts['now'])
+        time.sleep(0.01)
+        with lock:
+            counts['now'] -= 1
+
+    Run(limit, 30, Work)
+    assert counts['most'] == 3
+
+def test_increase_when_saturated():
+    log = []
+    limit = AIMDLimit('x', 2, maximum=8, log=lambda level, message: log.append(message))
+    Run(limit, 40, lambda: time.sleep(0.01))
+    assert limit.GetLimit() > 2
+    assert log
+
+def test_no_increase_below_the_limit():
+    limit = AIMDLimit('x', 4)
+    for _ in range(40):
+        with limit.Slot():
+            pass
+    assert limit.GetLimit() == 4
+
+def test_rate_limit_halves_once_per_window():
+    limit = AIMDLimit('x', 8)
+    for _ in range(2):
+        with pytest.raises(HttpError):
+            with limit.Slot():
+                raise RateLimited()
+    assert limit.GetLimit() == 4
+
+def test_other_errors_dont_decrease():
+    limit = AIMDLimit('x', 8)
+    with pytest.raises(ValueError):
+        with limit.Slot():
+            raise ValueError()
+    assert limit.GetLimit() == 8
+
+def test_latency_decrease():
+    limit = AIMDLimit('x', 8)
+    limit.best_latency = 0.001
+    # One window of slow requests
+    Run(limit, 8, lambda: time.sleep(0.05))
+    assert limit.GetLimit() == 6
+
+def test_latency_until_first_byte():
+    limit = AIMDLimit('x', 8)
+    limit.best_latency = 0.01
+
+    def Transfer():
+        limit.FirstByte()
+        time.sleep(0.05)
+
+    # Long transfers that were answered at once are not slow
+    Run(limit, 8, Transfer)
+    assert limit.GetLimit() >= 8
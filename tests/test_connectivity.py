@@ -0,0 +1,133 @@
+# gosync is an open source Google Drive(TM) sync application for Linux
+#
+# Copyright (C) 2015 Himanshu Chauhan
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+
+import threading, time
+import httplib2
+import pytest
+from googleapiclient.errors import HttpError
+
+from GoSync.GoSyncConnectivity import ConnectivityMonitor
+from GoSync.GoSyncRequestGate import RequestGate
+
+class Probe(object):
+    def __init__(self, up=True):
+        self.up = up
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        return self.up
+
+def Monitor(probe, changes=None, interval=30):
+    # The probe thread only comes back after 'interval' seconds
+    return ConnectivityMonitor(probe, min_interval=interval, max_interval=interval,
+                               on_change=None if changes is None else changes.append)
+
+def test_one_failure_is_checked_with_a_probe():
+    probe = Probe(True)
+    monitor = Monitor(probe)
+    monitor.ReportFailure()
+    assert probe.calls == 1
+    assert monitor.IsUp()
+
+def test_failures_in_a_row_take_the_link_down():
+    probe = Probe(True)
+    changes = []
+    monitor = Monitor(probe, changes)
+    for _ in range(3):
+        monitor.ReportFailure()
+    assert not monitor.IsUp()
+    assert changes == [False]
+    # Only the first two were probed, the third one is enough on its own
+    assert probe.calls <= 3
+
+def test_success_resets_the_count():
+    monitor = Monitor(Probe(True))
+    for _ in range(5):
+        monitor.ReportFailure()
+        monitor.ReportFailure()
+        monitor.ReportSuccess()
+    assert monitor.IsUp()
+
+def test_failed_probe_takes_the_link_down():
+    probe = Probe(False)
+    monitor = Monitor(probe, interval=0.01)
+    monitor.ReportFailure()
+    assert not monitor.IsUp()
+    probe.up = True
+    assert monitor.WaitUntilUp(check_every=0.01)
+    assert monitor.IsUp()
+
+def test_stale_link_is_probed():
+    probe = Probe(False)
+    monitor = ConnectivityMonitor(probe, stale_after=60)
+    monitor.ReportSuccess()
+    assert monitor.IsUp()
+    assert probe.calls == 0
+    monitor.last_ok -= 61
+    assert not monitor.IsUp()
+    assert probe.calls == 1
+
+def test_wait_until_up_stops():
+    monitor = Monitor(Probe(False))
+    monitor.SetDown()
+    start = time.monotonic()
+    assert not monitor.WaitUntilUp(lambda: time.monotonic() - start > 0.1, 0.01)
+
+def test_reported_success_wakes_waiters():
+    changes = []
+    monitor = Monitor(Probe(False), changes)
+    monitor.SetDown()
+    threading.Timer(0.1, monitor.ReportSuccess).start()
+    assert monitor.WaitUntilUp()
+    assert changes == [False, True]
+
+def test_gate_reports_to_the_monitor():
+    monitor = Monitor(Probe(True))
+    gate = RequestGate(base_delay=0.001, monitor=monitor)
+    failures = [ConnectionResetError(), ConnectionResetError()]
+
+    def Call():
+        if failures:
+            raise failures.pop()
+        return 'done'
+
+    assert gate.Execute(Call) == 'done'
+    assert monitor.failures == 0
+
+    # An answer from Drive, even an error, means the link is up
+    monitor.ReportFailure()
+    def Missing():
+        raise HttpError(httplib2.Response({'status': 404}), b'')
+    with pytest.raises(HttpError):
+        gate.Execute(Missing)
+    assert monitor.failures == 0
+
+def test_gate_stops_retrying_once_down():
+    probe = Probe(False)
+    gate = RequestGate(base_delay=0.001, monitor=Monitor(probe))
+    calls = []
+
+    def Call():
+        calls.append(1)
+        raise ConnectionResetError()
+
+    with pytest.raises(ConnectionResetError):
+        gate.Execute(Call)
+    assert len(calls) == 1
@@ -0,0 +1,104 @@
+# gosync is an open source Google Drive(TM) sync application for Linux
+#
+# Copyright (C) 2015 Himanshu Chauhan
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+
+import os, threading, time
+
+from GoSync.GoSyncConcurrency import AIMDLimit
+from GoSync.GoSyncCrawler import RemoteCrawler, CRAWL_BREADTH_FIRST, CRAWL_DEPTH_FIRST
+from GoSync.GoSyncDriveTree import FOLDER_MIME_TYPE
+
+# folder id -> [(id, name, is folder)]
+DRIVE = {
+    'top': [('a', 'a', True), ('b', 'b', True), ('f1', 'f1', False)],
+    'a': [('a1', 'a1', True), ('f2', 'f2', False)],
+    'a1': [('f3', 'f3', False)],
+    'b': [('b1', 'b1', True)],
+    'b1': [],
+}
+
+class FakeDrive(object):
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.lock = threading.Lock()
+        self.listed = []
+        self.in_flight = 0
+        self.most_in_flight = 0
+
+    def ListFolder(self, folder_id):
+        with self.lock:
+            self.listed.append(folder_id)
+            self.in_flight += 1
+            self.most_in_flight = max(self.most_in_flight, self.in_flight)
+        time.sleep(self.delay)
+        with self.lock:
+            self.in_flight -= 1
+        return [{'id': fid, 'name': name,
+                 'mimeType': FOLDER_MIME_TYPE if folder else 'text/plain'}
+                for fid, name, folder in DRIVE[folder_id]]
+
+def Never():
+    return False
+
+def test_crawl_everything():
+    crawler = RemoteCrawler(FakeDrive().ListFolder, Never)
+    found = list(crawler.Crawl('top', 'sync'))
+    paths = dict((item['id'], (parent, path)) for parent, path, item in found)
+    assert sorted(paths) == ['a', 'a1', 'b', 'b1', 'f1', 'f2', 'f3']
+    assert paths['f3'] == ('a1', os.path.join('sync', 'a', 'a1'))
+    assert paths['a'] == ('top', 'sync')
+    assert crawler.folders_listed == 5
+
+def test_folders_come_before_their_content():
+    crawler = RemoteCrawler(FakeDrive(0.01).ListFolder, Never, workers=4)
+    seen = set(['top'])
+    for parent, path, item in crawler.Crawl('top', ''):
+        assert parent in seen
+        seen.add(item['id'])
+
+def test_not_recursive():
+    drive = FakeDrive()
+    crawler = RemoteCrawler(drive.ListFolder, Never)
+    found = [item['id'] for _, _, item in crawler.Crawl('top', '', recursive=False)]
+    assert sorted(found) == ['a', 'b', 'f1']
+    assert drive.listed == ['top']
+
+def test_order():
+    drive = FakeDrive()
+    list(RemoteCrawler(drive.ListFolder, Never, workers=1, order=CRAWL_BREADTH_FIRST).Crawl('top', ''))
+    assert drive.listed == ['top', 'a', 'b', 'a1', 'b1']
+
+    drive = FakeDrive()
+    list(RemoteCrawler(drive.ListFolder, Never, workers=1, order=CRAWL_DEPTH_FIRST).Crawl('top', ''))
+    assert drive.listed == ['top', 'b', 'b1', 'a', 'a1']
+
+def test_listings_in_parallel():
+    drive = FakeDrive(0.05)
+    list(RemoteCrawler(drive.ListFolder, Never, workers=4).Crawl('top', ''))
+    assert drive.most_in_flight == 2
+
+    drive = FakeDrive(0.05)
+    limit = AIMDLimit('listing', 1, maximum=1)
+    list(RemoteCrawler(drive.ListFolder, Never, workers=4, limit=limit).Crawl('top', ''))
+    assert drive.most_in_flight == 1
+
+def test_stop():
+    drive = FakeDrive()
+    crawler = RemoteCrawler(drive.ListFolder, lambda: len(drive.listed) >= 2, workers=1)
+    list(crawler.Crawl('top', ''))
+    assert drive.listed == ['top', 'a']
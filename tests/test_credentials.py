@@ -0,0 +1,110 @@
+# gosync is an open source Google Drive(TM) sync application for Linux
+#
+# Copyright (C) 2015 Himanshu Chauhan
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+
+import datetime, threading, time
+from google.oauth2.credentials import Credentials
+
+from GoSync import GoSyncCredentials
+from GoSync.GoSyncCredentials import CredentialManager, _UtcNow
+
+class FakeCredentials(Credentials):
+    """
+    Credentials whose refresh hands out tok1, tok2, ... valid for an
+    hour, after 'delay' seconds, and never goes to the network.
+    """
+    def __init__(self, token, expires_in, delay=0.0):
+        Credentials.__init__(self, token, refresh_token='refresh',
+                             expiry=_UtcNow() + datetime.timedelta(seconds=expires_in))
+        self.delay = delay
+        self.refreshed = 0
+
+    def refresh(self, request):
+        time.sleep(self.delay)
+        self.refreshed += 1
+        self.token = 'tok%d' % self.refreshed
+        self.expiry = _UtcNow() + datetime.timedelta(seconds=3600)
+
+def Authorization(manager):
+    headers = {}
+    manager.before_request(None, 'GET', 'https://x', headers)
+    return headers['authorization']
+
+def test_fresh_token_is_used_as_is():
+    credentials = FakeCredentials('old', 3600)
+    manager = CredentialManager(credentials)
+    assert Authorization(manager) == 'Bearer old'
+    assert credentials.refreshed == 0
+
+def test_expiring_token_is_refreshed():
+    credentials = FakeCredentials('old', GoSyncCredentials.EXPIRY_SKEW - 1)
+    manager = CredentialManager(credentials)
+    assert Authorization(manager) == 'Bearer tok1'
+    assert manager.refreshes == 1
+
+def test_concurrent_requests_refresh_once():
+    credentials = FakeCredentials('old', -10, delay=0.1)
+    saved = []
+    manager = CredentialManager(credentials, save=saved.append)
+    tokens = []
+
+    def Request():
+        tokens.append(Authorization(manager))
+
+    threads = [threading.Thread(target=Request) for _ in range(10)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert credentials.refreshed == 1
+    assert tokens == ['Bearer tok1'] * 10
+
+    deadline = time.monotonic() + 5
+    while not saved and time.monotonic() < deadline:
+        time.sleep(0.01)
+    # A copy is saved, not the shared credentials
+    assert len(saved) == 1
+    assert saved[0] is not credentials
+    assert saved[0].token == 'tok1'
+
+def test_turned_down_token_is_refreshed():
+    credentials = FakeCredentials('old', 3600)
+    manager = CredentialManager(credentials)
+    manager.refresh(None)
+    assert Authorization(manager) == 'Bearer tok1'
+    # A thread that saw the old token doesn't refresh it again
+    assert manager.Refresh(None, 'old') == 'tok1'
+    assert credentials.refreshed == 1
+
+def test_background_refresh(monkeypatch):
+    monkeypatch.setattr(GoSyncCredentials, 'REFRESH_AHEAD', 3300)
+    credentials = FakeCredentials('old', 3000)
+    manager = CredentialManager(credentials)
+    manager.Start()
+    try:
+        deadline = time.monotonic() + 5
+        while manager.refreshes == 0 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        # Refreshed ahead of expiry, and only once: the new token is
+        # good for longer than REFRESH_AHEAD
+        time.sleep(0.1)
+        assert credentials.refreshed == 1
+        assert Authorization(manager) == 'Bearer tok1'
+    finally:
+        manager.Stop()
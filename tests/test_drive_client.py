@@ -0,0 +1,261 @@
+# gosync is an open source Google Drive(TM) sync application for Linux
+#
+# Copyright (C) 2015 Himanshu Chauhan
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+
+import io, threading, time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+import pytest
+from google.auth.credentials import AnonymousCredentials
+from googleapiclient.errors import HttpError
+
+from GoSync import GoSyncDriveClient
+from GoSync.GoSyncCancel import CancelToken, SyncCancelled
+from GoSync.GoSyncDriveClient import DriveClientFactory, SessionHttp, TransferStalled
+from GoSync.GoSyncRequestGate import RequestGate
+
+class FakeResponse(object):
+    status_code = 200
+    reason = 'OK'
+    headers = {'Content-Type': 'application/json', 'Content-Encoding': 'gzip'}
+    content = b'{}'
+
+class FakeSession(object):
+    def __init__(self):
+        self.requests = []
+
+    def request(self, method, uri, **kwargs):
+        self.requests.append((method, uri, kwargs))
+        return FakeResponse()
+
+def test_session_http():
+    session = FakeSession()
+    http = SessionHttp(session, (1, 2))
+    resp, content = http.request('https://x/files', 'POST', body=b'{}', headers={'a': 'b'})
+    assert resp.status == 200
+    assert resp['content-type'] == 'application/json'
+    # requests has unpacked the content already
+    assert 'content-encoding' not in resp
+    assert content == b'{}'
+    method, uri, kwargs = session.requests[0]
+    assert (method, uri) == ('POST', 'https://x/files')
+    assert kwargs['data'] == b'{}'
+    assert kwargs['headers'] == {'a': 'b'}
+    assert kwargs['timeout'] == (1, 2)
+
+def test_media_is_not_compressed():
+    session = FakeSession()
+    SessionHttp(session).request('https://x/files/1?alt=media')
+    assert session.requests[0][2]['headers']['accept-encoding'] == 'identity'
+
+def test_service_per_thread():
+    factory = DriveClientFactory(AnonymousCredentials())
+    try:
+        service = factory.GetService()
+        assert factory.GetService() is service
+        assert factory.document['version'] == 'v3'
+
+        services = []
+        thread = threading.Thread(target=lambda: services.append(factory.GetService()))
+        thread.start()
+        thread.join()
+        assert services[0] is not service
+        # Both go over the same connection pool
+        assert services[0]._http is service._http is factory.http
+        assert hasattr(services[0], 'files')
+    finally:
+        factory.Close()
+
+CONTENT = bytes(range(256)) * 1024
+
+class MediaHandler(BaseHTTPRequestHandler):
+    """
+    Serves CONTENT, from the start of the Range header if there is one,
+    the way the server's 'mode' says: all of it, the first part then
+    nothing (stall) or slowly (slow). Anything but /file is a 404.
+    The server's 'ranges' says what is done with a Range header: 'keep'
+    it, 'ignore' it (200 with everything) or answer from the 'wrong'
+    byte. /hang never answers.
+    """
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        if self.path == '/hang':
+            self.server.stop.wait(10)
+            return
+        if self.path != '/file':
+            self.send_error(404)
+            return
+
+        self.server.ranges.append(self.headers.get('range'))
+        start = 0
+        if self.headers.get('range') and self.server.range_mode != 'ignore':
+            start = int(self.headers['range'].split('=')[1].rstrip('-'))
+            if self.server.range_mode == 'wrong':
+                start //= 2
+        body = CONTENT[start:]
+        self.send_response(206 if start else 200)
+        if start:
+            self.send_header('content-range', 'bytes %d-%d/%d'
+                             % (start, len(CONTENT) - 1, len(CONTENT)))
+        self.send_header('content-length', str(len(body)))
+        self.end_headers()
+        try:
+            if self.server.mode == 'ok':
+                self.wfile.write(body)
+                return
+            self.wfile.write(body[:100000])
+            self.wfile.flush()
+            if self.server.mode == 'stall':
+                self.server.stop.wait(10)
+                return
+            for i in range(100000, len(body), 1000):
+                if self.server.stop.wait(0.02):
+                    return
+                self.wfile.write(body[i:i + 1000])
+                self.wfile.flush()
+        except OSError:
+            pass
+
+class MediaServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+@pytest.fixture
+def server(monkeypatch):
+    httpd = MediaServer(('127.0.0.1', 0), MediaHandler)
+    httpd.mode = 'ok'
+    httpd.range_mode = 'keep'
+    httpd.ranges = []
+    httpd.stop = threading.Event()
+    thread = threading.Thread(target=httpd.serve_forever, args=(0.05,))
+    thread.daemon = True
+    thread.start()
+    monkeypatch.setattr(GoSyncDriveClient, 'MEDIA_URI',
+                        'http://127.0.0.1:%d/%%s' % httpd.server_address[1])
+    yield httpd
+    httpd.stop.set()
+    httpd.shutdown()
+    httpd.server_close()
+
+@pytest.fixture
+def factory():
+    factory = DriveClientFactory(AnonymousCredentials(), stall_timeout=0.5)
+    factory.session.mount('http://', factory.session.get_adapter('https://'))
+    yield factory
+    factory.Close()
+
+def test_download(server, factory):
+    fh = io.BytesIO()
+    progress = []
+    answered = []
+    done = factory.Download('file', fh, progress=progress.append,
+                            on_response=lambda: answered.append(True))
+    assert done == len(CONTENT)
+    assert fh.getvalue() == CONTENT
+    assert progress[-1] == len(CONTENT)
+    assert answered == [True]
+    assert server.ranges == [None]
+
+def test_download_error(server, factory):
+    with pytest.raises(HttpError) as error:
+        factory.Download('missing', io.BytesIO())
+    assert error.value.resp.status == 404
+
+def test_stalled_download_resumes(server, factory):
+    server.mode = 'stall'
+    fh = io.BytesIO()
+    start = time.monotonic()
+    with pytest.raises(TransferStalled):
+        factory.Download('file', fh)
+    assert time.monotonic() - start < 5
+    # The whole blocks that came before the stall stay
+    written = fh.tell()
+    assert 0 < written <= 100000
+
+    server.mode = 'ok'
+    assert factory.Download('file', fh, written) == len(CONTENT) - written
+    assert fh.getvalue() == CONTENT
+    assert server.ranges[-1] == 'bytes=%d-' % written
+
+@pytest.mark.parametrize('range_mode', ['ignore', 'wrong'])
+def test_resume_not_honoured(server, factory, range_mode):
+    server.range_mode = range_mode
+    fh = io.BytesIO()
+    fh.write(CONTENT[:50000])
+    progress = []
+    assert factory.Download('file', fh, 50000, progress=progress.append) == len(CONTENT)
+    # Started again from the first byte instead of appending
+    assert fh.getvalue() == CONTENT
+    assert progress[-1] == len(CONTENT)
+    if range_mode == 'ignore':
+        assert server.ranges == ['bytes=50000-']
+    else:
+        assert server.ranges == ['bytes=50000-', None]
+
+def test_download_is_cancelled(server, factory):
+    server.mode = 'slow'
+    cancel = CancelToken()
+    threading.Timer(0.2, cancel.Cancel).start()
+    start = time.monotonic()
+    with pytest.raises(SyncCancelled):
+        factory.Download('file', io.BytesIO(), cancel=cancel)
+    assert time.monotonic() - start < 2
+
+def AbortLater(factory, cancel=None, delay=0.2):
+    def Abort():
+        if cancel is not None:
+            cancel.Cancel()
+        factory.Abort()
+    threading.Timer(delay, Abort).start()
+
+def test_abort_blocked_read(server, factory):
+    url = GoSyncDriveClient.MEDIA_URI % 'hang'
+    AbortLater(factory)
+    start = time.monotonic()
+    with pytest.raises(OSError):
+        factory.http.request(url)
+    assert time.monotonic() - start < 2
+    # The pool is still good
+    server.stop.set()
+    assert factory.Download('file', io.BytesIO()) == len(CONTENT)
+
+def test_abort_stalled_download(server):
+    server.mode = 'stall'
+    factory = DriveClientFactory(AnonymousCredentials(), stall_timeout=30)
+    factory.session.mount('http://', factory.session.get_adapter('https://'))
+    cancel = CancelToken()
+    AbortLater(factory, cancel)
+    start = time.monotonic()
+    try:
+        with pytest.raises(SyncCancelled):
+            factory.Download('file', io.BytesIO(), cancel=cancel)
+    finally:
+        factory.Close()
+    assert time.monotonic() - start < 2
+
+def test_abort_through_the_gate(server, factory):
+    url = GoSyncDriveClient.MEDIA_URI % 'hang'
+    cancel = CancelToken()
+    gate = RequestGate(base_delay=0.001)
+    AbortLater(factory, cancel)
+    start = time.monotonic()
+    with pytest.raises(SyncCancelled):
+        gate.Execute(lambda: factory.http.request(url), cancel=cancel)
+    assert time.monotonic() - start < 2
+    assert gate.GetStats()['retried'] == 0
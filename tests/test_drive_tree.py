@@ -0,0 +1,248 @@
+# gosync is an open source Google Drive(TM) sync application for Linux
+#
+# Copyright (C) 2015 Himanshu Chauhan
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+
+import os, pickle
+import pytest
+
+from GoSync import GoSyncDriveTree
+from GoSync.GoSyncDriveTree import (GoogleDriveTree, BuildDriveTree, FOLDER_MIME_TYPE,
+                                     CHANGE_ADD, CHANGE_UPDATE, CHANGE_MOVE, CHANGE_DELETE)
+
+PDF = {'mimeType': 'application/pdf', 'size': '1234',
+       'md5Checksum': '0123456789abcdef0123456789abcdef'}
+
+def MakeTree():
+    # root/
+    #   a/
+    #     b/
+    #       doc.pdf
+    #     notes.txt
+    tree = GoogleDriveTree()
+    tree.AddFolder('root', 'a', 'a', None)
+    tree.AddFolder('a', 'b', 'b', None)
+    tree.AddFile('b', 'doc', 'doc.pdf', PDF)
+    tree.AddFile('a', 'notes', 'notes.txt', {'mimeType': 'text/plain', 'size': '10'})
+    return tree
+
+def test_nodes_have_no_instance_dict():
+    tree = MakeTree()
+    assert not hasattr(tree.FindFile('doc'), '__dict__')
+    assert not hasattr(tree.FindFolder('a'), '__dict__')
+
+def test_file_metadata_round_trip():
+    node = MakeTree().FindFile('doc')
+    assert node.GetMimeType() == 'application/pdf'
+    assert node.GetSize() == 1234
+    assert node.GetMD5() == PDF['md5Checksum']
+    assert node.GetData() == dict(PDF, id='doc', name='doc.pdf', parents=['b'])
+
+def test_bad_md5_is_dropped():
+    tree = GoogleDriveTree()
+    node = tree.AddFile('root', 'f', 'f', {'md5Checksum': 'not hex'})
+    assert node.GetMD5() is None
+    assert node.GetSize() == 0
+
+def test_add_and_find():
+    tree = MakeTree()
+    assert tree.FindFolder('b').GetParentId() == 'a'
+    assert tree.FindFile('doc').GetPath() == os.path.join('a', 'b', 'doc.pdf')
+    assert tree.FindFileByPath(os.path.join('a', 'b', 'doc.pdf')).GetId() == 'doc'
+    assert tree.FindFolderByPath(os.path.join('a', 'b')).GetId() == 'b'
+    # A path to a file is not a folder, and the other way round
+    assert tree.FindFolderByPath(os.path.join('a', 'notes.txt')) is None
+    assert tree.FindFileByPath('a') is None
+    assert tree.FindFileByPath(os.path.join('a', 'missing')) is None
+
+def test_add_known_id_updates_metadata_only():
+    tree = MakeTree()
+    assert tree.AddFile('root', 'doc', 'other name', {'size': '5'}) is None
+    node = tree.FindFile('doc')
+    assert node.GetName() == 'doc.pdf'
+    assert node.GetSize() == 5
+    assert tree.AddFolder('root', 'a', 'a', None) is None
+
+def test_lookups_below_parent():
+    tree = MakeTree()
+    a = tree.FindFolder('a')
+    b = tree.FindFolder('b')
+    assert tree.FindFolderInParent(a, 'b') is b
+    assert tree.FindFolderInParent(b, 'a') is None
+    assert tree.FindFileByPath(os.path.join('a', 'b', 'doc.pdf'), b).GetId() == 'doc'
+    assert tree.FindFileByPath(os.path.join('a', 'notes.txt'), b) is None
+    assert tree.HasAncestorIn('doc', {'a'})
+    assert not tree.HasAncestorIn('notes', {'b'})
+
+def test_duplicate_names():
+    tree = GoogleDriveTree()
+    tree.AddFile('root', 'f1', 'same', None)
+    tree.AddFolder('root', 'd1', 'same', None)
+    assert tree.FindFileByPath('same').GetId() == 'f1'
+    assert tree.FindFolderByPath('same').GetId() == 'd1'
+
+def test_move_and_rename():
+    tree = MakeTree()
+    tree.MoveNode('b', 'root', 'c')
+    assert tree.FindFolder('b').GetPath() == 'c'
+    # Paths cached below the moved folder are dropped as well
+    assert tree.FindFile('doc').GetPath() == os.path.join('c', 'doc.pdf')
+    assert tree.FindFileByPath(os.path.join('c', 'doc.pdf')).GetId() == 'doc'
+    assert tree.FindFolderByPath(os.path.join('a', 'b')) is None
+
+def test_move_below_itself_fails():
+    tree = MakeTree()
+    with pytest.raises(NameError):
+        tree.MoveNode('a', 'b')
+    with pytest.raises(NameError):
+        tree.MoveNode('missing', 'root')
+
+def test_delete_folder():
+    tree = MakeTree()
+    deleted = []
+    removed = tree.DeleteFolder('a', lambda f: deleted.append(f.GetId()))
+    assert sorted(removed) == ['a', 'b', 'doc', 'notes']
+    # Children go before their parent
+    assert deleted == ['b', 'a']
+    assert tree.FindFolder('a') is None
+    assert tree.FindFile('doc') is None
+    assert tree.GetAllNodes() == []
+    with pytest.raises(NameError):
+        tree.DeleteFolder('a')
+    with pytest.raises(NameError):
+        tree.DeleteFolder('root')
+
+def test_get_all_nodes_parents_first():
+    order = [n.GetId() for n in MakeTree().GetAllNodes()]
+    assert sorted(order) == ['a', 'b', 'doc', 'notes']
+    assert order.index('a') < order.index('b') < order.index('doc')
+
+def test_pickle_round_trip():
+    tree = pickle.loads(pickle.dumps(MakeTree()))
+    assert tree.FindFile('doc').GetMD5() == PDF['md5Checksum']
+    assert tree.FindFileByPath(os.path.join('a', 'b', 'doc.pdf')).GetId() == 'doc'
+    tree.AddFile('b', 'new', 'new', None)
+    assert tree.FindFile('new').GetParentId() == 'b'
+
+def SnapshotPaths(snapshot):
+    paths = []
+    stack = [snapshot.GetRoot()]
+    while stack:
+        folder = stack.pop()
+        paths.append(folder.GetPath())
+        stack.extend(folder.GetChildren())
+    return sorted(paths)
+
+def test_snapshot_has_folders_only():
+    snapshot = MakeTree().GetDirectorySnapshot()
+    assert SnapshotPaths(snapshot) == ['', 'a', os.path.join('a', 'b')]
+
+def test_snapshot_shares_unchanged_folders():
+    tree = MakeTree()
+    tree.AddFolder('root', 'c', 'c', None)
+    first = tree.GetDirectorySnapshot()
+    assert tree.GetDirectorySnapshot().GetRoot() is first.GetRoot()
+
+    tree.AddFolder('b', 'd', 'd', None)
+    second = tree.GetDirectorySnapshot()
+    old = dict((f.GetId(), f) for f in first.GetRoot().GetChildren())
+    new = dict((f.GetId(), f) for f in second.GetRoot().GetChildren())
+    assert new['c'] is old['c']
+    assert new['a'] is not old['a']
+    # The old snapshot is left as it was
+    assert SnapshotPaths(first) == ['', 'a', os.path.join('a', 'b'), 'c']
+    assert os.path.join('a', 'b', 'd') in SnapshotPaths(second)
+
+def test_snapshot_follows_moves_and_deletes():
+    tree = MakeTree()
+    tree.GetDirectorySnapshot()
+    tree.MoveNode('b', 'root', 'c')
+    assert SnapshotPaths(tree.GetDirectorySnapshot()) == ['', 'a', 'c']
+    tree.DeleteFolder('a')
+    assert SnapshotPaths(tree.GetDirectorySnapshot()) == ['', 'c']
+
+def test_adding_a_file_keeps_the_snapshot():
+    tree = MakeTree()
+    first = tree.GetDirectorySnapshot()
+    tree.AddFile('b', 'new', 'new.txt', None)
+    assert tree.GetDirectorySnapshot().GetRoot() is first.GetRoot()
+
+def test_change_log():
+    tree = MakeTree()
+    start = tree.GetGeneration()
+    assert start == 4
+    assert tree.ChangesSince(start) == []
+
+    tree.AddFile('root', 'doc', 'doc.pdf', {'size': '1'})
+    # A known ID with no data changes nothing
+    tree.AddFile('root', 'doc', 'doc.pdf', None)
+    tree.MoveNode('notes', 'b')
+    tree.DeleteFolder('b')
+    changes = tree.ChangesSince(start)
+    assert [c[0] for c in changes] == list(range(start + 1, tree.GetGeneration() + 1))
+    assert [(kind, fid) for _, kind, fid in changes[:2]] == [(CHANGE_UPDATE, 'doc'),
+                                                             (CHANGE_MOVE, 'notes')]
+    assert sorted(fid for _, kind, fid in changes[2:]) == ['b', 'doc', 'notes']
+    assert all(kind == CHANGE_DELETE for _, kind, _ in changes[2:])
+    assert tree.ChangesSince(start + 1) == changes[1:]
+
+def test_change_log_from_the_start():
+    tree = MakeTree()
+    assert [(kind, fid) for _, kind, fid in tree.ChangesSince(0)] == [
+        (CHANGE_ADD, 'a'), (CHANGE_ADD, 'b'), (CHANGE_ADD, 'doc'), (CHANGE_ADD, 'notes')]
+
+def test_change_log_out_of_reach(monkeypatch):
+    monkeypatch.setattr(GoSyncDriveTree, 'CHANGE_LOG_SIZE', 3)
+    tree = MakeTree()
+    # Only the last three changes are kept
+    assert tree.ChangesSince(0) is None
+    assert len(tree.ChangesSince(1)) == 3
+    # A generation the tree hasn't reached belongs to another tree
+    assert tree.ChangesSince(tree.GetGeneration() + 1) is None
+
+def test_unpickled_tree_starts_a_new_log():
+    tree = pickle.loads(pickle.dumps(MakeTree()))
+    assert tree.GetGeneration() == 0
+    assert tree.ChangesSince(0) == []
+
+def Item(fid, name, parents, folder=False):
+    item = {'id': fid, 'name': name, 'mimeType': FOLDER_MIME_TYPE if folder else 'text/plain'}
+    if parents is not None:
+        item['parents'] = parents
+    return item
+
+def test_build_from_flat_listing():
+    # Children listed before their parents, as files().list may do
+    files = [Item('doc', 'doc.txt', ['b']),
+             Item('b', 'b', ['a'], True),
+             Item('a', 'a', ['MYROOT'], True),
+             Item('top', 'top.txt', ['MYROOT']),
+             Item('two', 'two.txt', ['a', 'b'])]
+    tree = BuildDriveTree(files, 'MYROOT')
+    assert tree.FindFileByPath(os.path.join('a', 'b', 'doc.txt')).GetId() == 'doc'
+    assert tree.FindFile('top').GetParentId() == 'root'
+    # Only the first parent counts
+    assert tree.FindFile('two').GetParentId() == 'a'
+    assert sorted(n.GetId() for n in tree.GetAllNodes()) == ['a', 'b', 'doc', 'top', 'two']
+
+def test_build_leaves_out_what_is_not_in_my_drive():
+    files = [Item('a', 'a', ['MYROOT'], True),
+             Item('shared', 'shared.txt', None),
+             Item('orphan', 'orphan', ['unlisted'], True),
+             Item('below', 'below.txt', ['orphan'])]
+    tree = BuildDriveTree(files, 'MYROOT')
+    assert [n.GetId() for n in tree.GetAllNodes()] == ['a']
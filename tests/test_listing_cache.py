@@ -0,0 +1,77 @@
+# gosync is an open source Google Drive(TM) sync application for Linux
+#
+# Copyright (C) 2015 Himanshu Chauhan
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+
+from GoSync.GoSyncListingCache import ListingCache
+
+def test_hit_and_miss():
+    cache = ListingCache()
+    assert cache.Get('p', 'x') == (False, None)
+    cache.Put('p', 'x', [{'id': '1'}])
+    assert cache.Get('p', 'x') == (True, [{'id': '1'}])
+    assert (cache.hits, cache.misses) == (1, 1)
+
+def test_negative_entry():
+    cache = ListingCache()
+    cache.Put('p', 'x', [])
+    assert cache.Get('p', 'x') == (True, [])
+
+def test_lru_eviction():
+    cache = ListingCache(max_entries=2)
+    cache.Put('p', 'a', [1])
+    cache.Put('p', 'b', [2])
+    # A hit makes 'a' the newest, 'b' goes first
+    cache.Get('p', 'a')
+    cache.Put('p', 'c', [3])
+    assert cache.Get('p', 'b') == (False, None)
+    assert cache.Get('p', 'a') == (True, [1])
+    assert cache.Get('p', 'c') == (True, [3])
+
+def test_invalidate():
+    cache = ListingCache()
+    cache.Put('p', 'a', [1])
+    cache.Put('q', 'a', [2])
+    cache.GetEntries()
+    cache.Invalidate('p', 'a')
+    assert cache.dirty
+    assert cache.Get('p', 'a') == (False, None)
+    assert cache.Get('q', 'a') == (True, [2])
+
+    cache.GetEntries()
+    cache.Invalidate('p', 'missing')
+    assert not cache.dirty
+
+    cache.Clear()
+    assert cache.Get('q', 'a') == (False, None)
+
+def test_save_and_restore():
+    cache = ListingCache()
+    cache.Put('p', 'a', [1])
+    cache.Put('p', 'none', [])
+    cache.Put('p', 'b', [2])
+    assert cache.dirty
+    entries = cache.GetEntries()
+    assert not cache.dirty
+    # Oldest first, negative entries left out
+    assert entries == [['p', 'a', [1]], ['p', 'b', [2]]]
+
+    restored = ListingCache(max_entries=1)
+    restored.SetEntries(entries)
+    assert restored.Get('p', 'a') == (False, None)
+    assert restored.Get('p', 'b') == (True, [2])
+    assert not restored.dirty
@@ -0,0 +1,232 @@
+# gosync is an open source Google Drive(TM) sync application for Linux
+#
+# Copyright (C) 2015 Himanshu Chauhan
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+
+import os
+import pytest
+
+from GoSync.GoSyncDriveTree import GoogleDriveTree, FOLDER_MIME_TYPE
+from GoSync.GoSyncRemoteChanges import (IsChangeMonitored, ApplyChangeToTree, ApplyRemoteMove,
+                                        LOCAL_MOVED, LOCAL_DELETED)
+
+ROOT_ID = 'MYDRIVE'
+
+def MakeTree():
+    # root/
+    #   top.txt
+    #   sel/        selected
+    #     f1
+    #   other/
+    #     f2
+    #     sub/      selected
+    tree = GoogleDriveTree()
+    tree.AddFile('root', 'top', 'top.txt', None)
+    tree.AddFolder('root', 'sel', 'sel', None)
+    tree.AddFile('sel', 'f1', 'f1', None)
+    tree.AddFolder('root', 'other', 'other', None)
+    tree.AddFile('other', 'f2', 'f2', None)
+    tree.AddFolder('other', 'sub', 'sub', None)
+    return tree
+
+def Selection():
+    return [['sel', 'sel'], [os.path.join('other', 'sub'), 'sub']]
+
+def Change(fid, parent, name=None, folder=False, **kwargs):
+    fdata = {'id': fid, 'name': name or fid, 'parents': [parent],
+             'mimeType': FOLDER_MIME_TYPE if folder else 'text/plain'}
+    fdata.update(kwargs)
+    return {'fileId': fid, 'file': fdata}
+
+def Monitored(change, path=None, tree=None, selection=None):
+    return IsChangeMonitored(tree or MakeTree(), selection or Selection(), ROOT_ID,
+                             change['fileId'], change, path)
+
+# Which changes get synced
+
+def test_everything_is_monitored_without_selection():
+    assert Monitored(Change('f2', 'other'), selection=[['root', '']])
+
+def test_file_in_selected_folder():
+    assert Monitored(Change('f1', 'sel'))
+    assert Monitored(Change('new', 'sel'))
+    # Below a selected folder counts too
+    tree = MakeTree()
+    tree.AddFolder('sel', 'deep', 'deep', None)
+    assert Monitored(Change('new', 'deep'), tree=tree)
+
+def test_file_in_root():
+    assert Monitored(Change('top', ROOT_ID))
+    assert Monitored(Change('new', ROOT_ID))
+
+def test_file_in_unselected_folder():
+    assert not Monitored(Change('f2', 'other'))
+    assert not Monitored(Change('new', 'other'))
+
+def test_file_moved_out_of_the_selection():
+    assert Monitored(Change('f1', 'other'))
+
+def test_file_moved_into_the_selection():
+    assert Monitored(Change('f2', 'sel'))
+
+def test_folder_with_a_selected_folder_below():
+    assert Monitored(Change('other', ROOT_ID, 'renamed', folder=True))
+
+def test_removed_changes():
+    assert Monitored({'fileId': 'f1', 'removed': True})
+    assert not Monitored({'fileId': 'f2', 'removed': True})
+    # Nothing tells where it was
+    assert Monitored({'fileId': 'unknown', 'removed': True})
+
+def test_change_without_a_parent():
+    assert not Monitored({'fileId': 'x', 'file': {'id': 'x', 'name': 'x'}})
+    assert Monitored({'fileId': 'x'})
+
+def test_parent_not_in_the_tree():
+    change = Change('new', 'unknown')
+    # Passed on when it can't be placed
+    assert Monitored(change)
+    assert Monitored(change, '/sel/unknown/new')
+    assert Monitored(change, '/' + os.path.join('other', 'sub', 'unknown', 'new'))
+    assert not Monitored(change, '/other/unknown/new')
+    assert Monitored(change, '/new')
+
+# Changes outside the selection only go into the tree
+
+def test_apply_new_file():
+    tree = MakeTree()
+    ApplyChangeToTree(tree, ROOT_ID, 'new', Change('new', 'other', 'new.txt', size='5'))
+    assert tree.FindFileByPath(os.path.join('other', 'new.txt')).GetSize() == 5
+
+def test_apply_move_and_update():
+    tree = MakeTree()
+    ApplyChangeToTree(tree, ROOT_ID, 'f2', Change('f2', ROOT_ID, 'f2.txt', size='9'))
+    node = tree.FindFile('f2')
+    assert node.GetPath() == 'f2.txt'
+    assert node.GetSize() == 9
+
+def test_apply_removed_and_trashed():
+    tree = MakeTree()
+    ApplyChangeToTree(tree, ROOT_ID, 'f2', {'fileId': 'f2', 'removed': True})
+    assert tree.FindFile('f2') is None
+    ApplyChangeToTree(tree, ROOT_ID, 'other', Change('other', ROOT_ID, folder=True, trashed=True))
+    assert tree.FindFolder('other') is None
+    assert tree.FindFolder('sub') is None
+    # Not in the tree, nothing to do
+    ApplyChangeToTree(tree, ROOT_ID, 'gone', {'fileId': 'gone', 'removed': True})
+
+def test_apply_parent_not_in_the_tree():
+    tree = MakeTree()
+    ApplyChangeToTree(tree, ROOT_ID, 'f2', Change('f2', 'unknown'))
+    assert tree.FindFile('f2') is None
+    ApplyChangeToTree(tree, ROOT_ID, 'new', Change('new', 'unknown'))
+    assert tree.FindFile('new') is None
+
+# Remote moves of synced files
+
+@pytest.fixture
+def mirror(tmp_path):
+    # The local copy of the selection in MakeTree(), with sub/ in it
+    mirror = tmp_path / 'mirror'
+    (mirror / 'sel').mkdir(parents=True)
+    (mirror / 'sel' / 'f1').write_text(u'one')
+    (mirror / 'other' / 'sub').mkdir(parents=True)
+    (mirror / 'other' / 'sub' / 'f3').write_text(u'three')
+    (mirror / 'top.txt').write_text(u'top')
+    return str(mirror)
+
+def Move(tree, selection, mirror, fid, parent, name, new_rel_path):
+    moves = []
+    node = tree.FindFile(fid)
+    moved = ApplyRemoteMove(tree, selection, mirror, ROOT_ID, node,
+                            {'id': fid, 'name': name, 'parents': [parent]},
+                            os.path.join(mirror, new_rel_path),
+                            lambda old, new, done: moves.append((old, new, done)))
+    return moved, moves
+
+def test_not_moved(mirror):
+    tree = MakeTree()
+    assert Move(tree, Selection(), mirror, 'f1', 'sel', 'f1', os.path.join('sel', 'f1')) == (False, [])
+
+def test_rename_in_place(mirror):
+    tree = MakeTree()
+    new = os.path.join('sel', 'f1.txt')
+    moved, moves = Move(tree, Selection(), mirror, 'f1', 'sel', 'f1.txt', new)
+    assert moved
+    assert moves == [(os.path.join('sel', 'f1'), new, LOCAL_MOVED)]
+    assert not os.path.exists(os.path.join(mirror, 'sel', 'f1'))
+    with open(os.path.join(mirror, new)) as f:
+        assert f.read() == 'one'
+    assert tree.FindFileByPath(new).GetId() == 'f1'
+
+def test_move_to_another_folder(mirror):
+    tree = MakeTree()
+    moved, moves = Move(tree, Selection(), mirror, 'top', 'sel', 'top.txt',
+                        os.path.join('sel', 'top.txt'))
+    assert moves[0][2] == LOCAL_MOVED
+    assert os.path.exists(os.path.join(mirror, 'sel', 'top.txt'))
+    assert tree.FindFile('top').GetParentId() == 'sel'
+
+def test_selected_folder_follows_its_move(mirror):
+    tree = MakeTree()
+    selection = Selection()
+    moved, moves = Move(tree, selection, mirror, 'sub', 'sel', 'sub2', os.path.join('sel', 'sub2'))
+    assert moves[0][2] == LOCAL_MOVED
+    assert os.path.exists(os.path.join(mirror, 'sel', 'sub2', 'f3'))
+    assert selection == [['sel', 'sel'], [os.path.join('sel', 'sub2'), 'sub']]
+
+def test_renamed_folder_renames_the_selection_below(mirror):
+    tree = MakeTree()
+    selection = [['other', 'other'], [os.path.join('other', 'sub'), 'sub']]
+    Move(tree, selection, mirror, 'other', ROOT_ID, 'renamed', 'renamed')
+    assert selection == [['renamed', 'other'], [os.path.join('renamed', 'sub'), 'sub']]
+    assert os.path.exists(os.path.join(mirror, 'renamed', 'sub', 'f3'))
+
+def test_move_out_of_the_synced_folders(mirror):
+    tree = MakeTree()
+    # other/ itself isn't synced, there's no such local folder
+    os.rename(os.path.join(mirror, 'other'), os.path.join(mirror, 'elsewhere'))
+    moved, moves = Move(tree, Selection(), mirror, 'f1', 'other', 'f1', os.path.join('other', 'f1'))
+    assert moved
+    assert moves[0][2] == LOCAL_DELETED
+    assert not os.path.exists(os.path.join(mirror, 'sel', 'f1'))
+    assert tree.FindFile('f1').GetParentId() == 'other'
+
+def test_move_to_a_parent_not_in_the_tree(mirror):
+    tree = MakeTree()
+    selection = Selection()
+    moved, moves = Move(tree, selection, mirror, 'sub', 'unknown', 'sub',
+                        os.path.join('unknown', 'sub'))
+    assert moved
+    assert moves[0][2] == LOCAL_DELETED
+    assert not os.path.exists(os.path.join(mirror, 'other', 'sub'))
+    assert tree.FindFolder('sub') is None
+    assert selection == [['sel', 'sel']]
+
+    # Once nothing is selected, the whole drive is
+    Move(tree, selection, mirror, 'sel', 'unknown', 'sel', os.path.join('unknown', 'sel'))
+    assert selection == [['root', '']]
+
+def test_something_in_the_way(mirror):
+    tree = MakeTree()
+    moved, moves = Move(tree, Selection(), mirror, 'f1', ROOT_ID, 'top.txt', 'top.txt')
+    assert moved
+    assert moves[0][2] is None
+    # Both local files are left alone
+    with open(os.path.join(mirror, 'top.txt')) as f:
+        assert f.read() == 'top'
+    assert os.path.exists(os.path.join(mirror, 'sel', 'f1'))
@@ -0,0 +1,151 @@
+# gosync is an open source Google Drive(TM) sync application for Linux
+#
+# Copyright (C) 2015 Himanshu Chauhan
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+
+import threading, time
+from email.utils import formatdate
+import httplib2
+import pytest
+from googleapiclient.errors import HttpError
+
+from GoSync.GoSyncCancel import CancelToken, SyncCancelled
+from GoSync.GoSyncRequestGate import (RequestGate, IsRateLimited, IsNetworkError,
+                                      IsTransient, RetryAfter)
+
+RATE_LIMITED = b'{"error": {"errors": [{"reason": "userRateLimitExceeded"}]}}'
+FORBIDDEN = b'{"error": {"errors": [{"reason": "insufficientFilePermissions"}]}}'
+
+def Error(status, content=b'', **headers):
+    info = dict((k.replace('_', '-'), v) for k, v in headers.items())
+    info['status'] = status
+    return HttpError(httplib2.Response(info), content)
+
+class Flaky(object):
+    def __init__(self, errors):
+        self.errors = list(errors)
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return 'done'
+
+def test_error_kinds():
+    assert IsRateLimited(Error(429))
+    assert IsRateLimited(Error(403, RATE_LIMITED))
+    assert not IsRateLimited(Error(403, FORBIDDEN))
+    assert IsTransient(Error(503))
+    assert IsTransient(Error(403, RATE_LIMITED))
+    assert not IsTransient(Error(403, FORBIDDEN))
+    assert not IsTransient(Error(404))
+    assert IsNetworkError(ConnectionResetError())
+    assert IsTransient(ConnectionResetError())
+    assert not IsTransient(httplib2.ServerNotFoundError())
+    assert not IsTransient(ValueError())
+
+def test_retry_after():
+    assert RetryAfter(Error(429, retry_after='7')) == 7
+    assert RetryAfter(Error(429)) is None
+    assert RetryAfter(Error(429, retry_after='soon')) is None
+    assert RetryAfter(ValueError()) is None
+    date = formatdate(time.time() + 30, usegmt=True)
+    assert 25 < RetryAfter(Error(503, retry_after=date)) <= 30
+
+def test_backoff_delay():
+    gate = RequestGate(base_delay=1, max_delay=8)
+    for attempt in range(6):
+        assert 0 <= gate.BackoffDelay(attempt) <= min(8, 2 ** attempt)
+
+def test_retry_delay():
+    gate = RequestGate(max_retries=2, base_delay=0.001)
+    assert gate.RetryDelay(Error(503), 0) < 0.01
+    assert gate.RetryDelay(Error(503), 2) is None
+    assert gate.RetryDelay(Error(404), 0) is None
+    # The server asked for longer than the backoff
+    assert gate.RetryDelay(Error(503, retry_after='5'), 0) == 5
+
+def test_transient_errors_are_retried():
+    gate = RequestGate(base_delay=0.001)
+    call = Flaky([Error(500), ConnectionResetError()])
+    assert gate.Execute(call) == 'done'
+    assert call.calls == 3
+    assert gate.GetStats() == {'calls': 3, 'throttled': 0, 'retried': 2, 'failed': 0}
+
+def test_permanent_error_is_raised_at_once():
+    gate = RequestGate(base_delay=0.001)
+    call = Flaky([Error(403, FORBIDDEN), Error(500)])
+    with pytest.raises(HttpError):
+        gate.Execute(call)
+    assert call.calls == 1
+    assert gate.GetStats()['failed'] == 1
+
+def test_retries_run_out():
+    gate = RequestGate(max_retries=2, base_delay=0.001)
+    call = Flaky([Error(503)] * 5)
+    with pytest.raises(HttpError):
+        gate.Execute(call)
+    assert call.calls == 3
+
+def test_rate_limit_pauses_the_gate():
+    gate = RequestGate(base_delay=0.001)
+    call = Flaky([Error(429, retry_after='0.3')])
+    start = time.monotonic()
+    assert gate.Execute(call) == 'done'
+    assert time.monotonic() - start >= 0.3
+    # Everyone else is held back too
+    gate.Pause(0.2)
+    start = time.monotonic()
+    gate.Execute(lambda: None)
+    assert time.monotonic() - start >= 0.2
+    assert gate.GetStats()['throttled'] == 2
+
+def test_token_bucket():
+    gate = RequestGate(rate=20, burst=2)
+    start = time.monotonic()
+    for _ in range(6):
+        gate.Acquire()
+    # Two from the bucket, four at 20 a second
+    assert time.monotonic() - start >= 0.15
+    assert gate.GetStats()['throttled'] == 4
+
+def test_cancel():
+    gate = RequestGate()
+    cancel = CancelToken()
+    gate.Pause(30)
+    threading.Timer(0.1, cancel.Cancel).start()
+    start = time.monotonic()
+    with pytest.raises(SyncCancelled):
+        gate.Execute(lambda: None, cancel=cancel)
+    assert time.monotonic() - start < 5
+
+    call = Flaky([])
+    with pytest.raises(SyncCancelled):
+        RequestGate().Execute(call, cancel=cancel)
+    assert call.calls == 0
+
+def test_backoff_is_cancelled():
+    gate = RequestGate(base_delay=30, max_delay=30)
+    cancel = CancelToken()
+    call = Flaky([Error(503, retry_after='30')])
+    threading.Timer(0.1, cancel.Cancel).start()
+    start = time.monotonic()
+    with pytest.raises(SyncCancelled):
+        gate.Execute(call, cancel=cancel)
+    assert time.monotonic() - start < 5
+    assert call.calls == 1
@@ -0,0 +1,81 @@
+# gosync is an open source Google Drive(TM) sync application for Linux
+#
+# Copyright (C) 2015 Himanshu Chauhan
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+
+from GoSync.GoSyncDriveTree import GoogleDriveTree
+from GoSync.GoSyncSearchIndex import SearchIndex
+
+def MakeTree():
+    tree = GoogleDriveTree()
+    tree.AddFolder('root', 'photos', 'Photos', None)
+    tree.AddFolder('photos', 'holiday', 'Holiday 2019', None)
+    tree.AddFile('holiday', 'beach', 'Beach.JPG', None)
+    tree.AddFile('holiday', 'report', 'holiday report.pdf', None)
+    tree.AddFile('root', 'notes', 'notes about photos.txt', None)
+    return tree
+
+def Ids(nodes):
+    return sorted(n.GetId() for n in nodes)
+
+def test_substring_search():
+    index = SearchIndex(MakeTree())
+    assert Ids(index.Search('photo')) == ['notes', 'photos']
+    assert Ids(index.Search('HOLIDAY')) == ['holiday', 'report']
+    assert Ids(index.Search('.jpg')) == ['beach']
+    assert index.Search('nothing') == []
+
+def test_prefix_search():
+    index = SearchIndex(MakeTree())
+    assert Ids(index.Search('photo', prefix=True)) == ['photos']
+    assert Ids(index.Search('holiday', prefix=True)) == ['holiday', 'report']
+    assert index.Search('report', prefix=True) == []
+
+def test_folders_only_and_limit():
+    index = SearchIndex(MakeTree())
+    assert Ids(index.Search('holiday', folders_only=True)) == ['holiday']
+    assert len(index.Search('o', limit=2)) == 2
+
+def test_bad_queries():
+    index = SearchIndex(MakeTree())
+    assert index.Search('') == []
+    assert index.Search('a\0b') == []
+
+def test_follows_tree_changes():
+    tree = MakeTree()
+    index = SearchIndex(tree)
+    index.Search('x')
+    tree.AddFile('root', 'new', 'Photo album.zip', None)
+    tree.MoveNode('beach', 'photos', 'sand.jpg')
+    tree.DeleteFolder('holiday')
+    assert Ids(index.Search('photo', prefix=True)) == ['new', 'photos']
+    assert Ids(index.Search('sand')) == ['beach']
+    assert index.Search('beach') == []
+    assert index.Search('holiday') == []
+
+def test_rebuild_after_many_changes():
+    tree = MakeTree()
+    index = SearchIndex(tree)
+    index.REBUILD_AFTER = 2
+    index.Search('x')
+    tree.AddFile('root', 'n1', 'new one', None)
+    tree.AddFile('root', 'n2', 'new two', None)
+    tree.AddFile('root', 'n3', 'new three', None)
+    assert Ids(index.Search('new')) == ['n1', 'n2', 'n3']
+    # Rebuilt, nothing is left on the side
+    assert index.recent == {}
+    assert index.stale == set()
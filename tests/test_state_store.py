@@ -0,0 +1,139 @@
+# gosync is an open source Google Drive(TM) sync application for Linux
+#
+# Copyright (C) 2015 Himanshu Chauhan
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+
+import os, sqlite3
+import pytest
+
+from GoSync.GoSyncDriveTree import GoogleDriveTree
+from GoSync.GoSyncStateStore import StateStore, StateStoreFailed
+
+MD5 = '0123456789abcdef0123456789abcdef'
+
+def MakeTree():
+    tree = GoogleDriveTree()
+    tree.AddFolder('root', 'a', 'a', None)
+    tree.AddFolder('a', 'b', 'b', None)
+    tree.AddFile('b', 'doc', 'doc.pdf', {'mimeType': 'application/pdf', 'size': '1234',
+                                         'md5Checksum': MD5})
+    tree.AddFile('root', 'top', 'top.txt', {'mimeType': 'text/plain', 'size': '1'})
+    return tree
+
+def Rows(path):
+    db = sqlite3.connect(path)
+    try:
+        return dict((row[0], row[1:]) for row in db.execute("SELECT * FROM nodes"))
+    finally:
+        db.close()
+
+@pytest.fixture
+def db_path(tmp_path):
+    return str(tmp_path / 'state.db')
+
+def test_round_trip(db_path):
+    store = StateStore(db_path)
+    assert not store.HasTree()
+    store.Save(MakeTree(), {'page_token': '42', 'selection': ['a', 'b']})
+    store.Close()
+
+    store = StateStore(db_path)
+    assert store.HasTree()
+    assert store.GetValue('page_token') == '42'
+    assert store.GetValue('selection') == ['a', 'b']
+    assert store.GetValue('missing', 'default') == 'default'
+
+    tree = store.LoadTree()
+    doc = tree.FindFileByPath(os.path.join('a', 'b', 'doc.pdf'))
+    assert doc.GetId() == 'doc'
+    assert doc.GetMimeType() == 'application/pdf'
+    assert doc.GetSize() == 1234
+    assert doc.GetMD5() == MD5
+    assert tree.FindFile('top').GetMD5() is None
+    assert sorted(n.GetId() for n in tree.GetAllNodes()) == ['a', 'b', 'doc', 'top']
+    store.Close()
+
+def test_incremental_save(db_path):
+    store = StateStore(db_path)
+    tree = MakeTree()
+    store.Save(tree)
+
+    # Rows the store doesn't know about survive an incremental save,
+    # and are gone after a full one.
+    db = sqlite3.connect(db_path)
+    db.execute("INSERT INTO nodes VALUES ('marker', 'root', 'm', 0, NULL, NULL, NULL)")
+    db.commit()
+    db.close()
+
+    tree.AddFile('a', 'new', 'new.txt', None)
+    tree.DeleteFolder('a')
+    tree.AddFolder('root', 'c', 'c', None)
+    tree.MoveNode('top', 'c', 'moved.txt')
+    store.Save(tree)
+    rows = Rows(db_path)
+    assert sorted(rows) == ['c', 'marker', 'top']
+    assert rows['top'][:2] == ('c', 'moved.txt')
+
+    store.Save(MakeTree())
+    assert sorted(Rows(db_path)) == ['a', 'b', 'doc', 'top']
+    store.Close()
+
+def test_save_without_changes_keeps_values(db_path):
+    store = StateStore(db_path)
+    tree = MakeTree()
+    store.Save(tree, {'page_token': '1'})
+    store.Save(tree, {'page_token': '2'})
+    assert store.GetValue('page_token') == '2'
+    assert sorted(Rows(db_path)) == ['a', 'b', 'doc', 'top']
+    store.Close()
+
+def test_loaded_tree_saves_incrementally(db_path):
+    store = StateStore(db_path)
+    store.Save(MakeTree())
+    store.Close()
+
+    store = StateStore(db_path)
+    tree = store.LoadTree()
+    tree.AddFile('root', 'new', 'new.txt', None)
+    store.Save(tree)
+    store.Close()
+    assert sorted(Rows(db_path)) == ['a', 'b', 'doc', 'new', 'top']
+
+def test_read_only(db_path):
+    store = StateStore(db_path)
+    store.Save(MakeTree(), {'page_token': '7'})
+    store.Close()
+
+    reader = StateStore(db_path, read_only=True)
+    assert reader.GetValue('page_token') == '7'
+    assert reader.LoadTree().FindFile('doc') is not None
+    with pytest.raises(StateStoreFailed):
+        reader.Save(None, {'page_token': '8'})
+    reader.Close()
+
+def test_read_only_needs_a_database(tmp_path):
+    with pytest.raises(StateStoreFailed):
+        StateStore(str(tmp_path / 'missing.db'), read_only=True)
+    assert not os.path.exists(str(tmp_path / 'missing.db'))
+
+def test_read_only_without_schema(tmp_path):
+    path = str(tmp_path / 'empty.db')
+    sqlite3.connect(path).close()
+    reader = StateStore(path, read_only=True)
+    with pytest.raises(StateStoreFailed):
+        reader.LoadTree()
+    reader.Close()
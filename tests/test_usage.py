@@ -0,0 +1,101 @@
+# gosync is an open source Google Drive(TM) sync application for Linux
+#
+# Copyright (C) 2015 Himanshu Chauhan
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+
+from GoSync.GoSyncDriveTree import GoogleDriveTree, FOLDER_MIME_TYPE
+from GoSync.GoSyncUsage import (UsageSnapshot, MimeCategory, CATEGORY_FOLDER,
+                                CATEGORY_GOOGLE_DOC, CATEGORY_AUDIO, CATEGORY_PHOTO,
+                                CATEGORY_MOVIES, CATEGORY_DOCUMENT, CATEGORY_OTHERS)
+
+def File(mime, size):
+    return {'mimeType': mime, 'size': str(size)}
+
+def MakeTree():
+    # root/         song.mp3 (100)
+    #   a/          photo.png (20)
+    #     b/        film.mp4 (300), report.pdf (4)
+    #   c/          (empty)
+    tree = GoogleDriveTree()
+    tree.AddFile('root', 'song', 'song.mp3', File('audio/mpeg', 100))
+    tree.AddFolder('root', 'a', 'a', None)
+    tree.AddFolder('root', 'c', 'c', None)
+    tree.AddFile('a', 'photo', 'photo.png', File('image/png', 20))
+    tree.AddFolder('a', 'b', 'b', None)
+    tree.AddFile('b', 'film', 'film.mp4', File('video/mp4', 300))
+    tree.AddFile('b', 'report', 'report.pdf', File('application/pdf', 4))
+    tree.AddFile('b', 'sheet', 'sheet', {'mimeType': 'application/vnd.google-apps.spreadsheet'})
+    return tree
+
+def test_mime_category():
+    assert MimeCategory(FOLDER_MIME_TYPE) == CATEGORY_FOLDER
+    assert MimeCategory('application/vnd.google-apps.document') == CATEGORY_GOOGLE_DOC
+    assert MimeCategory('audio/flac') == CATEGORY_AUDIO
+    assert MimeCategory('image/jpeg') == CATEGORY_PHOTO
+    assert MimeCategory('video/quicktime') == CATEGORY_MOVIES
+    assert MimeCategory('application/pdf') == CATEGORY_DOCUMENT
+    assert MimeCategory('application/vnd.openxmlformats-officedocument.wordprocessingml.document') == CATEGORY_DOCUMENT
+    assert MimeCategory('application/zip') == CATEGORY_OTHERS
+
+def test_snapshot_layout():
+    snapshot = UsageSnapshot(MakeTree())
+    assert len(snapshot) == 9
+    assert snapshot.ids[0] == 'root'
+    assert snapshot.parent[0] == -1
+    # Parents come before their children
+    for i in range(1, len(snapshot)):
+        assert snapshot.parent[i] < i
+        assert snapshot.depth[i] == snapshot.depth[snapshot.parent[i]] + 1
+
+def test_category_totals():
+    totals = UsageSnapshot(MakeTree()).CategoryTotals()
+    assert list(totals) == [0, 0, 100, 20, 300, 4, 0]
+
+def test_folder_sizes():
+    snapshot = UsageSnapshot(MakeTree())
+    sizes = snapshot.FolderSizes()
+    assert sizes[snapshot.IndexOf('root')] == 424
+    assert sizes[snapshot.IndexOf('a')] == 324
+    assert sizes[snapshot.IndexOf('b')] == 304
+    assert sizes[snapshot.IndexOf('c')] == 0
+    assert sizes[snapshot.IndexOf('film')] == 300
+
+def test_largest_files():
+    snapshot = UsageSnapshot(MakeTree())
+    assert snapshot.LargestFiles(2) == [('film', 300), ('song', 100)]
+    # Folders are never listed, however many are asked for
+    assert [fid for fid, _ in snapshot.LargestFiles(100)] == ['film', 'song', 'photo', 'report', 'sheet']
+    assert snapshot.LargestFiles(0) == []
+
+def test_selection_bytes():
+    snapshot = UsageSnapshot(MakeTree())
+    assert snapshot.SelectionBytes(['a', 'b', 'gone']) == {'a': 324, 'b': 304, 'gone': 0}
+
+def test_snapshot_is_a_copy():
+    tree = MakeTree()
+    snapshot = UsageSnapshot(tree)
+    generation = snapshot.generation
+    tree.AddFile('c', 'big', 'big.bin', File('application/octet-stream', 1000))
+    assert snapshot.generation == generation < tree.GetGeneration()
+    assert snapshot.FolderSizes()[0] == 424
+    assert UsageSnapshot(tree).FolderSizes()[0] == 1424
+
+def test_empty_tree():
+    snapshot = UsageSnapshot(GoogleDriveTree())
+    assert len(snapshot) == 1
+    assert list(snapshot.FolderSizes()) == [0]
+    assert snapshot.LargestFiles(5) == []